@@ -1,9 +1,9 @@
 from django.contrib import admin
-from models import TabaUser, Announcement
+from models import TabaUser, Announcement, MailBatch, QueuedMessage
 from django.template import loader, RequestContext
 from django.contrib.admin import helpers
 from django.http import HttpResponse
-from django.core.mail import send_mass_mail
+from mailqueue import enqueue_mass_mail, retry_failed
 import csv
 
 
@@ -29,8 +29,9 @@ class TabaUserAdmin(admin.ModelAdmin):
         """
         return_url = "/admin/paleoschema/paleocoreuser/"
         if 'apply' in request.POST: # check if the email form has been completed
-            # code to send emails. We use send_mass_email, which requires a four-part tuple
-            # containing the subject, message, from_address and a list of to addresses.
+            # code to queue emails. enqueue_mass_mail takes the same four-part tuples as send_mass_mail,
+            # containing the subject, message, from_address and a list of to addresses. The messages are
+            # sent in the background by the send_queued_mail management command.
             if 'subject' in request.POST:
                 if request.POST["subject"] == '':
                     self.message_user(request, "Message is missing a subject")
@@ -56,9 +57,9 @@ class TabaUserAdmin(admin.ModelAdmin):
                     messages_list.append(message_tuple)
             #slice off the first element of tuple which is empty
             messages_tuple = tuple(messages_list)
-            send_mass_mail(messages_tuple,fail_silently=False)
+            batch = enqueue_mass_mail(messages_tuple)
 
-            self.message_user(request, "Mail sent successfully ")
+            self.message_user(request, "%s messages queued for sending" % batch.total_count)
         else:
             t = loader.get_template("base/templates/email.html")
             c = RequestContext(request, {'return_url':return_url, 'emails': queryset,
@@ -73,6 +74,34 @@ class AnnouncementAdmin(admin.ModelAdmin):
     search_fields = ['title', 'short_title', 'body']
 
 
+class QueuedMessageInline(admin.TabularInline):
+    model = QueuedMessage
+    fields = ('recipients', 'status', 'attempts', 'last_error', 'sent')
+    readonly_fields = fields
+    extra = 0
+    can_delete = False
+
+
+class MailBatchAdmin(admin.ModelAdmin):
+    list_display = ('subject', 'created', 'total_count', 'sent_count', 'failed_count', 'progress')
+    readonly_fields = ('subject', 'created', 'total_count', 'sent_count', 'failed_count')
+    inlines = [QueuedMessageInline, ]
+
+
+class QueuedMessageAdmin(admin.ModelAdmin):
+    list_display = ('id', 'recipients', 'subject', 'status', 'attempts', 'created', 'claimed', 'sent')
+    list_filter = ['status', 'batch']
+    search_fields = ['recipients', 'subject']
+    actions = ['retry_messages']
+
+    def retry_messages(self, request, queryset):
+        count = retry_failed(queryset)
+        self.message_user(request, "%s failed messages queued for retry" % count)
+    retry_messages.short_description = "Retry selected failed messages"
+
+
 # Register your models here.
 admin.site.register(Announcement, AnnouncementAdmin)
 admin.site.register(TabaUser, TabaUserAdmin)
+admin.site.register(MailBatch, MailBatchAdmin)
+admin.site.register(QueuedMessage, QueuedMessageAdmin)
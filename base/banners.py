@@ -0,0 +1,136 @@
+"""
+Responsive variants of the home page banner images. generate_banner_variants resizes each banner to the
+BANNER_VARIANT_WIDTHS narrower than it with the easy_thumbnails processors, saves every size as progressive JPEG
+and, where PIL can save it, as WebP, and the full size as WebP, in the variants directory next to the banners, and
+writes a manifest of them that the banner template tags read to emit srcset. Variants that are not smaller than
+the banner itself are dropped, the banner is the full size candidate of both srcsets. Only new and changed
+banners are processed, and the variants of removed banners are deleted. The generate_banner_variants command
+runs it, and so does collectstatic before it collects the banners with their variants.
+"""
+from django.conf import settings
+from easy_thumbnails.engine import process_image
+from easy_thumbnails.utils import exif_orientation
+from PIL import Image
+import hashlib
+import json
+import logging
+import os
+
+# the banner shows 500 pixels wide, 1000 on high density screens
+DEFAULT_BANNER_VARIANT_WIDTHS = (320, 500, 750, 1000)
+BANNER_VARIANTS_DIR = 'variants'
+BANNER_VARIANTS_MANIFEST = 'manifest.json'
+logger = logging.getLogger(__name__)
+
+# file extension, PIL format and save options of each variant format
+BANNER_VARIANT_FORMATS = (
+    ('jpg', 'JPEG', {'quality': 80, 'progressive': True, 'optimize': True}),
+    ('webp', 'WEBP', {'quality': 80}),
+)
+
+
+def file_digest(file_path):
+    with open(file_path, 'rb') as image_file:
+        return hashlib.md5(image_file.read()).hexdigest()
+
+
+def saved_variant_formats():
+    """
+    Return the extensions of the variant formats this PIL build can save, e.g. without WebP when Pillow was built
+    without libwebp.
+    """
+    Image.init()
+    return [extension for extension, image_format, options in BANNER_VARIANT_FORMATS if image_format in Image.SAVE]
+
+
+def variant_manifest_path(images_path):
+    return os.path.join(images_path, BANNER_VARIANTS_DIR, BANNER_VARIANTS_MANIFEST)
+
+
+def read_variant_manifest(images_path):
+    """
+    Return the variant manifest of the banner directory, by banner name, or an empty one if none was generated.
+    """
+    try:
+        with open(variant_manifest_path(images_path)) as manifest_file:
+            return json.load(manifest_file)
+    except (IOError, ValueError):
+        return {}
+
+
+def variant_is_current(images_path, entry, digest, formats):
+    return entry is not None and entry['digest'] == digest and entry.get('formats') == formats and all(
+        os.path.exists(os.path.join(images_path, BANNER_VARIANTS_DIR, variant['file']))
+        for variants in entry['variants'].values() for variant in variants)
+
+
+def make_variants(images_path, name, digest, widths, formats):
+    """
+    Save the variants of one banner in the formats, by extension, and return its manifest entry.
+    """
+    source_size = os.path.getsize(os.path.join(images_path, name))
+    source = Image.open(os.path.join(images_path, name))
+    source = exif_orientation(source)
+    stem = os.path.splitext(name)[0]
+    entry = {'digest': digest, 'width': source.size[0], 'height': source.size[1], 'formats': formats,
+             'variants': dict((extension, []) for extension, image_format, options in BANNER_VARIANT_FORMATS)}
+    for width in sorted(set([w for w in widths if w < source.size[0]] + [source.size[0]])):
+        image = process_image(source, {'size': (width, 0)})
+        for extension, image_format, options in BANNER_VARIANT_FORMATS:
+            if extension not in formats or extension == 'jpg' and width == source.size[0]:
+                continue  # the banner itself
+            # the digest in the file name busts caches when the banner changes
+            variant_name = '%s-%sw.%s.%s' % (stem, width, digest[:12], extension)
+            variant_path = os.path.join(images_path, BANNER_VARIANTS_DIR, variant_name)
+            with open(variant_path, 'wb') as variant_file:
+                if image_format == 'JPEG' and image.mode not in ('RGB', 'L'):
+                    image.convert('RGB').save(variant_file, format=image_format, **options)
+                else:
+                    image.save(variant_file, format=image_format, **options)
+            if os.path.getsize(variant_path) >= source_size:  # e.g. of a banner that is already small
+                os.remove(variant_path)
+                continue
+            entry['variants'][extension].append({'file': variant_name, 'width': image.size[0],
+                                                 'height': image.size[1]})
+    return entry
+
+
+def generate_banner_variants(images_path, widths=None, force=False):
+    """
+    Generate the variants of the new and changed banners in images_path and write the variant manifest, also
+    with force, of all banners. Returns the names of the banners processed.
+    """
+    widths = widths or getattr(settings, 'BANNER_VARIANT_WIDTHS', DEFAULT_BANNER_VARIANT_WIDTHS)
+    variants_path = os.path.join(images_path, BANNER_VARIANTS_DIR)
+    if not os.path.isdir(variants_path):
+        os.makedirs(variants_path)
+    formats = saved_variant_formats()
+    for extension, image_format, options in BANNER_VARIANT_FORMATS:
+        if extension not in formats:
+            logger.warning('No %s banner variants, this PIL build cannot save %s', extension, image_format)
+    old_manifest = read_variant_manifest(images_path)
+    manifest, generated = {}, []
+    for name in sorted(os.listdir(images_path)):
+        file_path = os.path.join(images_path, name)
+        if not os.path.isfile(file_path):
+            continue
+        digest = file_digest(file_path)
+        if not force and variant_is_current(images_path, old_manifest.get(name), digest, formats):
+            manifest[name] = old_manifest[name]
+            continue
+        try:
+            manifest[name] = make_variants(images_path, name, digest, widths, formats)
+        except IOError:  # not an image, e.g. .DS_Store
+            continue
+        generated.append(name)
+
+    current = set(variant['file'] for entry in manifest.values()
+                  for variants in entry['variants'].values() for variant in variants)
+    for variant_name in os.listdir(variants_path):
+        if variant_name != BANNER_VARIANTS_MANIFEST and variant_name not in current:
+            os.remove(os.path.join(variants_path, variant_name))  # variants of changed and removed banners
+    temporary_path = variant_manifest_path(images_path) + '.tmp'
+    with open(temporary_path, 'w') as manifest_file:
+        json.dump(manifest, manifest_file, indent=2, sort_keys=True)
+    os.rename(temporary_path, variant_manifest_path(images_path))  # readers never see a partial manifest
+    return generated
@@ -0,0 +1,123 @@
+"""
+Measurement helpers for the benchmark_site command: latency percentiles, query counts and peak memory of
+repeated requests, and the comparison of results against a stored baseline.
+"""
+from django.core.cache import cache, get_cache
+from django.db import connection
+from django.test.utils import CaptureQueriesContext, override_settings
+import contextlib
+import resource
+import time
+import uuid
+
+# Allowances on top of the relative tolerance, so fast scenarios do not fail on timer and allocator noise
+LATENCY_SLACK_MS = 5.0
+MEMORY_SLACK_KB = 2048
+
+
+@contextlib.contextmanager
+def private_cache():
+    """
+    Run with the default cache replaced by an empty local memory cache of this process. The default cache is
+    shared with the live site (see CACHES), which must neither lose its entries to the cache clears of a
+    benchmark nor serve pages and meetings built from synthetic data. The cache object is imported by every
+    module, so it is switched over in place rather than only in the settings.
+    """
+    with override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                                               'LOCATION': 'benchmark-%s' % uuid.uuid4().hex}}):
+        private = get_cache('default')
+        shared = cache.__class__, cache.__dict__
+        cache.__class__, cache.__dict__ = private.__class__, private.__dict__
+        try:
+            yield
+        finally:
+            cache.clear()
+            cache.__class__, cache.__dict__ = shared
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[int(round(fraction * (len(values) - 1)))]
+
+
+def _proc_status_kb(field):
+    try:
+        with open('/proc/self/status') as status:
+            for line in status:
+                if line.startswith(field + ':'):
+                    return int(line.split()[1])
+    except IOError:
+        pass
+    return None
+
+
+def reset_peak_rss():
+    """
+    Reset the peak resident set size of the process where Linux allows it, and return the current size in KB.
+    Elsewhere the peak is a high-water mark for the whole process, so only increases over it are measured.
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w') as clear_refs:
+            clear_refs.write('5')
+    except IOError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return _proc_status_kb('VmRSS')
+
+
+def peak_rss_kb():
+    return _proc_status_kb('VmHWM') or resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def consume(response):
+    """
+    Read the whole response body, so the time and queries of streaming responses are measured.
+    """
+    if response.streaming:
+        return sum(len(chunk) for chunk in response.streaming_content)
+    return len(response.content)
+
+
+def measure(request, iterations, warmup=0, setup=None):
+    """
+    Call request() warmup times untimed and then iterations times, calling setup() untimed before each call.
+    request must return a response, which is read in full. Returns the p50 and p95 latency in ms, the most
+    queries run by any timed call and how far the calls raised the peak RSS above its size before them, in KB.
+    """
+    for i in range(warmup):
+        if setup:
+            setup()
+        consume(request())
+    timings, queries = [], 0
+    rss_before = reset_peak_rss()
+    for i in range(iterations):
+        if setup:
+            setup()
+        with CaptureQueriesContext(connection) as context:
+            start = time.time()
+            response = request()
+            consume(response)
+            timings.append((time.time() - start) * 1000)
+        if response.status_code >= 400:
+            raise AssertionError('Request returned status %s' % response.status_code)
+        queries = max(queries, len(context))
+    return {'p50_ms': round(percentile(timings, 0.5), 2), 'p95_ms': round(percentile(timings, 0.95), 2),
+            'queries': queries, 'peak_rss_kb': max(0, peak_rss_kb() - rss_before)}
+
+
+def compare_to_baseline(results, baseline, tolerance):
+    """
+    Return a description of every regression of results against baseline, both dicts of scenario name to
+    measurements. Any increase in queries is a regression, latency and memory may grow by the tolerance, a
+    fraction, plus a small slack. Scenarios missing from either side are not compared.
+    """
+    regressions = []
+    for name in sorted(set(results) & set(baseline)):
+        result, expected = results[name], baseline[name]
+        if result['queries'] > expected['queries']:
+            regressions.append('%s: %s queries, baseline %s' % (name, result['queries'], expected['queries']))
+        if result['p95_ms'] > expected['p95_ms'] * (1 + tolerance) + LATENCY_SLACK_MS:
+            regressions.append('%s: p95 %.2f ms, baseline %.2f ms' % (name, result['p95_ms'], expected['p95_ms']))
+        if result['peak_rss_kb'] > expected['peak_rss_kb'] * (1 + tolerance) + MEMORY_SLACK_KB:
+            regressions.append('%s: peak RSS +%s KB, baseline +%s KB' % (name, result['peak_rss_kb'],
+                                                                        expected['peak_rss_kb']))
+    return regressions
@@ -0,0 +1,82 @@
+from models import Blob, BLOB_TRACKED_MODELS, blob_fields
+from storage import BLOB_PREFIX, blob_digest
+import collections
+import datetime
+
+
+def blob_storages():
+    storages = []
+    for model in BLOB_TRACKED_MODELS:
+        for field in blob_fields(model):
+            if field.storage not in storages:
+                storages.append(field.storage)
+    return storages
+
+
+def referenced_digests():
+    """
+    Count the references of the tracked file fields to each blob, by content hash.
+    """
+    counts = collections.Counter()
+    for model in BLOB_TRACKED_MODELS:
+        for field in blob_fields(model):
+            names = model._default_manager.filter(**{'%s__startswith' % field.attname: BLOB_PREFIX + '/'})
+            for name in names.values_list(field.attname, flat=True):
+                digest = blob_digest(name)
+                if digest:
+                    counts[digest] += 1
+    return counts
+
+
+def recount_blob_references():
+    """
+    Set the reference counts of all blobs from the tracked file fields. Returns the number of counts corrected.
+    """
+    counts = referenced_digests()
+    corrected = 0
+    for blob in Blob.objects.all():
+        if blob.reference_count != counts.get(blob.digest, 0):
+            Blob.objects.filter(pk=blob.pk).update(reference_count=counts.get(blob.digest, 0))
+            corrected += 1
+    known = set(Blob.objects.values_list('digest', flat=True))
+    for storage in blob_storages():
+        for digest in storage.blob_digests():
+            if counts.get(digest) and digest not in known:
+                Blob.objects.create(digest=digest, size=storage.blob_size(digest), reference_count=counts[digest])
+                known.add(digest)
+                corrected += 1
+    return corrected
+
+
+def collect_blobs(grace=datetime.timedelta(hours=24), dry_run=False):
+    """
+    Delete the stored blobs that no file field refers to. Blobs stored or uploaded again within grace are kept,
+    their upload may not be saved to its model yet, as are blobs whose count is stale but that a field still
+    refers to.
+    Returns the hashes of the deleted blobs and the bytes they used.
+    """
+    cutoff = datetime.datetime.now() - grace  # storage modified times are naive local times
+    referenced = set(Blob.objects.filter(reference_count__gt=0).values_list('digest', flat=True))
+    deleted, freed = [], 0
+    for storage in blob_storages():
+        candidates = [digest for digest in storage.blob_digests()
+                      if digest not in referenced and storage.blob_modified_time(digest) < cutoff]
+        if candidates:
+            in_use = referenced_digests()
+            candidates = [digest for digest in candidates if digest not in in_use]
+        for digest in candidates:
+            freed += storage.blob_size(digest)
+            deleted.append(digest)
+            if not dry_run:
+                storage.delete_blob(digest)
+        if not dry_run:
+            for name in storage.temporary_files():  # left by interrupted uploads
+                if storage.modified_time(name) < cutoff:
+                    storage.delete(name)
+    if not dry_run:
+        on_disk = set(digest for storage in blob_storages() for digest in storage.blob_digests())
+        unreferenced = Blob.objects.filter(reference_count__lte=0).values_list('pk', 'digest')
+        gone = [pk for pk, digest in unreferenced if digest not in on_disk]
+        for start in range(0, len(gone), 500):  # under the sqlite limit of query parameters
+            Blob.objects.filter(pk__in=gone[start:start + 500]).delete()
+    return deleted, freed
@@ -0,0 +1,114 @@
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db.models import F
+from django.utils import timezone
+from models import MailBatch, QueuedMessage
+import datetime
+import time
+
+
+def enqueue_mail(subject, message, from_email, recipient_list, batch=None):
+    """
+    Queue a single message. Takes the same arguments as django.core.mail.send_mail.
+    """
+    return QueuedMessage.objects.create(batch=batch, subject=subject, body=message, from_email=from_email,
+                                        recipients=', '.join(recipient_list))
+
+
+def enqueue_mass_mail(datatuple, batch_subject=None):
+    """
+    Queue a group of messages as one MailBatch. Takes the same datatuple as django.core.mail.send_mass_mail,
+    a sequence of (subject, message, from_email, recipient_list) tuples, and returns the batch.
+    """
+    datatuple = list(datatuple)
+    if batch_subject is None:
+        batch_subject = datatuple[0][0] if datatuple else ''
+    batch = MailBatch.objects.create(subject=batch_subject, total_count=len(datatuple))
+    QueuedMessage.objects.bulk_create([
+        QueuedMessage(batch=batch, subject=subject, body=message, from_email=from_email,
+                      recipients=', '.join(recipient_list))
+        for subject, message, from_email, recipient_list in datatuple])
+    return batch
+
+
+def retry_failed(messages=None):
+    """
+    Return failed messages to the queue so the next run resends them, and only them. messages is an
+    optional queryset of QueuedMessages to limit the retry to, e.g. the messages of one batch.
+    """
+    if messages is None:
+        messages = QueuedMessage.objects.all()
+    failed = messages.filter(status='failed')
+    for batch_id, in failed.exclude(batch=None).values_list('batch').distinct():
+        MailBatch.objects.filter(pk=batch_id).update(
+            failed_count=F('failed_count') - failed.filter(batch=batch_id).count())
+    return failed.update(status='pending')
+
+
+def reopen(connection):
+    connection.close()
+    try:
+        connection.open()
+    except Exception:
+        pass  # if the server is still unreachable each send opens its own connection and fails on its own
+
+
+def claim_queued_mail(batch_size):
+    """
+    Claim up to batch_size pending messages for this worker and return them. Each message is claimed by an
+    update that only matches while it is still pending, so when workers run at the same time, e.g. a cron
+    run and a --loop worker, each message goes to one of them. Claims older than MAIL_QUEUE_CLAIM_TIMEOUT
+    seconds, of a worker that died while sending, are returned to the queue first.
+    """
+    now = timezone.now()
+    timeout = getattr(settings, 'MAIL_QUEUE_CLAIM_TIMEOUT', 60 * 60)
+    QueuedMessage.objects.filter(status='sending', claimed__lt=now - datetime.timedelta(seconds=timeout)).update(
+        status='pending')
+    candidates = QueuedMessage.objects.filter(status='pending').values_list('pk', flat=True)[:batch_size]
+    # single row updates in autocommit, a transaction around them would fail rather than wait on sqlite
+    claimed = [pk for pk in candidates
+               if QueuedMessage.objects.filter(pk=pk, status='pending').update(status='sending', claimed=now)]
+    return list(QueuedMessage.objects.filter(pk__in=claimed)) if claimed else []
+
+
+def send_queued_mail(batch_size=None, rate=None):
+    """
+    Claim up to batch_size pending messages and send them over a single reused connection, pausing between
+    messages to stay under rate messages per second. Failures are recorded on the message and do not stop
+    the batch. Returns a (sent, failed) tuple.
+    """
+    batch_size = batch_size or getattr(settings, 'MAIL_QUEUE_BATCH_SIZE', 50)
+    rate = rate or getattr(settings, 'MAIL_QUEUE_RATE', None)  # messages per second, None for no limit
+    messages = claim_queued_mail(batch_size)
+    if not messages:
+        return 0, 0
+    sent = failed = 0
+    connection = get_connection()
+    connection.open()  # keep one connection open for the whole batch
+    try:
+        for queued in messages:
+            started = time.time()
+            email = EmailMessage(queued.subject, queued.body, queued.from_email, queued.recipient_list(),
+                                 connection=connection)
+            try:
+                email.send()
+            except Exception as e:
+                reopen(connection)  # the failure may have left the connection broken
+                queued.status = 'failed'
+                queued.last_error = unicode(e)
+                failed += 1
+                counter = 'failed_count'
+            else:
+                queued.status = 'sent'
+                queued.sent = timezone.now()
+                sent += 1
+                counter = 'sent_count'
+            queued.attempts += 1
+            queued.save()
+            if queued.batch_id:
+                MailBatch.objects.filter(pk=queued.batch_id).update(**{counter: F(counter) + 1})
+            if rate:
+                time.sleep(max(0, 1.0 / rate - (time.time() - started)))
+    finally:
+        connection.close()
+    return sent, failed
@@ -0,0 +1,144 @@
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.core.urlresolvers import reverse
+from django.db import connection
+from django.test import Client
+from django.test.utils import setup_test_environment, teardown_test_environment, override_settings
+from optparse import make_option
+from base.benchmarks import measure, compare_to_baseline, private_cache
+from meetings.models import Meeting, Abstract, ProgramBook
+import json
+import logging
+import os
+import shutil
+import tempfile
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))),
+                                'benchmark_baseline.json')
+STAFF_USERNAME = 'benchmark_staff'
+STAFF_PASSWORD = 'benchmark'
+
+
+def submission_data(count):
+    data = {'presentation_type': 'Poster', 'title': 'Benchmark submission %s' % count,
+            'abstract_text': '<p>Benchmark submission with <em>Homo naledi</em> and three authors.</p>',
+            'contact_email': 'bench@example.com', 'confirm_email': 'bench@example.com',
+            'author_set-TOTAL_FORMS': 3, 'author_set-INITIAL_FORMS': 0, 'author_set-MAX_NUM_FORMS': 1000}
+    for i in range(3):
+        data.update({'author_set-%s-name' % i: 'Author %s' % i, 'author_set-%s-first_name' % i: 'Author',
+                     'author_set-%s-last_name' % i: 'Number %s' % i})
+    return data
+
+
+class Command(BaseCommand):
+    help = """Benchmark the public and admin hot paths with the test client, on synthetic data generated in a
+    throwaway test database. Prints p50/p95 latency, query counts and peak memory per scenario as JSON and
+    fails if any scenario regressed against the baseline file, which --save-baseline records. Query counts
+    must not grow; latency and memory may grow by the tolerance. Pages are measured both with the page
+    caches warm and with every cache cleared before each request ("uncached"), in a cache of the command's
+    own, so the site cache is left alone."""
+
+    option_list = BaseCommand.option_list + (
+        make_option('--seed', type='int', default=1, help='Random seed of the synthetic data'),
+        make_option('--meetings', type='int', default=3, help='Number of meetings, at least 2'),
+        make_option('--abstracts', type='int', default=300, help='Abstracts per meeting'),
+        make_option('--iterations', type='int', default=20, help='Timed requests per scenario'),
+        make_option('--warmup', type='int', default=2, help='Untimed requests per scenario'),
+        make_option('--tolerance', type='float', default=0.5,
+                    help='Allowed relative growth of latency and memory over the baseline'),
+        make_option('--baseline', default=DEFAULT_BASELINE, help='Baseline file'),
+        make_option('--save-baseline', action='store_true', dest='save_baseline', default=False,
+                    help='Record the results as the new baseline instead of comparing'),
+        make_option('--output', default=None, help='Also write the results to this file'),
+    )
+
+    def handle(self, *args, **options):
+        if options['meetings'] < 2:
+            raise CommandError('At least 2 meetings are needed, an open one and a past one')
+        dataset = {'seed': options['seed'], 'meetings': options['meetings'], 'abstracts': options['abstracts']}
+        media_root = tempfile.mkdtemp()  # for the program book files
+        # no line per request, and the uncached scenarios exceed the query budgets, which assume warm fiber caches
+        logging.getLogger('base.querybudget').setLevel(logging.ERROR)
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            # the synthetic meetings have the years of the real ones, their pages must not reach the site cache
+            with override_settings(MEDIA_ROOT=media_root), private_cache():
+                call_command('generate_synthetic_data', seed=options['seed'], meetings=options['meetings'],
+                             abstracts=options['abstracts'], members=200, stdout=open(os.devnull, 'w'))
+                scenarios = self.run_scenarios(options['iterations'], options['warmup'])
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+            shutil.rmtree(media_root)
+
+        report = json.dumps({'dataset': dataset, 'iterations': options['iterations'], 'scenarios': scenarios},
+                            indent=2, sort_keys=True)
+        self.stdout.write(report)
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                output.write(report + '\n')
+        if options['save_baseline']:
+            with open(options['baseline'], 'w') as baseline_file:
+                baseline_file.write(report + '\n')
+            return
+        if not os.path.exists(options['baseline']):
+            raise CommandError('No baseline at %s, record one with --save-baseline' % options['baseline'])
+        with open(options['baseline']) as baseline_file:
+            baseline = json.load(baseline_file)
+        if baseline['dataset'] != dataset:
+            raise CommandError('The baseline was recorded on a different dataset: %s' % baseline['dataset'])
+        regressions = compare_to_baseline(scenarios, baseline['scenarios'], options['tolerance'])
+        if regressions:
+            raise CommandError('Performance regressions against %s:\n  %s' % (options['baseline'],
+                                                                              '\n  '.join(regressions)))
+
+    def run_scenarios(self, iterations, warmup):
+        meeting = Meeting.objects.current()
+        past_meeting = Meeting.objects.filter(year__lt=meeting.year).order_by('-year')[0]
+        # the admin actions export a complete past meeting, as they do after the program is set, the program
+        # book its accepted abstracts
+        selected = list(Abstract.objects.filter(meeting=past_meeting).values_list('pk', flat=True))
+        accepted = list(Abstract.objects.filter(meeting=past_meeting, accepted=True).values_list('pk', flat=True))
+        User.objects.create_superuser(STAFF_USERNAME, 'staff@example.com', STAFF_PASSWORD)
+        public, staff = Client(), Client()
+        staff.login(username=STAFF_USERNAME, password=STAFF_PASSWORD)
+        changelist = reverse('admin:meetings_abstract_changelist')
+        submissions = iter(range(1000000))
+
+        def get(client, url):
+            return lambda: client.get(url)
+
+        def admin_action(action, pks):
+            return lambda: staff.post(changelist, {'action': action, '_selected_action': pks, 'index': 0})
+
+        def submit():
+            return public.post(reverse('meetings:create_abstract'), submission_data(next(submissions)))
+
+        def stale_program_book():
+            ProgramBook.objects.update(stale=True)
+
+        detail_url = reverse('meetings:meeting_detail', args=[past_meeting.year])
+        scenarios = [
+            ('home', get(public, '/home/'), None),
+            ('home_uncached', get(public, '/home/'), cache.clear),
+            ('meetings', get(public, reverse('meetings:meetings')), None),
+            ('meetings_uncached', get(public, reverse('meetings:meetings')), cache.clear),
+            ('meeting_detail', get(public, detail_url), None),
+            ('meeting_detail_uncached', get(public, detail_url), cache.clear),
+            ('abstract_create_get', get(public, reverse('meetings:create_abstract')), None),
+            ('abstract_create_post', submit, None),
+            ('admin_abstract_csv', admin_action('create_abstract_csv', selected), None),
+            ('admin_program_book', admin_action('create_abstract4meeting_html', accepted), None),
+            ('admin_program_book_rebuild', admin_action('create_abstract4meeting_html', accepted),
+             stale_program_book),
+        ]
+        results = {}
+        for name, request, setup in scenarios:
+            results[name] = measure(request, iterations, warmup, setup)
+            self.stderr.write('%-28s p50 %8.2f ms  p95 %8.2f ms  %4d queries  peak RSS +%d KB' % (
+                name, results[name]['p50_ms'], results[name]['p95_ms'], results[name]['queries'],
+                results[name]['peak_rss_kb']))
+        return results
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+from optparse import make_option
+from base.blobs import collect_blobs, recount_blob_references
+import datetime
+
+
+class Command(BaseCommand):
+    help = "Delete the uploaded file blobs that no announcement, meeting or abstract refers to anymore."
+
+    option_list = BaseCommand.option_list + (
+        make_option('--grace', type='float', dest='grace', default=24,
+                    help='Hours to keep unreferenced blobs, whose upload may still be saving'),
+        make_option('--recount', action='store_true', dest='recount', default=False,
+                    help='Recount the references of every blob first, e.g. after queryset updates'),
+        make_option('--dry-run', action='store_true', dest='dry_run', default=False,
+                    help='Only report the blobs that would be deleted'),
+    )
+
+    def handle(self, *args, **options):
+        if options['recount']:
+            self.stdout.write("Corrected %s reference counts" % recount_blob_references())
+        deleted, freed = collect_blobs(datetime.timedelta(hours=options['grace']), options['dry_run'])
+        for digest in deleted:
+            self.stdout.write(digest)
+        self.stdout.write("%s %s blobs, %s bytes" % ('Would delete' if options['dry_run'] else 'Deleted',
+                                                    len(deleted), freed))
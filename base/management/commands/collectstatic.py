@@ -0,0 +1,22 @@
+from django.contrib.staticfiles.management.commands.collectstatic import Command as CollectStaticCommand
+from optparse import make_option
+from base.banners import generate_banner_variants
+from base.templatetags.banner import banner_images_path
+
+
+class Command(CollectStaticCommand):
+    """
+    collectstatic, generating the variants of new and changed home page banners first so they are collected
+    with the banners.
+    """
+    option_list = CollectStaticCommand.option_list + (
+        make_option('--skip-banner-variants', action='store_true', dest='skip_banner_variants', default=False,
+                    help="Don't generate the home page banner variants first"),
+    )
+
+    def handle_noargs(self, **options):
+        if not options['skip_banner_variants']:
+            generated = generate_banner_variants(banner_images_path())
+            if generated and int(options.get('verbosity', 1)) >= 1:
+                self.stdout.write("Generated the variants of %s banners" % len(generated))
+        return super(Command, self).handle_noargs(**options)
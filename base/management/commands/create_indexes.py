@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.db.models import get_app, get_models
+
+
+class Command(BaseCommand):
+    args = '<app_label app_label ...>'
+    help = """Create the indexes declared on the models of the given apps (default base and meetings) that are
+    missing from an existing database. syncdb only creates indexes when it creates a table."""
+
+    def handle(self, *app_labels, **options):
+        app_labels = app_labels or ('base', 'meetings')
+        with transaction.atomic():
+            cursor = connection.cursor()
+            for app_label in app_labels:
+                for model in get_models(get_app(app_label)):
+                    for statement in connection.creation.sql_indexes_for_model(model, no_style()):
+                        cursor.execute(statement.replace('CREATE INDEX ', 'CREATE INDEX IF NOT EXISTS ', 1))
+                        self.stdout.write(statement)
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand, CommandError
+from optparse import make_option
+from base.banners import generate_banner_variants
+from base.templatetags.banner import banner_images_path
+
+
+class Command(BaseCommand):
+    help = """Generate the resized progressive JPEG and WebP variants of the new and changed home page banners,
+    and the manifest the home page reads their srcset from. collectstatic runs this before collecting."""
+
+    option_list = BaseCommand.option_list + (
+        make_option('--widths', default=None,
+                    help='Comma separated variant widths (default settings.BANNER_VARIANT_WIDTHS)'),
+        make_option('--force', action='store_true', dest='force', default=False,
+                    help='Regenerate the variants of every banner'),
+    )
+
+    def handle(self, *args, **options):
+        widths = None
+        if options['widths']:
+            try:
+                widths = [int(width) for width in options['widths'].split(',')]
+            except ValueError:
+                raise CommandError('--widths takes comma separated numbers of pixels, e.g. 320,500,1000')
+        generated = generate_banner_variants(banner_images_path(), widths, options['force'])
+        for name in generated:
+            self.stdout.write("Generated the variants of %s" % name)
+        self.stdout.write("%s banners processed" % len(generated))
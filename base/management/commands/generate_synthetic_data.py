@@ -0,0 +1,196 @@
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+from fiber.models import Page
+from optparse import make_option
+from base.models import TabaUser, Announcement
+from meetings.models import Meeting, Abstract, Author, lead_author_sort_key
+from meetings.search import rebuild_index
+import datetime
+import random
+
+WORDS = ('hominin fossil femur tibia cranium mandible molar enamel dentition bipedal locomotion stone tool '
+         'assemblage site excavation stratigraphy dating isotope diet savanna woodland pleistocene pliocene '
+         'morphology variation sample analysis population evolution adaptation climate habitat primate '
+         'skeleton gait pelvis foot hand brain endocast growth development cortical bone lithic flake core '
+         'cut mark butchery fauna taphonomy sediment basin rift valley cave layer deposit').split()
+SPECIES = ['Homo erectus', 'Homo neanderthalensis', 'Homo naledi', 'Australopithecus afarensis',
+           'Paranthropus boisei', 'Ardipithecus ramidus', 'Homo floresiensis']
+FIRST_NAMES = ('Ada Alan Amara Ana Bo Carlos Chen Dana Eitan Emma Fatima Hana Ian Ines Jamal Kofi Lena Li Maria '
+               'Mei Nadia Omar Priya Rosa Sam Sofia Tomas Yara Yusuf Zoe').split()
+LAST_NAMES = ('Abbott Baker Chavez Dlamini Eriksen Fischer Garcia Haddad Ito Johansson Kim Lopez Mensah Novak '
+              'Okafor Petrov Quispe Rossi Sato Tanaka Usman Vargas Wang Xu Yilmaz Zhang').split()
+INSTITUTIONS = ['University of %s' % place for place in ('Texas', 'Nairobi', 'Witwatersrand', 'Tokyo', 'Leipzig',
+                                                       'Cambridge', 'Arizona', 'Toronto', 'Barcelona', 'Beijing')]
+COUNTRIES = ['United States of America', 'Kenya', 'South Africa', 'Japan', 'Germany', 'United Kingdom',
+             'Canada', 'Spain', 'China']
+MEMBER_USERNAME_PREFIX = 'synthetic_member_'
+SENTENCE_POOL_SIZE = 5000
+
+
+def insert_rows(model, rows):
+    """
+    Insert dicts of field values, with foreign keys given as ids, with a single executemany. Used for the
+    largest table, authors: unlike bulk_create it does not build a model instance for every row and an
+    SQL statement for every hundred rows.
+    """
+    fields = [model._meta.get_field(name) for name in sorted(rows[0])] if rows else []
+    qn = connection.ops.quote_name
+    sql = 'INSERT INTO %s (%s) VALUES (%s)' % (qn(model._meta.db_table), ', '.join(qn(f.column) for f in fields),
+                                               ', '.join(['%s'] * len(fields)))
+    connection.cursor().executemany(sql, [[row[f.name] for f in fields] for row in rows])
+
+
+class Command(BaseCommand):
+    help = """Generate a reproducible synthetic dataset for scale testing: meetings with fiber pages, abstracts
+    with html text and ranked authors drawn from a shared pool, announcements with varied date windows, and
+    members. The same seed always generates the same data, with dates relative to today. Rows are inserted
+    in bulk, so the model signals do not run; derived fields are filled in directly and the search index is
+    rebuilt at the end."""
+
+    option_list = BaseCommand.option_list + (
+        make_option('--seed', type='int', default=1, help='Random seed'),
+        make_option('--meetings', type='int', default=5, help='Number of meetings'),
+        make_option('--first-year', type='int', dest='first_year', default=None,
+                    help='Year of the first meeting, by default so that the last meeting is next year'),
+        make_option('--abstracts', type='int', default=200, help='Abstracts per meeting'),
+        make_option('--max-authors', type='int', dest='max_authors', default=50, help='Most authors per abstract'),
+        make_option('--author-pool', type='int', dest='author_pool', default=2000,
+                    help='Number of distinct people authors are drawn from'),
+        make_option('--announcements', type='int', default=50, help='Number of announcements'),
+        make_option('--members', type='int', default=500, help='Number of members'),
+        make_option('--no-search-index', action='store_false', dest='search_index', default=True,
+                    help='Do not rebuild the search index'),
+    )
+
+    def handle(self, *args, **options):
+        self.rng = random.Random(options['seed'])
+        self.sentences = [self.sentence(8, 20) for i in range(SENTENCE_POOL_SIZE)]
+        self.titles = [self.sentence(4, 10) for i in range(SENTENCE_POOL_SIZE)]  # under 200 characters
+        today = timezone.now().date()
+        first_year = options['first_year'] or today.year - options['meetings'] + 2
+        years = range(first_year, first_year + options['meetings'])
+        if Meeting.objects.filter(year__in=years).exists():
+            raise CommandError('Meetings already exist for some of the years %s-%s' % (years[0], years[-1]))
+        # with DEBUG on, logging every insert costs more than the insert; callers keep their own setting
+        use_debug_cursor, connection.use_debug_cursor = connection.use_debug_cursor, False
+        try:
+            with transaction.atomic():
+                meetings = self.create_meetings(years)
+                people = [self.person(i) for i in range(options['author_pool'])]
+                abstract_count, author_count = self.create_abstracts(meetings, options['abstracts'],
+                                                                     options['max_authors'], people)
+                self.create_announcements(options['announcements'], today)
+                self.create_members(options['members'])
+            self.stdout.write('Created %s meetings, %s abstracts, %s authors, %s announcements and %s members' % (
+                len(meetings), abstract_count, author_count, options['announcements'], options['members']))
+            if options['search_index']:
+                self.stdout.write('Indexed %s abstracts' % rebuild_index())
+        finally:
+            connection.use_debug_cursor = use_debug_cursor
+        cache.clear()  # nothing cached from before the load should be served
+
+    def sentence(self, min_words, max_words):
+        """
+        Return a sentence as (html, plain text, word count), built from whole words so the html needs no
+        sanitizing and the plain text needs no parsing.
+        """
+        words = [self.rng.choice(WORDS) for i in range(self.rng.randint(min_words, max_words))]
+        plain = ' '.join(words).capitalize()
+        markup = plain
+        if self.rng.random() < 0.3:
+            species = self.rng.choice(SPECIES)
+            plain += ' in %s' % species
+            markup += ' in <em>%s</em>' % species
+            words += ['in'] + species.split()
+        return markup + '.', plain + '.', len(words)
+
+    def paragraph(self, sentences):
+        # sampled from a pool of sentences, which is much faster than building every sentence from words
+        chosen = [self.rng.choice(self.sentences) for i in range(sentences)]
+        return ' '.join(c[0] for c in chosen), ' '.join(c[1] for c in chosen), sum(c[2] for c in chosen)
+
+    def create_meetings(self, years):
+        mainmenu = Page.objects.filter(title='mainmenu', parent=None).first() or Page.objects.create(title='mainmenu')
+        if not Page.objects.filter(title='home').exists():
+            Page.objects.create(title='home', parent=mainmenu, url='home', template_name='base/home.html')
+        meetings_page = Page.objects.filter(title='meetings').first() or \
+            Page.objects.create(title='meetings', parent=mainmenu, url='meetings')
+        for page_url, title in [('create_abstract', 'abstract'), ('thanks', 'thanks')]:
+            if not Page.objects.filter(title=title, parent=meetings_page).exists():
+                Page.objects.create(title=title, parent=meetings_page, url=page_url, show_in_menu=False)
+        meetings = []
+        for year in years:
+            start_date = datetime.date(year, 4, self.rng.randint(1, 25))
+            meeting = Meeting.objects.create(title='Synthetic %s' % year, year=year, start_date=start_date,
+                                             end_date=start_date + datetime.timedelta(days=2),
+                                             location=self.rng.choice(INSTITUTIONS), associated_with='AAPA')
+            # meeting pages are created one at a time, mptt does not support bulk inserts
+            Page.objects.create(title=meeting.title, parent=meetings_page, url=str(year), show_in_menu=False)
+            meetings.append(meeting)
+        return meetings
+
+    def person(self, i):
+        first_name, last_name = self.rng.choice(FIRST_NAMES), self.rng.choice(LAST_NAMES)
+        return {'first_name': first_name, 'last_name': last_name, 'name': '%s %s' % (first_name, last_name),
+                'institution': self.rng.choice(INSTITUTIONS), 'department': 'Anthropology',
+                'country': self.rng.choice(COUNTRIES),
+                'email_address': '%s.%s%s@example.com' % (first_name.lower(), last_name.lower(), i)}
+
+    def create_abstracts(self, meetings, count, max_authors, people):
+        abstracts, author_lists = [], []
+        for meeting in meetings:
+            for rank in range(count):
+                title_html, title_text, title_words = self.rng.choice(self.titles)
+                paragraphs = [self.paragraph(self.rng.randint(3, 6)) for i in range(self.rng.randint(1, 3))]
+                # most abstracts have a few authors, consortium abstracts up to max_authors
+                authors = self.rng.sample(people, min(max_authors, len(people),
+                                                      1 + int(self.rng.expovariate(1 / 3.0))))
+                abstracts.append(Abstract(
+                    meeting=meeting, year=meeting.year, contact_email=authors[0]['email_address'],
+                    presentation_type=self.rng.choice(['Paper', 'Poster', 'Poster', 'Undergraduate Poster']),
+                    title=title_html, title_text=title_text,
+                    abstract_text=''.join('<p>%s</p>' % html for html, text, words in paragraphs),
+                    abstract_plain_text=' '.join(text for html, text, words in paragraphs),
+                    word_count=sum(words for html, text, words in paragraphs),
+                    abstract_rank=rank + 1, accepted=self.rng.random() < 0.8,
+                    lead_author_sort=lead_author_sort_key(Author(**authors[0]))))
+                author_lists.append(authors)
+        Abstract.objects.bulk_create(abstracts)
+        # bulk_create does not set primary keys on sqlite, read them back in insertion order
+        abstract_ids = Abstract.objects.filter(meeting__in=meetings).order_by('pk').values_list('pk', flat=True)
+        authors = [dict(person, abstract=abstract_id, author_rank=rank)
+                   for abstract_id, people in zip(abstract_ids, author_lists)
+                   for rank, person in enumerate(people, 1)]
+        insert_rows(Author, authors)
+        return len(abstracts), len(authors)
+
+    def create_announcements(self, count, today):
+        announcements = []
+        for i in range(count):
+            pub_date = today + datetime.timedelta(days=self.rng.randint(-90, 30))
+            title = self.paragraph(1)[1][:150]
+            announcements.append(Announcement(
+                title=title, short_title=title[:50], stub='<p>%s</p>' % self.paragraph(2)[0],
+                body='<p>%s</p>' % self.paragraph(4)[0], category=self.rng.choice(['Job', 'Meeting', 'Funding']),
+                priority=self.rng.randint(1, 5), created=pub_date, pub_date=pub_date,
+                expires=pub_date + datetime.timedelta(days=self.rng.randint(1, 120)),
+                approved=self.rng.choice([True, True, True, False, None])))
+        Announcement.objects.bulk_create(announcements)
+
+    def create_members(self, count):
+        start = User.objects.filter(username__startswith=MEMBER_USERNAME_PREFIX).count()
+        usernames = ['%s%06d' % (MEMBER_USERNAME_PREFIX, start + i) for i in range(count)]
+        users = []
+        for username in usernames:
+            person = self.person(len(users))
+            users.append(User(username=username, first_name=person['first_name'], last_name=person['last_name'],
+                              email=person['email_address'], password='!'))  # an unusable password
+        User.objects.bulk_create(users)
+        user_ids = User.objects.filter(username__in=usernames).values_list('pk', flat=True)
+        TabaUser.objects.bulk_create([
+            TabaUser(user_id=user_id, institution=self.rng.choice(INSTITUTIONS), department='Anthropology',
+                     send_emails=self.rng.random() < 0.9)
+            for user_id in user_ids])
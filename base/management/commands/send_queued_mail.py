@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+from optparse import make_option
+from base.mailqueue import send_queued_mail, retry_failed
+import time
+
+
+class Command(BaseCommand):
+    help = "Send pending messages from the outbound mail queue in batches over a reused connection."
+
+    option_list = BaseCommand.option_list + (
+        make_option('--batch-size', type='int', dest='batch_size', default=None,
+                    help='Messages sent per connection (default settings.MAIL_QUEUE_BATCH_SIZE)'),
+        make_option('--rate', type='float', dest='rate', default=None,
+                    help='Maximum messages per second (default settings.MAIL_QUEUE_RATE)'),
+        make_option('--retry-failed', action='store_true', dest='retry_failed', default=False,
+                    help='Return failed messages to the queue before sending'),
+        make_option('--loop', action='store_true', dest='loop', default=False,
+                    help='Keep polling the queue instead of exiting when it is empty'),
+        make_option('--sleep', type='float', dest='sleep', default=30,
+                    help='Seconds to wait between polls of an empty queue with --loop'),
+    )
+
+    def handle(self, *args, **options):
+        if options['retry_failed']:
+            self.stdout.write("%s failed messages queued for retry" % retry_failed())
+        while True:
+            sent, failed = send_queued_mail(options['batch_size'], options['rate'])
+            if sent or failed:
+                self.stdout.write("Sent %s messages, %s failed" % (sent, failed))
+            elif not options['loop']:
+                break
+            else:
+                time.sleep(options['sleep'])
@@ -0,0 +1,125 @@
+"""
+Serving of uploaded media, for the program and abstract PDFs downloaded on conference day. Supports single
+byte ranges, so interrupted downloads resume and PDF viewers fetch pages on demand, and conditional requests
+with If-None-Match, If-Modified-Since and If-Range. Files in the content addressed storage (base.storage) never
+change under their name and are sent with far-future cache headers.
+The MEDIA_SENDFILE setting hands the file transfer to the web server, which then handles the ranges:
+'x-accel-redirect' for nginx, with an internal location at MEDIA_ACCEL_REDIRECT_PREFIX aliased to MEDIA_ROOT,
+or 'x-sendfile' for Apache mod_xsendfile and lighttpd. Without it the file is streamed in chunks.
+"""
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseNotModified, StreamingHttpResponse
+from django.utils.http import http_date, parse_http_date_safe, quote_etag
+from django.views.static import was_modified_since
+from storage import blob_digest
+import mimetypes
+import os
+import re
+import urllib
+
+CHUNK_SIZE = 64 * 1024
+RANGE_RE = re.compile(r'^bytes=(?P<start>\d*)-(?P<end>\d*)$')
+IMMUTABLE_MAX_AGE = 60 * 60 * 24 * 365
+ETAG_RE = re.compile(r'(?:W/)?("[^"]*"|\*)')
+
+
+def media_etag(name, stat):
+    digest = blob_digest(name)
+    return quote_etag(digest if digest else '%x-%x' % (int(stat.st_mtime), stat.st_size))
+
+
+def parse_range(header, size):
+    """
+    Return the (start, end) byte positions, end included, of a single range Range header, None to send the whole
+    file, for missing, malformed and multiple range headers, or False if the range starts after the file.
+    """
+    match = RANGE_RE.match((header or '').replace(' ', ''))
+    if not match or not (match.group('start') or match.group('end')):
+        return None
+    if not match.group('start'):  # the last end bytes
+        suffix = int(match.group('end'))
+        return (max(size - suffix, 0), size - 1) if suffix and size else False
+    start = int(match.group('start'))
+    if match.group('end') and int(match.group('end')) < start:
+        return None  # invalid, ignored
+    if start >= size:
+        return False
+    return start, min(int(match.group('end')), size - 1) if match.group('end') else size - 1
+
+
+def if_range_matches(header, etag, mtime):
+    if header is None:
+        return True
+    if header.startswith('"') or header.startswith('W/'):
+        return header == etag  # weak etags never match
+    date = parse_http_date_safe(header)
+    return date is not None and int(mtime) <= date
+
+
+def not_modified(request, etag, stat):
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if if_none_match is not None:  # takes precedence over If-Modified-Since, compared weakly
+        tags = ETAG_RE.findall(if_none_match)
+        return '*' in tags or etag in tags
+    return not was_modified_since(request.META.get('HTTP_IF_MODIFIED_SINCE'), stat.st_mtime, stat.st_size)
+
+
+def file_chunks(path, start, length):
+    with open(path, 'rb') as media_file:
+        media_file.seek(start)
+        while length > 0:
+            chunk = media_file.read(min(CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+
+
+def set_validators(response, name, etag, stat):
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(stat.st_mtime)
+    if blob_digest(name):
+        response['Cache-Control'] = 'public, max-age=%s, immutable' % IMMUTABLE_MAX_AGE
+
+
+def media_response(request, name, path):
+    """
+    Return the response to a GET or HEAD request for the media file name, stored at path.
+    """
+    stat = os.stat(path)
+    etag = media_etag(name, stat)
+    if not_modified(request, etag, stat):
+        response = HttpResponseNotModified()
+        set_validators(response, name, etag, stat)
+        return response
+
+    content_type, encoding = mimetypes.guess_type(path)
+    sendfile = getattr(settings, 'MEDIA_SENDFILE', None)
+    if sendfile:
+        # the web server sends the file, and answers range requests itself
+        response = HttpResponse(content_type=content_type or 'application/octet-stream')
+        if sendfile == 'x-accel-redirect':
+            prefix = getattr(settings, 'MEDIA_ACCEL_REDIRECT_PREFIX', '/protected-media/')
+            response['X-Accel-Redirect'] = prefix + urllib.quote(name.encode('utf-8'))
+        else:
+            response['X-Sendfile'] = path.encode('utf-8')
+    else:
+        byte_range = None
+        if if_range_matches(request.META.get('HTTP_IF_RANGE'), etag, stat.st_mtime):
+            byte_range = parse_range(request.META.get('HTTP_RANGE'), stat.st_size)
+        if byte_range is False:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = 'bytes */%s' % stat.st_size
+            return response
+        start, end = byte_range or (0, stat.st_size - 1)
+        chunks = file_chunks(path, start, end - start + 1) if request.method != 'HEAD' else []
+        response = StreamingHttpResponse(chunks, content_type=content_type or 'application/octet-stream')
+        response['Content-Length'] = end - start + 1
+        if byte_range:
+            response.status_code = 206
+            response['Content-Range'] = 'bytes %s-%s/%s' % (start, end, stat.st_size)
+        response['Accept-Ranges'] = 'bytes'
+    if encoding:
+        response['Content-Encoding'] = encoding
+    set_validators(response, name, etag, stat)
+    return response
@@ -0,0 +1,142 @@
+from django.conf import settings
+from django.db import connections, DEFAULT_DB_ALIAS
+from fiber import middleware as fiber_middleware
+from pagecache import bump_fiber_generation
+from profiling import profile_requested, profile_view
+import logging
+import time
+
+query_logger = logging.getLogger('base.querybudget')
+
+# fiber views that move pages in the mptt tree, which changes urls and menus without sending any signals
+FIBER_MOVE_URL_NAMES = ['fiber_page_move_up', 'fiber_page_move_down', 'page-move', 'pagecontentitem-move']
+
+
+class FiberTreeMoveMiddleware(object):
+    """
+    Expire everything cached from the fiber page tree after a page has been moved.
+    """
+    def process_response(self, request, response):
+        resolver_match = getattr(request, 'resolver_match', None)
+        if resolver_match and resolver_match.url_name in FIBER_MOVE_URL_NAMES and response.status_code < 400:
+            bump_fiber_generation()
+        return response
+
+
+class SkipStreamingResponsesMixin(object):
+    """
+    Pass streamed responses through untouched. The fiber middleware rewrites the content of html responses,
+    which a streamed response, such as the program book download, does not have.
+    """
+    def process_response(self, request, response):
+        if response.streaming:
+            return response
+        return super(SkipStreamingResponsesMixin, self).process_response(request, response)
+
+
+class ObfuscateEmailAddressMiddleware(SkipStreamingResponsesMixin, fiber_middleware.ObfuscateEmailAddressMiddleware):
+    pass
+
+
+class AdminPageMiddleware(SkipStreamingResponsesMixin, fiber_middleware.AdminPageMiddleware):
+    pass
+
+
+class QueryCount(object):
+    def __init__(self):
+        self.queries = 0
+        self.seconds = 0.0
+
+    def add(self, seconds):
+        self.queries += 1
+        self.seconds += seconds
+
+
+class CountingCursor(object):
+    """
+    A cursor that adds the number and time of its queries to a QueryCount. Unlike the debug cursor it keeps
+    no sql, so it is cheap enough for every request.
+    """
+    def __init__(self, cursor, query_count):
+        self.cursor = cursor
+        self.query_count = query_count
+
+    def __getattr__(self, attr):
+        return getattr(self.cursor, attr)
+
+    def __iter__(self):
+        return iter(self.cursor)
+
+    def execute(self, sql, params=None):
+        start = time.time()
+        try:
+            return self.cursor.execute(sql, params)
+        finally:
+            self.query_count.add(time.time() - start)
+
+    def executemany(self, sql, param_list):
+        start = time.time()
+        try:
+            return self.cursor.executemany(sql, param_list)
+        finally:
+            self.query_count.add(time.time() - start)
+
+
+class QueryCountMiddleware(object):
+    """
+    Count the SQL queries and database time of every request, and log them, with a warning when the view's
+    query budget (see base.querybudget) is exceeded. In debug mode they are also sent as X-Query-Count,
+    X-Query-Time-Ms and X-Query-Budget response headers. The queries of a streamed response run while it is
+    sent, so they are only logged, once it has been sent. List first, so that the queries of the other
+    middleware are counted.
+    """
+    def process_request(self, request):
+        # the cursors of the connection of this thread count the queries of the request, on top of the debug
+        # cursor in debug mode and tests
+        db = connections[DEFAULT_DB_ALIAS]
+        query_count = request.query_count_state = QueryCount()
+        db.cursor = lambda: CountingCursor(type(db).cursor(db), query_count)
+
+    def process_response(self, request, response):
+        if not hasattr(request, 'query_count_state'):
+            return response  # an earlier middleware responded before process_request ran
+        if response.streaming:
+            response.streaming_content = self.count_after(response.streaming_content, request, response)
+        else:
+            self.count(request, response)
+            if settings.DEBUG:
+                response['X-Query-Count'] = response.query_count
+                response['X-Query-Time-Ms'] = '%.1f' % response.query_time_ms
+                if response.query_budget is not None:
+                    response['X-Query-Budget'] = response.query_budget
+        return response
+
+    def count_after(self, content, request, response):
+        try:
+            for chunk in content:
+                yield chunk
+        finally:
+            self.count(request, response)
+
+    def count(self, request, response):
+        db = connections[DEFAULT_DB_ALIAS]
+        if 'cursor' in db.__dict__:
+            del db.cursor
+        response.query_count = request.query_count_state.queries
+        response.query_time_ms = request.query_count_state.seconds * 1000
+        response.query_budget = getattr(request, 'query_budget', None)
+        query_logger.info('%s %s: %s queries in %.1f ms', request.method, request.path, response.query_count,
+                          response.query_time_ms)
+        if response.query_budget is not None and response.query_count > response.query_budget:
+            query_logger.warning('%s %s ran %s queries, over its budget of %s', request.method, request.path,
+                                 response.query_count, response.query_budget)
+
+
+class RequestProfileMiddleware(object):
+    """
+    Profile the view of a staff request that asks for it, see base.profiling. List last, so the other
+    middleware, such as the csrf check, runs before the view.
+    """
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if profile_requested(request):
+            return profile_view(view_func, request, view_args, view_kwargs)
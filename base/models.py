@@ -1,9 +1,17 @@
 from django.db import models
+from django.db.models import F
+from django.db.models.signals import post_init, post_save, post_delete
+from django.dispatch import receiver
 from django.contrib.auth.models import User
+from django.core.cache import cache
 from django.utils import timezone
+import datetime
 from ckeditor.fields import RichTextField
 import os
 from choices import ANNOUNCEMENT_CHOICES
+import pagecache  # connects the fiber page signals
+import sqlite  # configures every new sqlite connection
+from storage import ContentAddressedStorage, content_storage, blob_digest
 from django.core.urlresolvers import reverse
 
 
@@ -37,6 +45,46 @@ class TabaUser(models.Model):
         ordering = ["user__last_name", ]
 
 
+ACTIVE_ANNOUNCEMENTS_CACHE_KEY = 'base_active_announcements'
+ACTIVE_ANNOUNCEMENTS_MAX_TIMEOUT = 60 * 60 * 24
+
+
+def next_announcement_boundary(announcements, today):
+    """
+    Return the first date after today on which one of the announcements is published or expires,
+    i.e. the next date on which the active announcement list changes, or None.
+    """
+    boundaries = [a.pub_date for a in announcements if a.pub_date > today] + \
+                 [a.expires for a in announcements if a.expires > today]
+    if boundaries:
+        return min(boundaries)
+    return None
+
+
+class AnnouncementManager(models.Manager):
+    def active(self):
+        """
+        Return the list of active announcements, newest first. The list is cached until the next pub_date or
+        expires boundary, when an announcement appears or disappears, and is cleared whenever an announcement
+        is saved or deleted. The clearing reaches the other processes only through a shared cache, see CACHES.
+        """
+        announcements = cache.get(ACTIVE_ANNOUNCEMENTS_CACHE_KEY)
+        if announcements is None:
+            now = timezone.now()
+            today = now.date()
+            # approved announcements that have not yet expired are either active now or will be in the future
+            candidates = list(self.get_queryset().filter(approved=True, expires__gt=today).
+                              order_by('-pub_date', '-created'))
+            announcements = [a for a in candidates if a.is_active_on(today)]
+            timeout = ACTIVE_ANNOUNCEMENTS_MAX_TIMEOUT
+            boundary = next_announcement_boundary(candidates, today)
+            if boundary:
+                boundary = timezone.make_aware(datetime.datetime.combine(boundary, datetime.time.min), timezone.utc)
+                timeout = min(timeout, int((boundary - now).total_seconds()) + 1)
+            cache.set(ACTIVE_ANNOUNCEMENTS_CACHE_KEY, announcements, timeout)
+        return announcements
+
+
 class Announcement(models.Model):
     id = models.AutoField(primary_key=True)
     title = models.CharField(max_length=200, null=False, blank=False)
@@ -49,9 +97,14 @@ class Announcement(models.Model):
     pub_date = models.DateField(default=timezone.now())  # field type converts datetime to date
     expires = models.DateField()
     approved = models.NullBooleanField()
-    upload1 = models.FileField(upload_to='uploads/files', null=True, blank=True)
-    upload2 = models.FileField(upload_to='uploads/files', null=True, blank=True)
-    upload3 = models.FileField(upload_to='uploads/files', null=True, blank=True)
+    upload1 = models.FileField(upload_to='uploads/files', storage=content_storage, max_length=255,
+                               null=True, blank=True)
+    upload2 = models.FileField(upload_to='uploads/files', storage=content_storage, max_length=255,
+                               null=True, blank=True)
+    upload3 = models.FileField(upload_to='uploads/files', storage=content_storage, max_length=255,
+                               null=True, blank=True)
+
+    objects = AnnouncementManager()
 
     def __unicode__(self):
         return self.title[0:20]
@@ -59,9 +112,12 @@ class Announcement(models.Model):
     def body_header(self):
         return self.body[0:50]
 
+    def is_active_on(self, date):
+        return self.expires > date and self.pub_date <= date and self.approved is True
+
     def is_active(self):
         now = timezone.now().date()   # need current date (rather than datetime) for comparison
-        return self.expires > now and self.pub_date <= now and self.approved is True
+        return self.is_active_on(now)
     is_active.admin_order_field = 'pub_date'
     is_active.boolean = True
     is_active.short_description = 'Active'
@@ -78,3 +134,165 @@ class Announcement(models.Model):
 
     def upload3_filename(self):
         return os.path.basename(self.upload3.name)
+
+    class Meta:
+        # active announcements filter on approved and the date window, newest first
+        index_together = [['approved', 'pub_date', 'created', 'expires']]
+
+
+@receiver([post_save, post_delete], sender=Announcement)
+def announcement_changed(sender, **kwargs):
+    cache.delete(ACTIVE_ANNOUNCEMENTS_CACHE_KEY)
+
+
+############################################
+# Uploaded File Blobs
+############################################
+
+class Blob(models.Model):
+    """
+    A file in the content addressed storage (base.storage), identified by the sha256 hash of its content.
+    reference_count is the number of file fields referring to it, kept by the signals of track_blob_references;
+    the collect_blobs command deletes the blobs nothing refers to.
+    """
+    digest = models.CharField(max_length=64, unique=True)
+    size = models.BigIntegerField(default=0)
+    reference_count = models.IntegerField(default=0)
+    created = models.DateTimeField(auto_now_add=True)
+
+    def __unicode__(self):
+        return self.digest
+
+
+# the models registered with track_blob_references, whose fields collect_blobs checks before deleting
+BLOB_TRACKED_MODELS = []
+
+
+def blob_fields(model):
+    return [field for field in model._meta.fields
+            if isinstance(field, models.FileField) and isinstance(field.storage, ContentAddressedStorage)]
+
+
+def blob_names(instance):
+    """
+    Return the stored names of the blob fields of instance by attname, leaving out deferred fields.
+    """
+    names = {}
+    for field in blob_fields(instance.__class__):
+        if field.attname in instance.__dict__:  # reading a deferred field would query it
+            value = instance.__dict__[field.attname]
+            names[field.attname] = getattr(value, 'name', value) or ''
+    return names
+
+
+def add_blob_reference(name, storage):
+    digest = blob_digest(name)
+    if digest and not Blob.objects.filter(digest=digest).update(reference_count=F('reference_count') + 1):
+        Blob.objects.create(digest=digest, size=storage.size(name), reference_count=1)
+
+
+def remove_blob_reference(name):
+    digest = blob_digest(name)
+    if digest:
+        Blob.objects.filter(digest=digest).update(reference_count=F('reference_count') - 1)
+
+
+def remember_blob_names(sender, instance, **kwargs):
+    instance._stored_blob_names = blob_names(instance)
+
+
+def update_blob_references(sender, instance, created, **kwargs):
+    stored = {} if created else instance._stored_blob_names
+    names = blob_names(instance)
+    for field in blob_fields(sender):
+        if field.attname in names and (created or field.attname in stored):
+            if stored.get(field.attname, '') != names[field.attname]:
+                add_blob_reference(names[field.attname], field.storage)
+                remove_blob_reference(stored.get(field.attname, ''))
+    instance._stored_blob_names = names
+
+
+def remove_blob_references(sender, instance, **kwargs):
+    for name in blob_names(instance).values():
+        remove_blob_reference(name)
+
+
+def track_blob_references(*blob_models):
+    """
+    Count the references of the file fields of blob_models that use the content addressed storage. Saves and
+    deletes of single instances keep the counts; queryset updates bypass them, which collect_blobs --recount
+    repairs.
+    """
+    for model in blob_models:
+        BLOB_TRACKED_MODELS.append(model)
+        post_init.connect(remember_blob_names, sender=model)
+        post_save.connect(update_blob_references, sender=model)
+        post_delete.connect(remove_blob_references, sender=model)
+
+
+track_blob_references(Announcement)
+
+
+############################################
+# Outbound Mail Queue
+############################################
+
+MESSAGE_STATUS_CHOICES = (
+    ('pending', 'Pending'),
+    ('sending', 'Sending'),
+    ('sent', 'Sent'),
+    ('failed', 'Failed'),
+)
+
+
+class MailBatch(models.Model):
+    """
+    A group of queued messages created by one mailing, e.g. a send_emails admin action. The worker
+    keeps the sent and failed counters current so the admin can show progress without counting messages.
+    """
+    subject = models.CharField(max_length=255)
+    created = models.DateTimeField(auto_now_add=True)
+    total_count = models.IntegerField(default=0)
+    sent_count = models.IntegerField(default=0)
+    failed_count = models.IntegerField(default=0)
+
+    def __unicode__(self):
+        return self.subject
+
+    def pending_count(self):
+        return self.total_count - self.sent_count - self.failed_count
+
+    def progress(self):
+        return "%s of %s sent, %s failed" % (self.sent_count, self.total_count, self.failed_count)
+
+    class Meta:
+        verbose_name_plural = "Mail batches"
+        ordering = ["-created", ]
+
+
+class QueuedMessage(models.Model):
+    """
+    A single outbound email waiting to be sent by the send_queued_mail management command.
+    Recipients are stored as a comma separated list. A worker claims a message by setting it to sending,
+    at the claimed time, before sending it.
+    """
+    batch = models.ForeignKey(MailBatch, null=True, blank=True)
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    from_email = models.CharField(max_length=255)
+    recipients = models.TextField()
+    status = models.CharField(max_length=10, choices=MESSAGE_STATUS_CHOICES, default='pending')
+    attempts = models.IntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    created = models.DateTimeField(auto_now_add=True)
+    claimed = models.DateTimeField(null=True, blank=True)
+    sent = models.DateTimeField(null=True, blank=True)
+
+    def __unicode__(self):
+        return "%s: %s" % (self.recipients, self.subject)
+
+    def recipient_list(self):
+        return [address.strip() for address in self.recipients.split(',') if address.strip()]
+
+    class Meta:
+        ordering = ["created", ]
@@ -0,0 +1,93 @@
+"""
+Caching of the fiber page tree. Page menus and content items appear on every page, so everything cached from
+the tree is keyed by a generation token kept in the shared cache, and any change to a fiber Page, ContentItem or
+PageContentItem replaces the token, which puts every key built from it out of use at once, in all processes.
+Pages moved in the mptt tree send no signals, so FiberTreeMoveMiddleware replaces the token after fiber's move
+views.
+"""
+from django.core.cache import cache
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from fiber.mixins import FiberPageMixin
+from fiber.models import Page, ContentItem, PageContentItem
+import copy
+import uuid
+
+FIBER_GENERATION_CACHE_KEY = 'fiber_page_generation'
+
+
+def fiber_generation():
+    generation = cache.get(FIBER_GENERATION_CACHE_KEY)
+    if generation is None:
+        # a new random token rather than a counter, so an evicted token can never bring back old entries
+        generation = uuid.uuid4().hex
+        cache.set(FIBER_GENERATION_CACHE_KEY, generation, None)
+    return generation
+
+
+def bump_fiber_generation():
+    cache.set(FIBER_GENERATION_CACHE_KEY, uuid.uuid4().hex, None)
+
+
+@receiver([post_save, post_delete], sender=Page)
+@receiver([post_save, post_delete], sender=ContentItem)
+@receiver([post_save, post_delete], sender=PageContentItem)
+def fiber_content_changed(sender, **kwargs):
+    bump_fiber_generation()
+
+
+# Fiber pages and menus resolved in this process, for the current generation only
+_resolved = {'generation': None, 'entries': {}}
+
+
+def cached_in_process(key, compute):
+    """
+    Return the value cached in this process for key, calling compute to fill it when missing. None results
+    are not stored. Callers get a copy, so rendering can never change the cached model instances.
+    """
+    generation = fiber_generation()
+    if _resolved['generation'] != generation:
+        _resolved.update(generation=generation, entries={})
+    entries = _resolved['entries']  # a concurrent bump swaps in a new dict, so a stale value is never kept
+    if key in entries:
+        return copy.deepcopy(entries[key])
+    value = compute()
+    if value is not None:
+        entries[key] = copy.deepcopy(value)
+    return value
+
+
+class CachedFiberPageMixin(FiberPageMixin):
+    """
+    A FiberPageMixin that resolves the fiber page, its ancestors and the current menu pages for a url
+    once per process and generation instead of on every request.
+    """
+    def resolve_fiber_page(self):
+        page = super(CachedFiberPageMixin, self).get_fiber_page()
+        if page is None:
+            return None
+        current_pages = super(CachedFiberPageMixin, self).get_fiber_current_pages()
+        for p in [page] + current_pages:
+            p.get_absolute_url()  # loads the parents so the cached pages build their urls without queries
+        return page, current_pages
+
+    def get_fiber_page(self):
+        if self.fiber_page is None:
+            resolved = cached_in_process(('page', self.get_fiber_page_url()), self.resolve_fiber_page)
+            if resolved is not None:
+                self.fiber_page, self.fiber_current_pages = resolved
+        return self.fiber_page
+
+    def get_fiber_current_pages(self):
+        self.get_fiber_page()
+        return super(CachedFiberPageMixin, self).get_fiber_current_pages()
+
+
+def fiber_page_urls():
+    """
+    The set of request paths that can resolve to a fiber page, built with one query per process and generation.
+    """
+    def build_urls():
+        pages = Page.objects.link_parent_objects(Page.objects.all())
+        return frozenset([page.url for page in pages] + [page.get_absolute_url() for page in pages])
+    return cached_in_process(('urls',), build_urls)
@@ -0,0 +1,85 @@
+"""
+On-demand profiling of single requests. When a staff user sends a request with the X-Profile header or the
+_profile query parameter, RequestProfileMiddleware (base.middleware) runs its view under cProfile and saves the
+stats to REQUEST_PROFILE_DIR, which keeps the most recent REQUEST_PROFILE_KEEP profiles. The profiles admin
+page lists them with their functions by cumulative time. Other requests only pay for the trigger check.
+"""
+from django.conf import settings
+from django.utils import timezone
+import cProfile
+import datetime
+import os
+import pstats
+import re
+
+PROFILE_HEADER = 'HTTP_X_PROFILE'
+PROFILE_PARAMETER = '_profile'
+PROFILE_NAME_RE = re.compile(r'^(?P<created>\d{8}-\d{6}-\d{6})_(?P<method>[A-Z]+)_(?P<path>[\w-]*)\.prof$')
+
+
+def profile_dir():
+    return getattr(settings, 'REQUEST_PROFILE_DIR', os.path.join(settings.BASE_DIR, 'profiles'))
+
+
+def profile_requested(request):
+    # the header and raw query string are checked first, so other requests never parse the query or load the user
+    requested = PROFILE_HEADER in request.META or (PROFILE_PARAMETER in request.META.get('QUERY_STRING', '') and
+                                                   PROFILE_PARAMETER in request.GET)
+    return requested and request.user.is_staff
+
+
+def run_view(view, request, args, kwargs):
+    response = view(request, *args, **kwargs)
+    if hasattr(response, 'render') and callable(response.render):
+        response = response.render()  # template responses render after the view, which is usually the slow part
+    return response
+
+
+def profile_view(view, request, args, kwargs):
+    """
+    Call the view under cProfile and save the stats. Returns the rendered response, with the name of the profile
+    in its X-Profile header.
+    """
+    profile = cProfile.Profile()
+    response = profile.runcall(run_view, view, request, args, kwargs)
+    response['X-Profile'] = save_profile(profile, request)
+    return response
+
+
+def save_profile(profile, request):
+    directory = profile_dir()
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    path = re.sub(r'[^\w]+', '-', request.path).strip('-')[:100]
+    name = '%s_%s_%s.prof' % (timezone.now().strftime('%Y%m%d-%H%M%S-%f'), request.method, path)
+    profile.dump_stats(os.path.join(directory, name))
+    for old_name in profile_names()[getattr(settings, 'REQUEST_PROFILE_KEEP', 50):]:
+        os.remove(os.path.join(directory, old_name))
+    return name
+
+
+def profile_names():
+    """
+    Return the names of the saved profiles, newest first.
+    """
+    directory = profile_dir()
+    if not os.path.isdir(directory):
+        return []
+    return sorted([name for name in os.listdir(directory) if PROFILE_NAME_RE.match(name)], reverse=True)
+
+
+def read_profile(name, limit=20):
+    """
+    Return the request and total time of a saved profile, and its limit functions with the most cumulative time.
+    """
+    match = PROFILE_NAME_RE.match(name)
+    stats = pstats.Stats(os.path.join(profile_dir(), name))
+    rows = sorted(stats.stats.items(), key=lambda item: item[1][3], reverse=True)[:limit]
+    return {
+        'name': name, 'method': match.group('method'), 'path': match.group('path'),
+        'created': datetime.datetime.strptime(match.group('created'), '%Y%m%d-%H%M%S-%f'),
+        'total_time': stats.total_tt,
+        'functions': [{'function': pstats.func_std_string(function), 'calls': calls, 'own_time': own_time,
+                       'cumulative_time': cumulative_time}
+                      for function, (primitive_calls, calls, own_time, cumulative_time, callers) in rows],
+    }
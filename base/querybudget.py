@@ -0,0 +1,36 @@
+"""
+Query budgets: the most SQL queries a request to a view may run. Class based views declare a query_budget with
+QueryBudgetMixin, view functions, admin views and admin actions with the query_budget decorator. The budget of
+the innermost view or action called wins, so an admin action can have a larger budget than its changelist.
+Budgets assume the fiber page, menu and content caches shared by every page are warm, so requests that fill
+them, after a page is edited, go over.
+QueryCountMiddleware (base.middleware) counts the queries of every request and warns when a budget is
+exceeded, and QueryBudgetTestMixin (base.testing) fails tests that exceed one.
+"""
+from django.http import HttpRequest
+import functools
+
+
+def query_budget(budget):
+    """
+    Decorate a view function, admin view or admin action with its query budget.
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            for arg in args:
+                if isinstance(arg, HttpRequest):  # the first argument of views, the second of admin actions
+                    arg.query_budget = budget
+                    break
+            return view(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class QueryBudgetMixin(object):
+    query_budget = None
+
+    def dispatch(self, request, *args, **kwargs):
+        if self.query_budget is not None:
+            request.query_budget = self.query_budget
+        return super(QueryBudgetMixin, self).dispatch(request, *args, **kwargs)
@@ -0,0 +1,22 @@
+"""
+SQLite configuration for concurrent use. Every new connection gets the SQLITE_PRAGMAS setting: a busy timeout,
+so writers wait for the write lock instead of failing with "database is locked", WAL journaling, so readers
+neither block nor are blocked by the single writer, and the NORMAL synchronous level, which is durable in WAL
+mode except for the last transactions on power loss. Persistent connections (CONN_MAX_AGE) keep the settings
+and the page cache between requests.
+"""
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+# the busy timeout comes first, switching the journal mode takes a lock
+DEFAULT_SQLITE_PRAGMAS = (('busy_timeout', 20000), ('journal_mode', 'WAL'), ('synchronous', 'NORMAL'))
+
+
+@receiver(connection_created)
+def configure_sqlite(sender, connection, **kwargs):
+    if connection.vendor != 'sqlite':
+        return
+    cursor = connection.cursor()
+    for name, value in getattr(settings, 'SQLITE_PRAGMAS', DEFAULT_SQLITE_PRAGMAS):
+        cursor.execute('PRAGMA %s = %s' % (name, value))
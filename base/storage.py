@@ -0,0 +1,149 @@
+"""
+Content addressed storage for uploaded files. An upload is streamed to a temporary file in chunks while it is
+hashed, and stored once under the sha256 hash of its content, as blobs/<first two digits>/<hash>/<filename>.
+Uploading the same content again stores nothing new; under another filename it is a hard link to the same
+content, so the original filename still shows in links. The stored files never change under a name, so they
+can be served with far-future cache headers.
+The file fields using the storage count their references to each blob in the Blob model (base.models,
+track_blob_references), and the collect_blobs command deletes the blobs that nothing refers to.
+"""
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage
+from django.utils._os import abspathu
+from django.utils.text import get_valid_filename
+import errno
+import hashlib
+import os
+import re
+import shutil
+import tempfile
+
+BLOB_PREFIX = 'blobs'
+BLOB_NAME_RE = re.compile(r'^%s/[0-9a-f]{2}/(?P<digest>[0-9a-f]{64})/[^/]+$' % BLOB_PREFIX)
+TEMPORARY_PREFIX = '.upload-'
+# the max_length of the file fields using the storage, names are cut to fit
+BLOB_NAME_MAX_LENGTH = 255
+CHUNK_SIZE = 64 * 1024
+
+
+def blob_digest(name):
+    """
+    Return the content hash of a stored file name, or None for names outside the blob store, like files uploaded
+    before it.
+    """
+    match = BLOB_NAME_RE.match(name or '')
+    return match.group('digest') if match else None
+
+
+def blob_directory(digest):
+    return '/'.join([BLOB_PREFIX, digest[:2], digest])
+
+
+def blob_filename(name):
+    """
+    Return the filename kept for an upload, shortened so that its blob name fits BLOB_NAME_MAX_LENGTH.
+    """
+    filename = get_valid_filename(os.path.basename(name)) or 'file'
+    room = BLOB_NAME_MAX_LENGTH - len(blob_directory('0' * 64)) - 1
+    if len(filename) > room:
+        root, extension = os.path.splitext(filename)
+        extension = extension[:room // 2]
+        filename = root[:room - len(extension)] + extension
+    return filename
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    File system storage that stores each content once under its hash. The upload_to directory of a field is
+    ignored, only its filename is kept. Without a location and base_url it follows the MEDIA_ROOT and MEDIA_URL
+    settings, like the default storage.
+    """
+    def __init__(self, location=None, base_url=None):
+        self._location = location
+        self._base_url = base_url
+
+    @property
+    def location(self):
+        return abspathu(self._location or settings.MEDIA_ROOT)
+
+    @property
+    def base_url(self):
+        return self._base_url or settings.MEDIA_URL
+
+    def get_available_name(self, name):
+        return name  # names are chosen by content, an existing name has the same content
+
+    def _save(self, name, content):
+        filename = blob_filename(name)
+        self.make_directory(BLOB_PREFIX)
+        descriptor, temporary = tempfile.mkstemp(prefix=TEMPORARY_PREFIX, dir=self.path(BLOB_PREFIX))
+        try:
+            digest = hashlib.sha256()
+            with os.fdopen(descriptor, 'wb') as temporary_file:
+                for chunk in content.chunks(CHUNK_SIZE):
+                    digest.update(chunk)
+                    temporary_file.write(chunk)
+            directory = blob_directory(digest.hexdigest())
+            name = '/'.join([directory, filename])
+            self.make_directory(directory)
+            # collect_blobs keeps blobs modified within its grace period, an upload of a blob it would
+            # collect starts the period again, so the blob outlives the save of the upload to its model
+            os.utime(self.path(directory), None)
+            if not self.exists(name):
+                stored = self.listdir(directory)[1]
+                if stored:
+                    self.link(os.path.join(self.path(directory), stored[0]), self.path(name))
+                else:
+                    os.rename(temporary, self.path(name))
+                    temporary = None
+                    if settings.FILE_UPLOAD_PERMISSIONS is not None:
+                        os.chmod(self.path(name), settings.FILE_UPLOAD_PERMISSIONS)
+        finally:
+            if temporary is not None:
+                os.remove(temporary)
+        return name
+
+    def make_directory(self, name):
+        try:
+            os.makedirs(self.path(name))
+        except OSError as e:
+            if e.errno != errno.EEXIST:  # created by a concurrent upload
+                raise
+
+    def link(self, source, path):
+        try:
+            os.link(source, path)
+        except AttributeError:  # no hard links on this platform
+            shutil.copyfile(source, path)
+        except OSError as e:
+            if e.errno != errno.EEXIST:  # linked by a concurrent upload of the same file
+                raise
+
+    def blob_digests(self):
+        """
+        Return the hashes of all stored blobs.
+        """
+        if not self.exists(BLOB_PREFIX):
+            return []
+        return [digest for prefix in self.listdir(BLOB_PREFIX)[0]
+                for digest in self.listdir('/'.join([BLOB_PREFIX, prefix]))[0]]
+
+    def blob_size(self, digest):
+        directory = blob_directory(digest)
+        stored = self.listdir(directory)[1]
+        return self.size('/'.join([directory, stored[0]])) if stored else 0
+
+    def blob_modified_time(self, digest):
+        return self.modified_time(blob_directory(digest))
+
+    def delete_blob(self, digest):
+        shutil.rmtree(self.path(blob_directory(digest)), ignore_errors=True)
+
+    def temporary_files(self):
+        if not self.exists(BLOB_PREFIX):
+            return []
+        return ['/'.join([BLOB_PREFIX, name]) for name in self.listdir(BLOB_PREFIX)[1]
+                if name.startswith(TEMPORARY_PREFIX)]
+
+
+content_storage = ContentAddressedStorage()
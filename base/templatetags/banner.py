@@ -1,14 +1,96 @@
 from django import template
-from os import listdir, path
+from os import listdir, path, stat
 from django.conf import settings
+from django.contrib.staticfiles.templatetags.staticfiles import static
 from random import choice
+from PIL import Image
+from base.banners import file_digest, read_variant_manifest, variant_manifest_path, BANNER_VARIANTS_DIR
 
 register = template.Library()
 
+BANNER_IMAGES_STATIC_DIR = 'base/home_page_images'
+
+# Process level cache of banner manifests keyed by directory path. Each manifest records the
+# directory and variant manifest mtimes it was built from so it is only rebuilt when images are added
+# or removed, or their variants generated.
+_manifests = {}
+
+
+def banner_images_path():
+    #banner_images_path = '/Users/reedd/Dropbox/pycharm/paleoanthro_dev/static/base/home_page_images/'
+    return path.join(path.dirname(settings.PROJECT_PATH), "static", "base", "home_page_images",)
+
+
+def variant_srcset(variants, image):
+    """
+    Return the srcset of the variants of a banner, ending with the banner itself unless a variant has its width.
+    """
+    directory = '%s/%s' % (BANNER_IMAGES_STATIC_DIR, BANNER_VARIANTS_DIR)
+    candidates = [(static('%s/%s' % (directory, variant['file'])), variant['width']) for variant in variants]
+    if image['width'] not in [variant['width'] for variant in variants]:
+        candidates.append((image['url'], image['width']))
+    return ', '.join('%s %sw' % candidate for candidate in candidates)
+
+
+def build_banner_manifest(images_path):
+    """
+    Read every image in the banner directory once and record its name, pixel dimensions and a
+    cache-busting static url built from a hash of the file contents, and the srcset of its JPEG
+    and WebP variants when they are current (see base.banners).
+    """
+    variant_manifest = read_variant_manifest(images_path)
+    images = []
+    for name in sorted(listdir(images_path)):
+        file_path = path.join(images_path, name)
+        try:
+            digest = file_digest(file_path)
+            width, height = Image.open(file_path).size
+        except IOError:  # skip directories and files that are not images, e.g. .DS_Store
+            continue
+        image = {
+            'name': name,
+            'width': width,
+            'height': height,
+            'url': '%s?v=%s' % (static('%s/%s' % (BANNER_IMAGES_STATIC_DIR, name)), digest[:12]),
+        }
+        variants = variant_manifest.get(name)
+        # variants of a replaced banner are not used
+        if variants and variants['digest'] == digest and any(variants['variants'].values()):
+            image['srcset'] = variant_srcset(variants['variants']['jpg'], image)
+            if variants['variants']['webp']:  # none without WebP support in PIL
+                image['webp_srcset'] = variant_srcset(variants['variants']['webp'], image)
+        images.append(image)
+    return images
+
+
+def get_banner_manifest(images_path=None):
+    """
+    Return the list of banner images, rebuilding the cached manifest only when the
+    directory or variant manifest modification time has changed.
+    """
+    images_path = images_path or banner_images_path()
+    manifest_path = variant_manifest_path(images_path)
+    mtimes = (stat(images_path).st_mtime, stat(manifest_path).st_mtime if path.exists(manifest_path) else None)
+    manifest = _manifests.get(images_path)
+    if manifest is None or manifest['mtimes'] != mtimes:
+        manifest = {'mtimes': mtimes, 'images': build_banner_manifest(images_path)}
+        _manifests[images_path] = manifest
+    return manifest['images']
+
+
 @register.filter(name='bannerImage')
 def bannerImage(value):
-    #banner_images_path = '/Users/reedd/Dropbox/pycharm/paleoanthro_dev/static/base/home_page_images/'
-    banner_images_path = path.join(path.dirname(settings.PROJECT_PATH), "static", "base", "home_page_images",)
-    banner_images_names = listdir(banner_images_path)
-    return choice(banner_images_names)
+    return choice(get_banner_manifest())['name']
+
 
+@register.assignment_tag
+def random_banner_image():
+    """
+    Usage: {% random_banner_image as banner %}
+    Returns a dictionary with the name, url, width and height of a random banner image, and the
+    srcset and webp_srcset of its variants if they were generated.
+    """
+    images = get_banner_manifest()
+    if images:
+        return choice(images)
+    return None
@@ -0,0 +1,56 @@
+"""
+Cached versions of the fiber show_menu and show_page_content tags. Load this library after fiber_tags to
+replace them. Menus and content blocks are cached per page until the fiber page tree changes (see
+base.pagecache). Staff users get the uncached tags, which include the fiber editing data.
+"""
+from django import template
+from django.contrib.auth.models import AnonymousUser
+from fiber.models import Page
+from fiber.templatetags import fiber_tags
+from base.pagecache import cached_in_process
+
+register = template.Library()
+
+
+def is_staff(context):
+    user = context.get('user')
+    return user is not None and user.is_staff
+
+
+def show_menu(context, menu_name, min_level, max_level, expand=None):
+    if is_staff(context):
+        return fiber_tags.show_menu(context, menu_name, min_level, max_level, expand)
+    fiber_page = context.get('fiber_page')
+
+    def build_menu():
+        user = context.get('user') or AnonymousUser()
+        menu_context = fiber_tags.show_menu(template.Context({'fiber_page': fiber_page, 'user': user}),
+                                            menu_name, min_level, max_level, expand)
+        return menu_context['fiber_menu_pages'], menu_context['fiber_menu_parent_page']
+
+    key = ('menu', menu_name, min_level, max_level, expand, fiber_page.pk if fiber_page else None)
+    context['Page'] = Page
+    context['fiber_menu_pages'], context['fiber_menu_parent_page'] = cached_in_process(key, build_menu)
+    context['fiber_menu_args'] = {'menu_name': menu_name, 'min_level': min_level, 'max_level': max_level,
+                                  'expand': expand}
+    return context
+
+register.inclusion_tag('fiber/menu.html', takes_context=True)(show_menu)
+
+
+class CachedShowPageContentNode(fiber_tags.ShowPageContentNode):
+    def render(self, context):
+        if is_staff(context):
+            return super(CachedShowPageContentNode, self).render(context)
+        try:
+            page = self.page.resolve(context)
+        except template.VariableDoesNotExist:
+            return ''
+        key = ('content', page.pk if page else None, self.block_name)
+        return cached_in_process(key, lambda: super(CachedShowPageContentNode, self).render(context))
+
+
+@register.tag(name='show_page_content')
+def do_show_page_content(parser, token):
+    node = fiber_tags.do_show_page_content(parser, token)
+    return CachedShowPageContentNode(node.page.var, node.block_name)
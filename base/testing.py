@@ -0,0 +1,86 @@
+"""
+Test helpers shared by the base and meetings test suites.
+"""
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+import ast
+import re
+
+# Django records sqlite queries as "QUERY = u'...' - PARAMS = (...)"
+RECORDED_QUERY_RE = re.compile(r"^QUERY = (?P<sql>.*) - PARAMS = (?P<params>.*)$", re.DOTALL)
+FULL_SCAN_RE = re.compile(r"^SCAN (TABLE )?(?P<table>\w+)")
+
+
+def recorded_statements(queries):
+    """
+    Convert the queries recorded by CaptureQueriesContext back into (sql, params) pairs.
+    """
+    for query in queries:
+        match = RECORDED_QUERY_RE.match(query['sql'])
+        if match:
+            yield ast.literal_eval(match.group('sql')), ast.literal_eval(match.group('params'))
+
+
+def full_table_scans(sql, params):
+    """
+    Return the names of the tables that sqlite reads in full to run sql, according to EXPLAIN QUERY PLAN.
+    A scan that walks an index ("SCAN t USING INDEX ...") is not a full table scan.
+    """
+    cursor = connection.cursor()
+    cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+    tables = []
+    for row in cursor.fetchall():
+        detail = row[-1]
+        match = FULL_SCAN_RE.match(detail)
+        if match and 'USING' not in detail:
+            tables.append(match.group('table'))
+    return tables
+
+
+class QueryPlanTestMixin(object):
+    """
+    A TestCase mixin that fails when the queries run by a view read a hot table in full instead of using an index.
+    """
+    def assertNoFullTableScans(self, url, tables):
+        """
+        Request url with the test client and check the plan of every SELECT it ran against the given tables.
+        """
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        for sql, params in recorded_statements(context.captured_queries):
+            if not sql.lstrip().upper().startswith('SELECT'):
+                continue
+            scanned = [table for table in full_table_scans(sql, params) if table in tables]
+            if scanned:
+                self.fail("Full table scan of %s for query: %s" % (', '.join(scanned), sql))
+        return response
+
+
+class QueryBudgetTestMixin(object):
+    """
+    A TestCase mixin that fails when a request runs more queries than the query budget of its view (see
+    base.querybudget). Budgets are for the queries of the view itself: a first request warms the fiber page,
+    menu and content caches shared by every page, and drop_view_caches() drops what the view caches itself
+    before the measured request. Create a scaled dataset in setUp, so queries run per row show up.
+    """
+    def drop_view_caches(self):
+        pass
+
+    def assertWithinQueryBudget(self, url, data=None):
+        """
+        GET url, or POST data to it, and check the queries it ran, including those of a streamed response.
+        """
+        self.client.get(url)
+        self.drop_view_caches()
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url) if data is None else self.client.post(url, data)
+            if response.streaming:
+                response.streamed_content = b''.join(response.streaming_content)
+        budget = getattr(response, 'query_budget', None)
+        if budget is None:
+            self.fail("%s declares no query budget" % url)
+        if len(context) > budget:
+            self.fail("%s ran %s queries, over its budget of %s:\n%s" % (
+                url, len(context), budget, '\n'.join(query['sql'] for query in context.captured_queries)))
+        return response
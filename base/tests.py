@@ -1,10 +1,49 @@
 from django.test import TestCase
-from base.models import Announcement
+from django.test.client import Client
+from base.models import Announcement, next_announcement_boundary
 from fiber.models import Page
 from django.core.urlresolvers import reverse
 from django.utils import timezone
 import datetime
+import json
+import os
+import shutil
+import struct
+import tempfile
+import time
 from django.contrib.auth.models import User
+from django.core import mail
+from django.core.cache import cache, get_cache
+from django.core.mail.backends.locmem import EmailBackend
+from django.test.utils import override_settings
+from base.testing import QueryPlanTestMixin
+from base.benchmarks import measure, compare_to_baseline, percentile, private_cache
+from base.testing import QueryBudgetTestMixin
+from base.models import ACTIVE_ANNOUNCEMENTS_CACHE_KEY
+from base.pagecache import FIBER_GENERATION_CACHE_KEY, fiber_generation
+from base.views import AnnouncementView
+from base.profiling import profile_names, profile_requested, read_profile
+from django.test.client import RequestFactory
+from django.db import connection, connections, DEFAULT_DB_ALIAS
+from django.test.utils import CaptureQueriesContext
+from django.db.backends.sqlite3.base import DatabaseWrapper
+import logging
+from base.mailqueue import enqueue_mass_mail, send_queued_mail, retry_failed, claim_queued_mail
+from base.models import MailBatch, QueuedMessage, TabaUser
+from meetings.models import Abstract
+from meetings.search import search_abstract_ids
+from django.core.management import call_command
+from StringIO import StringIO
+from PIL import Image
+from base.templatetags import banner
+from base.models import Blob
+from base.blobs import collect_blobs, recount_blob_references
+from base.storage import content_storage, blob_digest
+from django.core.files.base import ContentFile
+import hashlib
+from base.media import parse_range
+from django.utils.http import http_date
+from base.banners import generate_banner_variants, read_variant_manifest
 
 
 class MockRequest(object):
@@ -23,7 +62,7 @@ def create_django_page_tree():
     mainmenu=Page(title='mainmenu')
     mainmenu.save()
     home = Page.objects.create(title='home', parent=mainmenu, url='home', template_name='base/home.html')
-    detail = Page.objects.create(title='detail', parent=home, url='home/detail', template_name='base/detail.html')
+    detail = Page.objects.create(title='detail', parent=home, url='detail', template_name='base/detail.html')
     join = Page.objects.create(title='join', parent=home, url='join', template_name='base/join.html')
     members = Page.objects.create(title='members', parent=home, url='members', template_name='base/members.html')
     meetings = Page.objects.create(title='meetings', parent=mainmenu, url='meetings', template_name='')
@@ -91,11 +130,64 @@ class AnnouncementMethodTests(TestCase):
         self.assertEqual(len(expired_announcement.body_header()), 50)
 
 
-class PageViewTests(TestCase):
+class ActiveAnnouncementCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def create_announcement(self, title, pub_days, expires_days, approved=True):
+        today = timezone.now().date()
+        return Announcement.objects.create(title=title, short_title=title, stub="stub", category="Job", priority=1,
+                                           pub_date=today + datetime.timedelta(days=pub_days),
+                                           expires=today + datetime.timedelta(days=expires_days),
+                                           approved=approved)
+
+    def test_active_announcements_are_cached(self):
+        current = self.create_announcement("Current", -1, 5)
+        self.create_announcement("Future", 3, 5)
+        self.create_announcement("Expired", -5, -1)
+        self.create_announcement("Unapproved", -1, 5, approved=False)
+        self.assertEqual(Announcement.objects.active(), [current])
+        with self.assertNumQueries(0):
+            self.assertEqual(Announcement.objects.active(), [current])
+        # the cached set agrees with is_active
+        self.assertEqual([a for a in Announcement.objects.all() if a.is_active()], [current])
+
+    def test_cache_is_cleared_when_announcements_change(self):
+        current = self.create_announcement("Current", -1, 5)
+        self.assertEqual(Announcement.objects.active(), [current])
+        current.approved = False
+        current.save()
+        self.assertEqual(Announcement.objects.active(), [])
+        newer = self.create_announcement("Newer", 0, 5)
+        self.assertEqual(Announcement.objects.active(), [newer])
+        newer.delete()
+        self.assertEqual(Announcement.objects.active(), [])
+
+    def test_cache_is_cleared_for_other_processes(self):
+        other = get_cache('default')  # a backend of its own, like the cache of another process
+        current = self.create_announcement("Current", -1, 5)
+        self.assertEqual(Announcement.objects.active(), [current])
+        self.assertEqual(other.get(ACTIVE_ANNOUNCEMENTS_CACHE_KEY), [current])
+        current.delete()
+        self.assertEqual(other.get(ACTIVE_ANNOUNCEMENTS_CACHE_KEY), None)
+
+    def test_next_boundary(self):
+        today = timezone.now().date()
+        current = self.create_announcement("Current", -1, 5)
+        future = self.create_announcement("Future", 3, 10)
+        self.assertEqual(next_announcement_boundary([current, future], today), today + datetime.timedelta(days=3))
+        self.assertEqual(next_announcement_boundary([current], today), today + datetime.timedelta(days=5))
+        self.assertEqual(next_announcement_boundary([], today), None)
+
+
+class PageViewTests(QueryPlanTestMixin, TestCase):
     """
     Tests for the pages and links in the base part of the site, including the home page,
     and announcement detail pages, the join page and the members search page.
     """
+    def setUp(self):
+        cache.clear()  # the active announcement list is cached across requests
+
 
     def test_home_page_view(self):
         create_django_page_tree()  # create a test fiber page tree
@@ -103,6 +195,7 @@ class PageViewTests(TestCase):
         response = self.client.get(reverse('base:home'))  # fetch the home page
         self.assertEqual(response.status_code, 200)  # check home page returns 200
         self.assertContains(response, "There are no active announcements")  # Test no announcements message
+        self.assertContains(response, '<img src="/static/base/home_page_images/')  # banner with hashed url
         Announcement.objects.create(title="A Wonderful Test Announcement",
                                     short_title="Test_Short_Title",
                                     body="<p>Announcement body text html format</p>",
@@ -143,7 +236,632 @@ class PageViewTests(TestCase):
         # passed by the test client!
 
 
+    def test_home_page_queries_use_indexes(self):
+        create_django_page_tree()
+        Announcement.objects.create(title="A Wonderful Test Announcement", short_title="Test_Short_Title",
+                                    category="Job", priority=1, approved=True,
+                                    expires=timezone.now()+datetime.timedelta(days=1))
+        self.assertNoFullTableScans(reverse('base:home'), ['base_announcement'])
+
     def test_reverse_method_for_join_page(self):
         create_django_page_tree()
         response = self.client.get(reverse('base:join'))
-        self.assertEqual(response.status_code, 200)
\ No newline at end of file
+        self.assertEqual(response.status_code, 200)
+
+
+class FiberPageCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        create_django_page_tree()
+
+    def menu_position(self, content, url):
+        return content.index('href="%s"' % url)
+
+    def test_warm_home_page_runs_no_queries(self):
+        self.client.get(reverse('base:home'))
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('base:home'))
+        self.assertContains(response, 'href="/meetings/"')
+
+    def test_page_save_invalidates_cached_pages(self):
+        self.client.get(reverse('base:home'))
+        meetings = Page.objects.get(title='meetings')
+        meetings.title = 'Conferences'
+        meetings.save()
+        self.assertContains(self.client.get(reverse('base:home')), 'Conferences')
+
+    def test_page_move_invalidates_cached_pages(self):
+        content = self.client.get(reverse('base:home')).content
+        self.assertLess(self.menu_position(content, '/home/'), self.menu_position(content, '/meetings/'))
+        User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        staff = Client()
+        staff.login(username='admin', password='password')
+        response = staff.put(reverse('page-move', args=[Page.objects.get(title='meetings').pk]),
+                             json.dumps({'position': 'before', 'target_node_id': Page.objects.get(title='home').pk}),
+                             content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        content = self.client.get(reverse('base:home')).content
+        self.assertLess(self.menu_position(content, '/meetings/'), self.menu_position(content, '/home/'))
+
+    def test_page_change_is_seen_by_other_processes(self):
+        other = get_cache('default')  # a backend of its own, like the cache of another process
+        self.assertNotIn(type(other).__name__, ['LocMemCache', 'DummyCache'])
+        generation = fiber_generation()
+        self.assertEqual(other.get(FIBER_GENERATION_CACHE_KEY), generation)
+        Page.objects.get(title='meetings').save()
+        self.assertNotEqual(other.get(FIBER_GENERATION_CACHE_KEY), generation)
+
+
+class FiberCatchAllTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        create_django_page_tree()
+
+    def test_unknown_paths_are_rejected_without_queries(self):
+        self.client.get('/.env')  # builds the set of page urls and the 404 page
+        with self.assertNumQueries(0):
+            response = self.client.get('/wp-login.php')
+        self.assertEqual(response.status_code, 404)
+        self.assertContains(response, 'Page not found', status_code=404)
+
+    def test_new_pages_are_served(self):
+        self.assertEqual(self.client.get('/about/').status_code, 404)
+        Page.objects.create(title='about', parent=Page.objects.get(title='mainmenu'), url='about')
+        self.assertEqual(self.client.get('/about/').status_code, 200)
+        self.assertRedirects(self.client.get('/about'), '/about/', status_code=301)
+
+
+class SyntheticDataTests(TestCase):
+    def generate(self, first_year, seed=1):
+        call_command('generate_synthetic_data', seed=seed, meetings=2, first_year=first_year, abstracts=20,
+                     announcements=10, members=5, stdout=StringIO())
+        return Abstract.objects.filter(year__gte=first_year, year__lt=first_year + 2).order_by('pk')
+
+    def test_generated_data(self):
+        abstracts = self.generate(3000)
+        self.assertEqual(abstracts.count(), 40)
+        self.assertEqual(Page.objects.filter(title__startswith='Synthetic').count(), 2)
+        self.assertEqual(Announcement.objects.count(), 10)
+        self.assertEqual(TabaUser.objects.count(), 5)
+        for abstract in abstracts.prefetch_related('author_set'):
+            ranks = [author.author_rank for author in abstract.author_set.all()]
+            self.assertEqual(ranks, range(1, len(ranks) + 1))
+            self.assertTrue(1 <= len(ranks) <= 50)
+            self.assertEqual(abstract.lead_author_sort, abstract.author_set.all()[0].last_name.lower())
+            # the derived fields match what saving the abstract would store
+            derived = (abstract.title, abstract.title_text, abstract.abstract_plain_text, abstract.word_count)
+            abstract.prepare_text()
+            self.assertEqual((abstract.title, abstract.title_text, abstract.abstract_plain_text,
+                              abstract.word_count), derived)
+        self.assertTrue(search_abstract_ids(abstracts[0].title_text.split()[0]))
+
+    def test_debug_cursor_setting_is_restored(self):
+        use_debug_cursor = connection.use_debug_cursor
+        connection.use_debug_cursor = True
+        try:
+            self.generate(3000)
+            self.assertTrue(connection.use_debug_cursor)
+        finally:
+            connection.use_debug_cursor = use_debug_cursor
+
+    def test_same_seed_generates_same_data(self):
+        first = list(self.generate(3000).values_list('title', 'abstract_text', 'lead_author_sort'))
+        self.assertEqual(list(self.generate(3010).values_list('title', 'abstract_text', 'lead_author_sort')),
+                         first)
+        self.assertNotEqual(list(self.generate(3020, seed=2).values_list('title', 'abstract_text')),
+                            [row[:2] for row in first])
+
+
+class BenchmarkTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        create_django_page_tree()
+
+    def test_measure(self):
+        calls = []
+        result = measure(lambda: self.client.get(reverse('base:home')), 5, warmup=1, setup=lambda: calls.append(1))
+        self.assertEqual(len(calls), 6)
+        self.assertEqual(result['queries'], 0)  # the warmup request cached the page
+        self.assertTrue(0 < result['p50_ms'] <= result['p95_ms'])
+        self.assertTrue(result['peak_rss_kb'] >= 0)
+        with self.assertRaises(AssertionError):
+            measure(lambda: self.client.get('/no/such/page/'), 1)
+
+    def test_compare_to_baseline(self):
+        baseline = {'home': {'p50_ms': 10.0, 'p95_ms': 20.0, 'queries': 3, 'peak_rss_kb': 10000}}
+        within = {'home': {'p50_ms': 12.0, 'p95_ms': 30.0, 'queries': 2, 'peak_rss_kb': 14000},
+                  'new': {'p50_ms': 1.0, 'p95_ms': 1.0, 'queries': 1, 'peak_rss_kb': 0}}
+        self.assertEqual(compare_to_baseline(within, baseline, 0.5), [])
+        regressed = {'home': {'p50_ms': 12.0, 'p95_ms': 40.0, 'queries': 4, 'peak_rss_kb': 20000}}
+        self.assertEqual(len(compare_to_baseline(regressed, baseline, 0.5)), 3)
+        self.assertEqual(percentile([5, 1, 4, 2, 3], 0.5), 3)
+        self.assertEqual(percentile(range(1, 101), 0.95), 95)
+
+    def test_private_cache_leaves_the_site_cache_alone(self):
+        site = get_cache('default')  # the cache of the live processes
+        cache.set('benchmark_test', 'site')
+        with private_cache():
+            self.assertEqual(cache.get('benchmark_test'), None)
+            cache.set('benchmark_test', 'synthetic')
+            cache.clear()
+            cache.set('benchmark_test', 'synthetic')
+            self.assertEqual(site.get('benchmark_test'), 'site')
+        self.assertEqual(cache.get('benchmark_test'), 'site')
+
+
+class RecordingHandler(logging.Handler):
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+class QueryBudgetTests(QueryBudgetTestMixin, TestCase):
+    def setUp(self):
+        cache.clear()
+        create_django_page_tree()
+        call_command('generate_synthetic_data', meetings=1, abstracts=1, announcements=40, members=0,
+                     stdout=StringIO())
+
+    def drop_view_caches(self):
+        cache.delete(ACTIVE_ANNOUNCEMENTS_CACHE_KEY)
+
+    def test_views_are_within_budget(self):
+        self.assertWithinQueryBudget(reverse('base:home'))
+        announcement = Announcement.objects.filter(approved=True)[0]
+        self.assertWithinQueryBudget(reverse('base:announcement_detail', args=[announcement.pk]))
+        self.assertWithinQueryBudget(reverse('base:join'))
+
+    def test_over_budget_fails_and_is_logged(self):
+        handler = RecordingHandler()
+        logger = logging.getLogger('base.querybudget')
+        logger.addHandler(handler)
+        level, logger.level = logger.level, logging.INFO
+        AnnouncementView.query_budget = 0
+        try:
+            with self.assertRaises(self.failureException):
+                self.assertWithinQueryBudget(reverse('base:home'))
+        finally:
+            AnnouncementView.query_budget = 3
+            logger.removeHandler(handler)
+            logger.level = level
+        self.assertEqual(handler.records[-1].levelno, logging.WARNING)
+        self.assertIn('over its budget of 0', handler.records[-1].getMessage())
+        self.assertEqual(handler.records[-2].levelno, logging.INFO)
+
+    @override_settings(DEBUG=True)
+    def test_debug_headers(self):
+        response = self.client.get(reverse('base:home'))
+        self.assertEqual(response['X-Query-Count'], str(response.query_count))
+        self.assertTrue(float(response['X-Query-Time-Ms']) >= 0)
+        self.assertEqual(response['X-Query-Budget'], '3')
+
+    def test_queries_are_counted_without_the_debug_cursor(self):
+        self.client.get(reverse('base:home'))
+        self.drop_view_caches()
+        response = self.client.get(reverse('base:home'))
+        self.assertGreater(response.query_count, 0)
+        self.assertEqual(connection.queries, [])  # no sql kept outside debug mode
+        self.assertFalse(response.has_header('X-Query-Count'))
+        self.assertNotIn('cursor', connections[DEFAULT_DB_ALIAS].__dict__)  # restored after the request
+        self.drop_view_caches()
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(reverse('base:home'))
+        self.assertEqual(response.query_count, len(context))
+
+
+class RequestProfileTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        create_django_page_tree()
+        self.profile_dir = tempfile.mkdtemp()
+        self.settings_override = override_settings(REQUEST_PROFILE_DIR=self.profile_dir, REQUEST_PROFILE_KEEP=2)
+        self.settings_override.enable()
+        User.objects.create_superuser('admin', 'admin@example.com', 'password')
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.profile_dir)
+
+    def test_requests_are_only_profiled_for_staff_that_ask(self):
+        self.assertFalse(self.client.get(reverse('base:home'), HTTP_X_PROFILE='1').has_header('X-Profile'))
+        self.client.login(username='admin', password='password')
+        self.assertFalse(self.client.get(reverse('base:home')).has_header('X-Profile'))
+        self.assertEqual(profile_names(), [])
+        # requests without the header or parameter do not load the user, the request factory sets none
+        self.assertFalse(profile_requested(RequestFactory().get(reverse('base:home'), {'q': 'profile'})))
+
+    def test_profiles_are_saved_rotated_and_listed(self):
+        self.client.login(username='admin', password='password')
+        names = [self.client.get(reverse('base:home'), {'_profile': '1'})['X-Profile'],
+                 self.client.get(reverse('meetings:meetings'), HTTP_X_PROFILE='1')['X-Profile'],
+                 self.client.get(reverse('base:join'), HTTP_X_PROFILE='1')['X-Profile']]
+        self.assertEqual(profile_names(), [names[2], names[1]])  # the oldest was removed
+        profile = read_profile(names[1])
+        self.assertEqual((profile['method'], profile['path']), ('GET', 'meetings'))
+        self.assertTrue(any('render' in function['function'] for function in profile['functions']))
+        response = self.client.get(reverse('request_profiles'))
+        self.assertContains(response, names[2])
+        self.assertContains(response, profile['functions'][0]['function'])
+        self.client.logout()
+        self.assertNotContains(self.client.get(reverse('request_profiles')), names[2])  # the admin login form
+
+
+class SqliteConfigurationTests(TestCase):
+    def pragma(self, connection, name):
+        cursor = connection.cursor()
+        cursor.execute('PRAGMA %s' % name)
+        return cursor.fetchone()[0]
+
+    def test_new_connections_are_configured(self):
+        directory = tempfile.mkdtemp()
+        file_connection = DatabaseWrapper(dict(connection.settings_dict, NAME=os.path.join(directory, 'db.sqlite3')))
+        try:
+            self.assertEqual(self.pragma(file_connection, 'journal_mode'), 'wal')
+            self.assertEqual(self.pragma(file_connection, 'synchronous'), 1)  # NORMAL
+            self.assertEqual(self.pragma(file_connection, 'busy_timeout'), 20000)
+        finally:
+            file_connection.close()
+            shutil.rmtree(directory)
+        self.assertEqual(self.pragma(connection, 'synchronous'), 1)  # the in-memory test database
+
+
+class BannerManifestTests(TestCase):
+    def setUp(self):
+        self.images_path = tempfile.mkdtemp()
+        Image.new('RGB', (1000, 400)).save(os.path.join(self.images_path, 'wide.jpeg'))
+        open(os.path.join(self.images_path, '.DS_Store'), 'w').close()  # not an image, should be skipped
+
+    def tearDown(self):
+        shutil.rmtree(self.images_path)
+
+    def test_manifest_records_dimensions_and_hashed_url(self):
+        images = banner.get_banner_manifest(self.images_path)
+        self.assertEqual(len(images), 1)
+        self.assertEqual(images[0]['name'], 'wide.jpeg')
+        self.assertEqual((images[0]['width'], images[0]['height']), (1000, 400))
+        self.assertTrue(images[0]['url'].startswith('/static/base/home_page_images/wide.jpeg?v='))
+
+    def test_manifest_is_rebuilt_only_when_directory_changes(self):
+        images = banner.get_banner_manifest(self.images_path)
+        self.assertIs(banner.get_banner_manifest(self.images_path), images)  # cached while mtime is unchanged
+        Image.new('RGB', (600, 600)).save(os.path.join(self.images_path, 'square.jpeg'))
+        mtime = os.stat(self.images_path).st_mtime + 10
+        os.utime(self.images_path, (mtime, mtime))
+        images = banner.get_banner_manifest(self.images_path)
+        self.assertEqual([image['name'] for image in images], ['square.jpeg', 'wide.jpeg'])
+
+
+class BouncingEmailBackend(EmailBackend):
+    """
+    A locmem backend that refuses messages to bounce addresses and counts the connections it opens.
+    """
+    bounce = True
+    opened = 0
+
+    def open(self):
+        BouncingEmailBackend.opened += 1
+
+    def send_messages(self, messages):
+        for message in messages:
+            if BouncingEmailBackend.bounce and 'bounce@example.com' in message.to:
+                raise Exception('Mailbox unavailable')
+        return super(BouncingEmailBackend, self).send_messages(messages)
+
+
+@override_settings(EMAIL_BACKEND='base.tests.BouncingEmailBackend')
+class MailQueueTests(TestCase):
+    def setUp(self):
+        BouncingEmailBackend.bounce = True
+        BouncingEmailBackend.opened = 0
+        addresses = ['member%s@example.com' % i for i in range(4)] + ['bounce@example.com']
+        self.batch = enqueue_mass_mail([('Meeting news', 'Hello', 'paleocore@paleocore.org', [address])
+                                        for address in addresses])
+
+    def test_enqueue_does_not_send(self):
+        self.assertEqual(len(mail.outbox), 0)
+        self.assertEqual(QueuedMessage.objects.filter(status='pending').count(), 5)
+        self.assertEqual(self.batch.total_count, 5)
+
+    def test_send_in_batches_over_reused_connections(self):
+        self.assertEqual(send_queued_mail(batch_size=3), (3, 0))
+        self.assertEqual(send_queued_mail(batch_size=3), (1, 1))
+        self.assertEqual(send_queued_mail(batch_size=3), (0, 0))
+        self.assertEqual(len(mail.outbox), 4)
+        self.assertEqual(BouncingEmailBackend.opened, 3)  # one per batch plus one reopen after the failure
+        batch = MailBatch.objects.get(pk=self.batch.pk)
+        self.assertEqual((batch.sent_count, batch.failed_count, batch.pending_count()), (4, 1, 0))
+        self.assertEqual(QueuedMessage.objects.get(status='failed').last_error, 'Mailbox unavailable')
+
+    def test_retry_resends_only_failed_messages(self):
+        send_queued_mail()
+        BouncingEmailBackend.bounce = False
+        self.assertEqual(retry_failed(), 1)
+        self.assertEqual(send_queued_mail(), (1, 0))
+        self.assertEqual(len(mail.outbox), 5)
+        self.assertEqual([m.to for m in mail.outbox].count(['bounce@example.com']), 1)
+        batch = MailBatch.objects.get(pk=self.batch.pk)
+        self.assertEqual((batch.sent_count, batch.failed_count), (5, 0))
+
+    def test_messages_claimed_by_another_worker_are_not_sent(self):
+        claimed = claim_queued_mail(3)  # another worker, still sending
+        self.assertEqual(QueuedMessage.objects.filter(status='sending').count(), 3)
+        self.assertEqual(send_queued_mail(), (1, 1))
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertNotIn(claimed[0].recipients, [','.join(m.to) for m in mail.outbox])
+        self.assertEqual(claim_queued_mail(3), [])
+
+    def test_stale_claims_are_queued_again(self):
+        claim_queued_mail(3)  # by a worker that died
+        QueuedMessage.objects.filter(status='sending').update(
+            claimed=timezone.now() - datetime.timedelta(hours=2))
+        self.assertEqual(send_queued_mail(), (4, 1))
+        self.assertEqual(QueuedMessage.objects.filter(status='sending').count(), 0)
+
+
+class BlobStorageTests(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        self.settings_override.enable()
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.media_root)
+
+    def announcement(self, **uploads):
+        announcement = Announcement(title='Field school', short_title='Field school', stub='<p>Apply</p>',
+                                    category='Job', priority=1, expires=timezone.now() + datetime.timedelta(days=1))
+        for field, (filename, content) in uploads.items():
+            getattr(announcement, field).save(filename, ContentFile(content), save=False)
+        announcement.save()
+        return announcement
+
+    def reference_count(self, content):
+        return Blob.objects.get(digest=hashlib.sha256(content).hexdigest()).reference_count
+
+    def test_uploads_are_stored_once_by_content(self):
+        first = self.announcement(upload1=('flyer.pdf', 'flyer'), upload2=('poster.pdf', 'poster'))
+        second = self.announcement(upload1=('flyer.pdf', 'flyer'), upload2=('renamed flyer.pdf', 'flyer'))
+        digest = hashlib.sha256('flyer').hexdigest()
+        self.assertEqual(first.upload1.name, 'blobs/%s/%s/flyer.pdf' % (digest[:2], digest))
+        self.assertEqual(second.upload1.name, first.upload1.name)
+        self.assertEqual(second.upload2_filename(), 'renamed_flyer.pdf')  # the filename is kept
+        self.assertEqual(os.stat(first.upload1.path).st_ino, os.stat(second.upload2.path).st_ino)  # hard link
+        self.assertEqual(first.upload1.read(), 'flyer')
+        self.assertEqual(self.reference_count('flyer'), 3)
+        self.assertEqual(self.reference_count('poster'), 1)
+        self.assertEqual(Blob.objects.get(digest=digest).size, 5)
+        self.assertEqual(len(content_storage.blob_digests()), 2)
+        self.assertEqual(content_storage.temporary_files(), [])
+        self.assertEqual(blob_digest('uploads/files/flyer.pdf'), None)  # files uploaded before the blob store
+
+    def test_long_filenames_fit_the_field(self):
+        announcement = self.announcement(upload1=('%s.pdf' % ('program ' * 40), 'program'))
+        name = Announcement.objects.get(pk=announcement.pk).upload1.name
+        self.assertEqual(len(name), Announcement._meta.get_field('upload1').max_length)
+        self.assertTrue(name.startswith('blobs/') and name.endswith('.pdf'))  # the extension is kept
+
+    def test_references_follow_saves_and_deletes(self):
+        announcement = self.announcement(upload1=('flyer.pdf', 'flyer'))
+        announcement = Announcement.objects.get(pk=announcement.pk)
+        announcement.upload1.save('flyer.pdf', ContentFile('new flyer'))
+        self.assertEqual(self.reference_count('flyer'), 0)
+        self.assertEqual(self.reference_count('new flyer'), 1)
+        announcement.title = 'Field school 2015'
+        announcement.save()
+        self.assertEqual(self.reference_count('new flyer'), 1)
+        announcement.delete()
+        self.assertEqual(self.reference_count('new flyer'), 0)
+
+    def test_collect_deletes_only_unreferenced_blobs(self):
+        kept = self.announcement(upload1=('flyer.pdf', 'flyer'))
+        self.announcement(upload1=('poster.pdf', 'poster')).delete()
+        self.assertEqual(collect_blobs(), ([], 0))  # within the grace period
+        poster = hashlib.sha256('poster').hexdigest()
+        self.assertEqual(collect_blobs(datetime.timedelta(0), dry_run=True), ([poster], 6))
+        self.assertEqual(len(content_storage.blob_digests()), 2)
+        self.assertEqual(collect_blobs(datetime.timedelta(0)), ([poster], 6))
+        self.assertEqual(content_storage.blob_digests(), [hashlib.sha256('flyer').hexdigest()])
+        self.assertEqual(list(Blob.objects.values_list('digest', flat=True)), [hashlib.sha256('flyer').hexdigest()])
+        self.assertEqual(Announcement.objects.get(pk=kept.pk).upload1.read(), 'flyer')
+
+    def test_uploads_of_collectable_blobs_are_kept(self):
+        self.announcement(upload1=('poster.pdf', 'poster')).delete()
+        poster = hashlib.sha256('poster').hexdigest()
+        directory = content_storage.path(os.path.dirname(content_storage.save('poster.pdf', ContentFile('poster'))))
+        old = time.time() - 2 * 24 * 60 * 60
+        os.utime(directory, (old, old))
+        self.assertEqual(collect_blobs(dry_run=True), ([poster], 6))
+        content_storage.save('poster.pdf', ContentFile('poster'))  # uploaded again, not yet saved to its model
+        self.assertEqual(collect_blobs(), ([], 0))
+
+    def test_stale_counts_never_delete_files_in_use(self):
+        announcement = self.announcement(upload1=('flyer.pdf', 'flyer'))
+        Blob.objects.update(reference_count=0)
+        self.assertEqual(collect_blobs(datetime.timedelta(0)), ([], 0))
+        self.assertTrue(os.path.exists(announcement.upload1.path))
+        self.assertEqual(recount_blob_references(), 1)
+        self.assertEqual(self.reference_count('flyer'), 1)
+        out = StringIO()
+        call_command('collect_blobs', grace=0, stdout=out)
+        self.assertIn('Deleted 0 blobs', out.getvalue())
+
+
+class MediaServingTests(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        self.settings_override.enable()
+        create_django_page_tree()  # for the menus of the 404 page
+        self.name = content_storage.save('uploads/files/program.pdf', ContentFile('0123456789'))
+        self.url = '/media/' + self.name
+        self.digest = hashlib.sha256('0123456789').hexdigest()
+        os.makedirs(os.path.join(self.media_root, 'uploads', 'files'))
+        with open(os.path.join(self.media_root, 'uploads', 'files', 'old program.pdf'), 'wb') as old_file:
+            old_file.write('old program')
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.media_root)
+
+    def content(self, response):
+        return ''.join(response.streaming_content)
+
+    def test_whole_file(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.content(response), '0123456789')
+        self.assertEqual((response['Content-Type'], response['Content-Length']), ('application/pdf', '10'))
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertEqual(response['ETag'], '"%s"' % self.digest)
+        self.assertIn('immutable', response['Cache-Control'])
+        old = self.client.get('/media/uploads/files/old%20program.pdf')
+        self.assertEqual(self.content(old), 'old program')
+        self.assertFalse(old.has_header('Cache-Control'))  # may be replaced under the same name
+
+    def test_private_directories_are_not_served(self):
+        os.makedirs(os.path.join(self.media_root, 'meetings', 'program_books'))
+        with open(os.path.join(self.media_root, 'meetings', 'program_books', 'program_book_2016.html'), 'w') as book:
+            book.write('<html></html>')
+        for url in ['/media/meetings/program_books/program_book_2016.html',
+                    '/media/meetings/./program_books//program_book_2016.html',
+                    '/media/uploads/../meetings/program_books/program_book_2016.html']:
+            self.assertEqual(self.client.get(url).status_code, 404)
+
+    def test_ranges(self):
+        response = self.client.get(self.url, HTTP_RANGE='bytes=2-5')
+        self.assertEqual((response.status_code, self.content(response)), (206, '2345'))
+        self.assertEqual(response['Content-Range'], 'bytes 2-5/10')
+        self.assertEqual(response['Content-Length'], '4')
+        self.assertEqual(self.content(self.client.get(self.url, HTTP_RANGE='bytes=7-')), '789')
+        self.assertEqual(self.content(self.client.get(self.url, HTTP_RANGE='bytes=-3')), '789')
+        self.assertEqual(self.content(self.client.get(self.url, HTTP_RANGE='bytes=8-100')), '89')
+        unsatisfiable = self.client.get(self.url, HTTP_RANGE='bytes=10-')
+        self.assertEqual((unsatisfiable.status_code, unsatisfiable['Content-Range']), (416, 'bytes */10'))
+        resumed = self.client.get(self.url, HTTP_RANGE='bytes=5-', HTTP_IF_RANGE='"%s"' % self.digest)
+        self.assertEqual((resumed.status_code, self.content(resumed)), (206, '56789'))
+        changed = self.client.get(self.url, HTTP_RANGE='bytes=5-', HTTP_IF_RANGE='"another version"')
+        self.assertEqual((changed.status_code, self.content(changed)), (200, '0123456789'))
+        self.assertEqual(parse_range('bytes=0-1,4-5', 10), None)  # multiple ranges get the whole file
+        self.assertEqual(parse_range('bytes=5-2', 10), None)
+
+    def test_conditional_requests(self):
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH='"other", W/"%s"' % self.digest)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], '"%s"' % self.digest)
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH='"other"').status_code, 200)
+        modified = os.stat(content_storage.path(self.name)).st_mtime
+        self.assertEqual(self.client.get(self.url, HTTP_IF_MODIFIED_SINCE=http_date(modified)).status_code, 304)
+        self.assertEqual(self.client.get(self.url, HTTP_IF_MODIFIED_SINCE=http_date(modified - 60)).status_code,
+                         200)
+
+    def test_sendfile_offload(self):
+        with self.settings(MEDIA_SENDFILE='x-accel-redirect', MEDIA_ACCEL_REDIRECT_PREFIX='/protected/'):
+            response = self.client.get('/media/uploads/files/old%20program.pdf')
+            self.assertEqual(response['X-Accel-Redirect'], '/protected/uploads/files/old%20program.pdf')
+            self.assertEqual(response.content, '')
+        with self.settings(MEDIA_SENDFILE='x-sendfile'):
+            response = self.client.get(self.url)
+            self.assertEqual(response['X-Sendfile'], content_storage.path(self.name))
+            self.assertEqual(response['ETag'], '"%s"' % self.digest)
+
+    def test_only_files_in_media_root(self):
+        self.assertEqual(self.client.get('/media/../myproject/settings.py').status_code, 404)
+        self.assertEqual(self.client.get('/media/uploads/files/').status_code, 404)
+        self.assertEqual(self.client.get('/media/uploads/files/missing.pdf').status_code, 404)
+        self.assertEqual(self.client.post(self.url).status_code, 405)
+
+
+class BannerVariantTests(TestCase):
+    def setUp(self):
+        self.images_path = tempfile.mkdtemp()
+        Image.new('RGB', (1000, 400), 'red').save(os.path.join(self.images_path, 'wide.jpeg'))
+        Image.new('RGB', (400, 400), 'blue').save(os.path.join(self.images_path, 'small.jpeg'))
+        open(os.path.join(self.images_path, '.DS_Store'), 'w').close()  # not an image, should be skipped
+
+    def tearDown(self):
+        shutil.rmtree(self.images_path)
+
+    def variant_files(self):
+        return sorted(os.listdir(os.path.join(self.images_path, 'variants')))
+
+    def test_variants_are_generated_once(self):
+        self.assertEqual(generate_banner_variants(self.images_path, (320, 500)), ['small.jpeg', 'wide.jpeg'])
+        manifest = read_variant_manifest(self.images_path)
+        self.assertEqual([v['width'] for v in manifest['wide.jpeg']['variants']['jpg']], [320, 500])  # and the banner
+        self.assertEqual([v['width'] for v in manifest['wide.jpeg']['variants']['webp']], [320, 500, 1000])
+        self.assertEqual([v['width'] for v in manifest['small.jpeg']['variants']['webp']], [320, 400])  # no upscaling
+        variant = manifest['wide.jpeg']['variants']['jpg'][0]
+        self.assertEqual(variant['height'], 128)
+        image = Image.open(os.path.join(self.images_path, 'variants', variant['file']))
+        self.assertEqual((image.format, image.size), ('JPEG', (320, 128)))
+        self.assertTrue(image.info.get('progressive'))
+        webp = manifest['wide.jpeg']['variants']['webp'][1]['file']
+        self.assertEqual(Image.open(os.path.join(self.images_path, 'variants', webp)).format, 'WEBP')
+        self.assertEqual(len(self.variant_files()), 8 + 1)  # with the manifest
+        self.assertEqual(generate_banner_variants(self.images_path, (320, 500)), [])
+
+    def test_variants_hold_one_image_in_their_format(self):
+        os.remove(os.path.join(self.images_path, '.DS_Store'))
+        os.remove(os.path.join(self.images_path, 'small.jpeg'))  # only the banner itself
+        generate_banner_variants(self.images_path, (320, 500))
+        variants = read_variant_manifest(self.images_path)['wide.jpeg']['variants']
+        for extension, image_format in [('jpg', 'JPEG'), ('webp', 'WEBP')]:
+            for variant in variants[extension]:
+                path = os.path.join(self.images_path, 'variants', variant['file'])
+                self.assertEqual(Image.open(path).format, image_format)
+                with open(path, 'rb') as variant_file:
+                    data = variant_file.read()
+                if image_format == 'JPEG':
+                    self.assertEqual((data.count(b'\xff\xd8\xff'), data.count(b'\xff\xd9')), (1, 1))
+                    self.assertTrue(data.endswith(b'\xff\xd9'))
+                else:
+                    self.assertEqual((data[:4], data[8:12]), (b'RIFF', b'WEBP'))
+                    self.assertEqual(struct.unpack('<I', data[4:8])[0] + 8, len(data))
+
+    def test_formats_pil_cannot_save_are_skipped(self):
+        Image.init()
+        save_webp = Image.SAVE.pop('WEBP')  # as in a Pillow built without libwebp
+        try:
+            self.assertEqual(generate_banner_variants(self.images_path, (320,)), ['small.jpeg', 'wide.jpeg'])
+            small, wide = banner.get_banner_manifest(self.images_path)
+        finally:
+            Image.SAVE['WEBP'] = save_webp
+        self.assertEqual(read_variant_manifest(self.images_path)['wide.jpeg']['variants']['webp'], [])
+        self.assertEqual([name for name in self.variant_files() if name.endswith('.webp')], [])
+        self.assertIn('wide-320w.', wide['srcset'])
+        self.assertNotIn('webp_srcset', wide)
+        # generated again once WebP can be saved
+        self.assertEqual(generate_banner_variants(self.images_path, (320,)), ['small.jpeg', 'wide.jpeg'])
+
+    def test_changed_and_removed_banners(self):
+        generate_banner_variants(self.images_path, (320,))
+        old_files = self.variant_files()
+        Image.new('RGB', (1000, 400), 'green').save(os.path.join(self.images_path, 'wide.jpeg'))
+        os.remove(os.path.join(self.images_path, 'small.jpeg'))
+        self.assertEqual(generate_banner_variants(self.images_path, (320,)), ['wide.jpeg'])
+        self.assertEqual(read_variant_manifest(self.images_path).keys(), ['wide.jpeg'])
+        self.assertEqual(len(self.variant_files()), 3 + 1)
+        self.assertEqual(set(old_files) & set(self.variant_files()), set(['manifest.json']))  # new names bust caches
+
+    def test_manifest_has_srcset_of_current_variants(self):
+        self.assertNotIn('srcset', banner.get_banner_manifest(self.images_path)[0])
+        generate_banner_variants(self.images_path, (320,))
+        small, wide = banner.get_banner_manifest(self.images_path)  # rebuilt for the new variant manifest
+        self.assertRegexpMatches(wide['srcset'], r'^/static/base/home_page_images/variants/wide-320w\.\w+\.jpg 320w, '
+                                                 r'/static/base/home_page_images/wide\.jpeg\?v=\w+ 1000w$')
+        self.assertIn('wide-1000w.', wide['webp_srcset'])
+        Image.new('RGB', (1000, 400), 'green').save(os.path.join(self.images_path, 'wide.jpeg'))
+        mtime = os.stat(self.images_path).st_mtime + 10
+        os.utime(self.images_path, (mtime, mtime))
+        self.assertNotIn('srcset', banner.get_banner_manifest(self.images_path)[1])  # stale variants are not used
+
+    def test_variants_larger_than_the_banner_are_dropped(self):
+        Image.effect_noise((400, 200), 100).convert('RGB').save(os.path.join(self.images_path, 'noisy.jpeg'),
+                                                                   quality=10)
+        generate_banner_variants(self.images_path, (320,))
+        self.assertEqual(read_variant_manifest(self.images_path)['noisy.jpeg']['variants'], {'jpg': [], 'webp': []})
+        self.assertNotIn('srcset', banner.get_banner_manifest(self.images_path)[0])
@@ -1,8 +1,21 @@
 from django.views import generic
 from models import Announcement
 from django.core.urlresolvers import reverse
-from fiber.views import FiberPageMixin
-from django.utils import timezone
+from django.conf import settings
+from django.contrib.admin.views.decorators import staff_member_required
+from django.contrib.auth.models import AnonymousUser
+from django.shortcuts import render
+from django.http import HttpResponseNotFound, Http404
+from django.utils._os import safe_join
+from django.views.decorators.http import require_safe
+from django.template.loader import render_to_string
+from fiber.views import FiberTemplateView
+from pagecache import CachedFiberPageMixin, cached_in_process, fiber_page_urls
+from querybudget import QueryBudgetMixin, query_budget
+from profiling import profile_names, read_profile
+from media import media_response
+import os
+import posixpath
 
 
 ########################
@@ -10,23 +23,23 @@ from django.utils import timezone
 ########################
 
 
-class AnnouncementView(FiberPageMixin, generic.ListView):
+class AnnouncementView(QueryBudgetMixin, CachedFiberPageMixin, generic.ListView):
     template_name = 'base/home.html'
     context_object_name = 'announcement_list'
+    query_budget = 3
 
     def get_queryset(self):
         """Return a list of current announcements"""
-        now = timezone.now()
-        return Announcement.objects.filter(pub_date__lte=now).\
-            filter(expires__gt=now).filter(approved=True).order_by('-pub_date', '-created')
+        return Announcement.objects.active()
 
     def get_fiber_page_url(self):
         return reverse('base:home')
 
 
-class AnnouncementDetailView(FiberPageMixin, generic.DetailView):
+class AnnouncementDetailView(QueryBudgetMixin, CachedFiberPageMixin, generic.DetailView):
     template_name = 'base/detail.html'
     model = Announcement
+    query_budget = 3
 
     # A class to combine the context for the fiber page with the general context.
     def get_fiber_page_url(self):
@@ -37,7 +50,9 @@ class AnnouncementDetailView(FiberPageMixin, generic.DetailView):
 ## Join Page Views ##
 #####################
 
-class JoinIndexView(FiberPageMixin, generic.ListView):
+class JoinIndexView(QueryBudgetMixin, CachedFiberPageMixin, generic.ListView):
+    query_budget = 3
+
     # A class to combine the context for the fiber page with the general context.
     def get_fiber_page_url(self):
         return reverse('base:join')
@@ -49,6 +64,71 @@ class JoinView(JoinIndexView):
 
     def get_queryset(self):
         """Return a list of current announcements"""
-        now = timezone.now()
-        return Announcement.objects.filter(pub_date__lte=now).\
-            filter(expires__gt=now).filter(approved=True).order_by('-pub_date')
+        return Announcement.objects.active()
+
+
+######################
+## Fiber Page Views ##
+######################
+
+def page_not_found_response():
+    """
+    A 404 response whose page is rendered once per process and generation, for requests that cannot match any page.
+    """
+    content = cached_in_process(('not_found',), lambda: render_to_string('404.html', {'user': AnonymousUser()}))
+    return HttpResponseNotFound(content)
+
+
+class FiberPageView(QueryBudgetMixin, CachedFiberPageMixin, FiberTemplateView):
+    """
+    The fiber catch-all page view, with the page lookup cached. Paths that cannot match any fiber page, such as
+    scanner probes for /wp-login.php, get the pre-rendered 404 page without touching the database.
+    """
+    query_budget = 3
+
+    def dispatch(self, request, *args, **kwargs):
+        path = request.path_info
+        urls = fiber_page_urls()
+        # fiber redirects paths missing their trailing slash, so let those through when the slashed path is a page
+        if path not in urls and not (settings.APPEND_SLASH and path + '/' in urls):
+            return page_not_found_response()
+        return super(FiberPageView, self).dispatch(request, *args, **kwargs)
+
+page = FiberPageView.as_view()
+
+
+############################
+## Request Profiles Admin ##
+############################
+
+@staff_member_required
+def request_profiles(request):
+    """
+    List the saved request profiles, newest first, with the functions that took the most cumulative time.
+    """
+    profiles = [read_profile(name) for name in profile_names()]
+    return render(request, 'admin/base/request_profiles.html', {'title': 'Request profiles', 'profiles': profiles})
+
+
+#################
+## Media Files ##
+#################
+
+@require_safe
+@query_budget(0)
+def serve_media(request, path):
+    """
+    Serve an uploaded file from MEDIA_ROOT, with range and conditional requests, see base.media. Files in the
+    MEDIA_PRIVATE_DIRS are not served.
+    """
+    name = posixpath.normpath(path).lstrip('/')
+    if any((name.lower() + '/').startswith(directory.lower().rstrip('/') + '/')
+           for directory in getattr(settings, 'MEDIA_PRIVATE_DIRS', ())):
+        raise Http404
+    try:
+        full_path = safe_join(settings.MEDIA_ROOT, name)
+    except ValueError:  # outside MEDIA_ROOT
+        raise Http404
+    if not os.path.isfile(full_path):
+        raise Http404
+    return media_response(request, name, full_path)
@@ -2,33 +2,21 @@ from django.contrib import admin
 from models import *
 from django import forms
 from django.forms.widgets import Textarea
-from django.http import HttpResponse
+from django.http import HttpResponse, StreamingHttpResponse
 from django.template import loader, Context
-import unicodecsv
+from exports import stream_abstract_csv, get_program_book, render_abstracts_html
+from search import filter_abstracts
+from base.querybudget import query_budget
 
 
 ###########################
 # Abstract Report Actions #
 ###########################
 
+@query_budget(8)
 def create_abstract_csv(modeladmin, request, queryset):
-    response = HttpResponse(content_type='text/csv')
-    response['Content-Disposition'] = 'attachment; filename="taba_abstracts.csv"'
-    writer = unicodecsv.writer(response)
-    writer.writerow(['id', 'contact_email', 'presentation_type', 'title', 'abstract_text', 'acknowledgements',
-                     'references', 'comments', 'year', 'abstract_rank', 'authors'])
-
-    for abstract in queryset.all():
-        author_list = []
-        for a in abstract.author_set.all().order_by('author_rank'):
-            author_list.append(a.name)
-        writer.writerow(
-            [abstract.id, abstract.contact_email, abstract.presentation_type, abstract.title, abstract.abstract_text,
-             abstract.acknowledgements, abstract.references, abstract.comments, abstract.year,
-             abstract.abstract_rank, ', '.join(author_list)]
-        )
-
-    return response
+    # Rows are streamed in chunks with authors prefetched, see meetings.exports
+    return stream_abstract_csv(queryset)
 create_abstract_csv.short_description = "Download .csv"
 
 
@@ -62,33 +50,24 @@ create_abstract_csv.short_description = "Download .csv"
 #     return response
 # create_abstract4meeting_html.short_description = "Download .html for meeting"
 
+@query_budget(15)
 def create_abstract4meeting_html(modeladmin, request, queryset):
-    abstracts = queryset.order_by('abstract_rank')
-    for abstract in abstracts:
-        abstract.authors = abstract.author_set.all().order_by("author_rank")
-        # if len(abstract.authors) > 2:
-        #     try:
-        #         abstract.authors = abstract.authors[0].name.split()[-1]+" et al."  # get the last name
-        #     except IndexError:
-        #         abstract.authors = abstract.authors[0].name.split()[0]+" et al."
-        # if len(abstract.authors) == 2:
-        #     try:
-        #         abstract.authors = abstract.authors[0].name.split()[-1]+" and "+abstract.authors[1].name.split()[-1]
-        #     except IndexError:
-        #         abstract.authors = abstract.authors[0].name.split()[0]+" and "+abstract.authors[1].name.split()[0]
-        # if len(abstract.authors) == 1:
-        #     try:
-        #         abstract.authors = abstract.authors[0].name.split()[-1]  # get the last name
-        #     except IndexError:
-        #         abstract.authors = abstract.authors[0].name.split()[0]  # get the last name
-
-    response = HttpResponse(content_type='text/csv')
+    """
+    Download the program book html of the selected abstracts. When the selection is exactly the accepted
+    abstracts of one meeting the stored program book is served, and rebuilt only if the meeting has changed.
+    Any other selection is rendered directly, with only the selected abstracts.
+    """
+    selected = list(queryset.values_list('meeting', 'accepted'))
+    meeting_ids = set(meeting_id for meeting_id, accepted in selected)
+    # the selection is only accepted abstracts of one meeting, and as many as the meeting has
+    if len(meeting_ids) == 1 and all(accepted for meeting_id, accepted in selected) and \
+            len(selected) == Abstract.objects.filter(meeting__in=meeting_ids, accepted=True).count():
+        book = get_program_book(Meeting.objects.get(pk=meeting_ids.pop()))
+        response = StreamingHttpResponse(book.html.chunks(), content_type='text/html; charset=utf-8')
+    else:
+        response = HttpResponse(render_abstracts_html(queryset.order_by('abstract_rank')),
+                                content_type='text/html; charset=utf-8')
     response['Content-Disposition'] = 'attachment; filename="PaleoAnthro_abstracts_for_meeting.html"'
-    t = loader.get_template("meetings/abstract_meeting_template.html")
-    c = Context({
-        'data': abstracts,
-    })
-    response.write(t.render(c))
     return response
 create_abstract4meeting_html.short_description = "Download .html for meeting"
 
@@ -117,8 +96,9 @@ class AbstractAdminForm(forms.ModelForm):
 
 
 class AbstractAdmin(admin.ModelAdmin):
-    list_display = ('id', 'contact_email', 'presentation_type', 'title', 'year', 'abstract_rank', 'accepted')
-    list_display_links = ['id', 'title']
+    list_display = ('id', 'contact_email', 'presentation_type', 'title_text', 'lead_author_last_name', 'year',
+                    'abstract_rank', 'accepted')
+    list_display_links = ['id', 'title_text']
     list_editable = ['accepted', 'abstract_rank']
     list_filter = ['year', 'presentation_type', 'accepted']
     search_fields = ['title', 'author__name']
@@ -126,6 +106,20 @@ class AbstractAdmin(admin.ModelAdmin):
     inlines = [AuthorInline, ]
     actions = [create_abstract_csv, create_abstract4meeting_html]
 
+    @query_budget(10)
+    def changelist_view(self, request, extra_context=None):
+        return super(AbstractAdmin, self).changelist_view(request, extra_context)
+
+    def get_queryset(self, request):
+        # the lead author column reads the prefetched authors
+        return super(AbstractAdmin, self).get_queryset(request).prefetch_related('author_set')
+
+    def get_search_results(self, request, queryset, search_term):
+        # Use the full text index rather than LIKE scans joined to Author, which also return duplicate rows
+        if not search_term:
+            return queryset, False
+        return filter_abstracts(queryset, search_term), False
+
 
 class AbstractInline(admin.TabularInline):
     model = Abstract
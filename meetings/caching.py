@@ -0,0 +1,19 @@
+"""
+Cache keys for rendered meeting detail pages. Entries are keyed by year and by the fiber page generation,
+so they are dropped individually when the abstracts, authors or meeting for a year change, and all at once
+when the fiber page tree changes. Pages are cached for a day, which relies on the shared cache of CACHES for the
+drops to reach every process.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from base.pagecache import fiber_generation
+
+MEETING_DETAIL_CACHE_TIMEOUT = getattr(settings, 'MEETING_DETAIL_CACHE_TIMEOUT', 60 * 60 * 24)
+
+
+def meeting_detail_cache_key(year):
+    return 'meetings_detail_%s_%s' % (fiber_generation(), year)
+
+
+def invalidate_meeting_detail(year):
+    cache.delete(meeting_detail_cache_key(year))
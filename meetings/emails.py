@@ -0,0 +1,27 @@
+"""
+Emails about abstract submissions. They are queued in the outbound mail queue (base.mailqueue) in the
+transaction that saves the submission, and sent by the send_queued_mail worker, so a slow or unreachable mail
+server never delays or fails a submission, and a submission that is rolled back sends nothing.
+"""
+from django.conf import settings
+from django.template.loader import render_to_string
+from base.mailqueue import enqueue_mail
+
+ABSTRACT_FROM_EMAIL = getattr(settings, 'ABSTRACT_FROM_EMAIL', settings.DEFAULT_FROM_EMAIL)
+PROGRAM_COMMITTEE_EMAILS = getattr(settings, 'PROGRAM_COMMITTEE_EMAILS', [])
+
+
+def enqueue_submission_emails(abstract):
+    """
+    Queue the confirmation to the contact email of a newly submitted abstract, and its copy to the program
+    committee. Returns the queued messages.
+    """
+    context = {'abstract': abstract, 'meeting': abstract.meeting, 'authors': list(abstract.author_set.all())}
+    messages = [enqueue_mail('Paleoanthropology Abstract Submission',
+                             render_to_string('meetings/email/abstract_confirmation.txt', context),
+                             ABSTRACT_FROM_EMAIL, [abstract.contact_email])]
+    if PROGRAM_COMMITTEE_EMAILS:
+        messages.append(enqueue_mail(('Abstract submission: %s' % abstract.title_text)[:255],
+                                     render_to_string('meetings/email/abstract_committee.txt', context),
+                                     ABSTRACT_FROM_EMAIL, PROGRAM_COMMITTEE_EMAILS))
+    return messages
@@ -0,0 +1,101 @@
+from django.core.files.base import ContentFile
+from django.http import StreamingHttpResponse
+from django.template import loader, Context
+from models import Abstract, ProgramBook
+import hashlib
+import unicodecsv
+
+# title and abstract_text are exported as plain text
+ABSTRACT_CSV_HEADER = ['id', 'contact_email', 'presentation_type', 'title', 'abstract_text', 'acknowledgements',
+                       'references', 'comments', 'year', 'abstract_rank', 'authors', 'word_count']
+EXPORT_CHUNK_SIZE = 500
+
+
+class Echo(object):
+    """
+    A file-like object that returns what is written to it instead of buffering it,
+    so a csv writer can feed a StreamingHttpResponse one row at a time.
+    """
+    def write(self, value):
+        return value
+
+
+def iter_abstracts_with_authors(queryset, chunk_size=EXPORT_CHUNK_SIZE):
+    """
+    Iterate over the abstracts in queryset in primary key order, loading chunk_size abstracts at a time
+    with their authors prefetched. Each chunk costs two queries however many authors the abstracts have,
+    and only one chunk is held in memory at a time.
+    """
+    queryset = queryset.order_by('pk').prefetch_related('author_set')
+    last_pk = 0
+    while True:
+        chunk = list(queryset.filter(pk__gt=last_pk)[:chunk_size])
+        if not chunk:
+            break
+        for abstract in chunk:
+            yield abstract
+        if len(chunk) < chunk_size:  # a short chunk is the last one
+            break
+        last_pk = chunk[-1].pk
+
+
+def abstract_csv_rows(queryset, chunk_size=EXPORT_CHUNK_SIZE):
+    yield ABSTRACT_CSV_HEADER
+    for abstract in iter_abstracts_with_authors(queryset, chunk_size):
+        author_list = [a.name for a in abstract.author_set.all()]  # prefetched, ordered by author_rank
+        yield [abstract.id, abstract.contact_email, abstract.presentation_type, abstract.title_text,
+               abstract.abstract_plain_text, abstract.acknowledgements, abstract.references, abstract.comments,
+               abstract.year, abstract.abstract_rank, ', '.join(author_list), abstract.word_count]
+
+
+def stream_abstract_csv(queryset, filename='taba_abstracts.csv', chunk_size=EXPORT_CHUNK_SIZE):
+    """
+    Return a StreamingHttpResponse that writes the abstracts in queryset as csv rows as they are read
+    from the database, rather than building the whole file in memory.
+    """
+    writer = unicodecsv.writer(Echo())
+    response = StreamingHttpResponse((writer.writerow(row) for row in abstract_csv_rows(queryset, chunk_size)),
+                                     content_type='text/csv')
+    response['Content-Disposition'] = 'attachment; filename="%s"' % filename
+    return response
+
+
+def render_abstracts_html(abstracts):
+    """
+    Render the meeting abstracts template for a queryset of abstracts, with authors prefetched.
+    """
+    abstracts = list(abstracts.prefetch_related('author_set'))
+    for abstract in abstracts:
+        abstract.authors = abstract.author_set.all()  # prefetched, ordered by author_rank
+    t = loader.get_template("meetings/abstract_meeting_template.html")
+    return t.render(Context({'data': abstracts}))
+
+
+def program_book_fingerprint(meeting):
+    """
+    A hash of the id, last_modified date and abstract_rank of every accepted abstract for the meeting.
+    """
+    fingerprint = hashlib.sha1()
+    for values in Abstract.objects.filter(meeting=meeting, accepted=True).order_by('pk').\
+            values_list('id', 'last_modified', 'abstract_rank'):
+        fingerprint.update(repr(values))
+    return fingerprint.hexdigest()
+
+
+def get_program_book(meeting):
+    """
+    Return the ProgramBook for a meeting, rendering and storing the html for the accepted abstracts
+    only if the stored file is missing, stale, or was built from a different fingerprint.
+    """
+    book, created = ProgramBook.objects.get_or_create(meeting=meeting)
+    fingerprint = program_book_fingerprint(meeting)
+    if book.stale or book.fingerprint != fingerprint or not book.html or not book.html.storage.exists(book.html.name):
+        abstracts = Abstract.objects.filter(meeting=meeting, accepted=True).order_by('abstract_rank')
+        html = render_abstracts_html(abstracts)
+        if book.html:
+            book.html.delete(save=False)
+        book.html.save('program_book_%s.html' % meeting.year, ContentFile(html.encode('utf-8')), save=False)
+        book.fingerprint = fingerprint
+        book.stale = False
+        book.save()
+    return book
@@ -1,35 +1,46 @@
 from django.forms import ModelForm
-from models import Abstract, Author, Meeting
+from models import Abstract, Author, ABSTRACT_WORD_LIMIT
 from django.forms.models import inlineformset_factory
-from django.forms.widgets import Textarea, TextInput, HiddenInput, EmailInput
+from django.forms.widgets import Textarea, TextInput, EmailInput
 from django import forms
+from django.db import transaction
 from captcha.fields import CaptchaField
+import text
 
 
 # Abstract Model Form
 class AbstractForm(ModelForm):
+    # meeting and year are not form fields, the view sets them on the instance from Meeting.objects.current()
     confirm_email = forms.EmailField(widget=TextInput(attrs={'size': 60}))
-    meeting = forms.ModelChoiceField(queryset=Meeting.objects.filter(year__exact=2017), empty_label=None)
-    year = forms.IntegerField(widget=HiddenInput, initial=2017)
     #human_test = CaptchaField(help_text='Enter the solution')
 
+    def clean_abstract_text(self):
+        abstract_text = self.cleaned_data['abstract_text']
+        words = text.word_count(text.html_to_text(abstract_text))
+        if words > ABSTRACT_WORD_LIMIT:
+            raise forms.ValidationError('Abstracts are limited to %s words, this abstract has %s.' %
+                                        (ABSTRACT_WORD_LIMIT, words))
+        return abstract_text
+
     def clean(self):
         cleaned_data = super(AbstractForm, self).clean()
         contact_email = cleaned_data.get('contact_email')
         confirm_email = cleaned_data.get('confirm_email')
 
-        if contact_email != confirm_email:
+        if contact_email and confirm_email and contact_email != confirm_email:
+            # Django 1.6 forms have no add_error, errors are set as in its documentation
             msg = 'Emails do not match'
-            self.add_error('contact_email', msg)
-            self.add_error('confirm_email', msg)
+            self._errors['contact_email'] = self.error_class([msg])
+            self._errors['confirm_email'] = self.error_class([msg])
+            del cleaned_data['contact_email']
+            del cleaned_data['confirm_email']
+        return cleaned_data
 
 
 
     class Meta:
         model = Abstract
         fields = (
-            'year',
-            'meeting',
             'presentation_type',
             'title',
             'abstract_text',
@@ -72,3 +83,16 @@ AuthorInlineFormSet = inlineformset_factory(Abstract, Author,
                                             can_delete=False,
                                             )
 
+
+
+def save_abstract_submission(form, author_formset):
+    """
+    Save a valid abstract form and its author formset in one transaction, so a failure never leaves an abstract
+    without its authors. Authors are inserted with one statement and ranked in the order entered.
+    Returns the abstract.
+    """
+    with transaction.atomic():
+        abstract = form.save()
+        author_formset.instance = abstract
+        abstract.create_authors(author_formset.save(commit=False))
+    return abstract
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from meetings.models import Abstract
+from meetings.search import rebuild_index
+from backfill_lead_author_sort import add_missing_column
+
+TEXT_FIELDS = ['title', 'abstract_text', 'title_text', 'abstract_plain_text', 'word_count']
+
+
+class Command(BaseCommand):
+    help = """Add the plain text and word count columns to an existing meetings_abstract table if they are missing,
+    sanitize the title and text of every abstract, store their plain text and word count, and rebuild the
+    search index from the plain text."""
+
+    def handle(self, *args, **options):
+        for field_name in ['title_text', 'abstract_plain_text', 'word_count']:
+            add_missing_column(Abstract, field_name, self.stdout)
+        updated = 0
+        with transaction.atomic():
+            for abstract in Abstract.objects.only(*TEXT_FIELDS).iterator():
+                before = [getattr(abstract, field) for field in TEXT_FIELDS]
+                abstract.prepare_text()
+                after = [getattr(abstract, field) for field in TEXT_FIELDS]
+                if after != before:
+                    # update() rather than save(), which would also touch last_modified and reindex each abstract
+                    Abstract.objects.filter(pk=abstract.pk).update(**dict(zip(TEXT_FIELDS, after)))
+                    updated += 1
+        self.stdout.write('Updated the text of %s abstracts' % updated)
+        self.stdout.write('Indexed %s abstracts' % rebuild_index())
@@ -0,0 +1,40 @@
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from meetings.exports import iter_abstracts_with_authors
+from meetings.models import Abstract, lead_author_sort_key
+
+
+def add_missing_column(model, field_name, stdout):
+    """
+    Add the column of a field added to a model after its table was created by syncdb.
+    """
+    field = model._meta.get_field(field_name)
+    table = model._meta.db_table
+    cursor = connection.cursor()
+    columns = [column[0] for column in connection.introspection.get_table_description(cursor, table)]
+    if field.column not in columns:
+        qn = connection.ops.quote_name
+        default = field.get_default()
+        default = "''" if default == '' else int(default)  # the text and integer fields added to Abstract
+        cursor.execute("ALTER TABLE %s ADD COLUMN %s %s NOT NULL DEFAULT %s" %
+                       (qn(table), qn(field.column), field.db_type(connection), default))
+        stdout.write('Added column %s.%s' % (table, field.column))
+
+
+class Command(BaseCommand):
+    help = """Add the lead_author_sort column and its indexes to an existing meetings_abstract table if they
+    are missing, and set the lead author sort key of every abstract from its authors."""
+
+    def handle(self, *args, **options):
+        add_missing_column(Abstract, 'lead_author_sort', self.stdout)
+        call_command('create_indexes', 'meetings', stdout=self.stdout)
+        updated = 0
+        with transaction.atomic():
+            for abstract in iter_abstracts_with_authors(Abstract.objects.all()):
+                key = lead_author_sort_key(abstract.lead_author())
+                if key != abstract.lead_author_sort:
+                    # update() rather than save(), which would also touch last_modified
+                    Abstract.objects.filter(pk=abstract.pk).update(lead_author_sort=key)
+                    updated += 1
+        self.stdout.write('Updated the lead author sort key of %s abstracts' % updated)
@@ -0,0 +1,76 @@
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from django.http import HttpResponse
+from optparse import make_option
+from meetings.models import Meeting, Abstract, Author
+from meetings.exports import stream_abstract_csv
+import unicodecsv
+import resource
+import time
+
+
+def in_memory_abstract_csv(queryset):
+    """
+    The original create_abstract_csv implementation, kept for comparison. Builds the whole file in
+    an HttpResponse and queries the authors of each abstract separately.
+    """
+    response = HttpResponse(content_type='text/csv')
+    writer = unicodecsv.writer(response)
+    writer.writerow(['id', 'contact_email', 'presentation_type', 'title', 'abstract_text', 'acknowledgements',
+                     'references', 'comments', 'year', 'abstract_rank', 'authors'])
+    for abstract in queryset.all():
+        author_list = []
+        for a in abstract.author_set.all().order_by('author_rank'):
+            author_list.append(a.name)
+        writer.writerow(
+            [abstract.id, abstract.contact_email, abstract.presentation_type, abstract.title, abstract.abstract_text,
+             abstract.acknowledgements, abstract.references, abstract.comments, abstract.year,
+             abstract.abstract_rank, ', '.join(author_list)]
+        )
+    return response
+
+
+def peak_rss_kb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+class Command(BaseCommand):
+    help = """Time the abstract csv export on synthetic abstracts. The data is created inside a transaction
+    that is rolled back. Peak RSS is a process high-water mark, so the streaming export runs first and
+    each result reports how far that export raised the mark."""
+
+    option_list = BaseCommand.option_list + (
+        make_option('--abstracts', type='int', default=10000, help='Number of synthetic abstracts'),
+        make_option('--authors', type='int', default=3, help='Authors per abstract'),
+    )
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            queryset = self.create_abstracts(options['abstracts'], options['authors'])
+            # Each export returns the number of bytes written. Streamed chunks are discarded as they arrive.
+            self.report('streaming', lambda: sum(len(chunk) for chunk in stream_abstract_csv(queryset)))
+            self.report('in memory', lambda: len(in_memory_abstract_csv(queryset).content))
+            transaction.set_rollback(True)
+
+    def create_abstracts(self, abstract_count, author_count):
+        meeting = Meeting.objects.create(title='Benchmark Meeting', year=9999)
+        Abstract.objects.bulk_create([
+            Abstract(meeting=meeting, contact_email='bench@example.com', presentation_type='Paper',
+                     title='<p>Benchmark abstract %s</p>' % i, abstract_text='<p>%s</p>' % ('Lorem ipsum ' * 200),
+                     year=9999, abstract_rank=i)
+            for i in range(abstract_count)])
+        abstracts = Abstract.objects.filter(meeting=meeting)
+        Author.objects.bulk_create([
+            Author(abstract_id=abstract_id, author_rank=rank, name='Author %s' % rank)
+            for abstract_id in abstracts.values_list('id', flat=True) for rank in range(1, author_count + 1)])
+        return abstracts
+
+    def report(self, label, export):
+        rss_before = peak_rss_kb()
+        start = time.time()
+        with CaptureQueriesContext(connection) as queries:
+            size = export()
+        elapsed = time.time() - start
+        self.stdout.write('%-10s %8.2f s %8d queries %10d bytes  peak RSS +%d KB' % (
+            label, elapsed, len(queries), size, peak_rss_kb() - rss_before))
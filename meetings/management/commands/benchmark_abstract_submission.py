@@ -0,0 +1,69 @@
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from optparse import make_option
+from meetings.forms import AbstractForm, AuthorInlineFormSet, save_abstract_submission
+from meetings.models import Meeting, Abstract
+import time
+
+
+def legacy_abstract_submission(form, author_formset):
+    """
+    The original AbstractCreateView.form_valid persistence, kept for comparison. Saves each author separately
+    in autocommit mode, so every author is its own transaction.
+    """
+    abstract = form.save()
+    author_formset.instance = abstract
+    rank = 1
+    for author in author_formset.save(commit=False):
+        author.author_rank = rank
+        author.abstract = abstract
+        author.save()
+        rank += 1
+    return abstract
+
+
+def submission_data(author_count):
+    data = {'presentation_type': 'Paper', 'title': 'Benchmark abstract', 'abstract_text': '<p>Benchmark text</p>',
+            'contact_email': 'bench@example.com', 'confirm_email': 'bench@example.com',
+            'author_set-TOTAL_FORMS': author_count, 'author_set-INITIAL_FORMS': 0, 'author_set-MAX_NUM_FORMS': 1000}
+    for i in range(author_count):
+        data['author_set-%s-name' % i] = 'Author %s' % i
+    return data
+
+
+def median(values):
+    values = sorted(values)
+    return values[len(values) // 2]
+
+
+class Command(BaseCommand):
+    help = """Time the persistence of abstract submissions against the number of authors, for the original
+    per-author saves and the single transaction bulk insert. The benchmark meeting and its submissions are
+    created inside a transaction that is rolled back, so the commit of each author in the original saves is
+    not part of the timings, only its extra queries are."""
+
+    option_list = BaseCommand.option_list + (
+        make_option('--authors', default='1,5,10,30,60', help='Comma separated author counts'),
+        make_option('--repeat', type='int', default=20, help='Submissions per author count and method'),
+    )
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            meeting = Meeting.objects.create(title='Benchmark Meeting', year=9999)
+            self.stdout.write('%8s %-10s %10s %10s' % ('authors', 'method', 'median ms', 'queries'))
+            for author_count in [int(count) for count in options['authors'].split(',')]:
+                for label, save in [('per author', legacy_abstract_submission), ('bulk', save_abstract_submission)]:
+                    timings = []
+                    for i in range(options['repeat']):
+                        data = submission_data(author_count)
+                        form = AbstractForm(data, instance=Abstract(meeting=meeting, year=meeting.year))
+                        author_formset = AuthorInlineFormSet(data)
+                        assert form.is_valid() and author_formset.is_valid()
+                        start = time.time()
+                        with CaptureQueriesContext(connection) as queries:
+                            save(form, author_formset)
+                        timings.append(time.time() - start)
+                    self.stdout.write('%8d %-10s %10.2f %10d' % (author_count, label, median(timings) * 1000,
+                                                                  len(queries)))
+            transaction.set_rollback(True)
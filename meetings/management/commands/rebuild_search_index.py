@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand, CommandError
+from meetings.search import rebuild_index, fts5_available
+
+
+class Command(BaseCommand):
+    help = "Rebuild the full text search index of abstracts and authors."
+
+    def handle(self, *args, **options):
+        if not fts5_available():
+            raise CommandError("The database does not support SQLite FTS5. Search falls back to LIKE queries.")
+        self.stdout.write("Indexed %s abstracts" % rebuild_index())
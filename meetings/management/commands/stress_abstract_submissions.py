@@ -0,0 +1,131 @@
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.core.urlresolvers import reverse
+from django.db import connection, connections, OperationalError
+from django.test import Client
+from django.test.utils import setup_test_environment, teardown_test_environment, override_settings
+from optparse import make_option
+from meetings.models import Meeting
+from benchmark_abstract_submission import submission_data
+from base.benchmarks import private_cache
+from base.sqlite import DEFAULT_SQLITE_PRAGMAS
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+# sqlite as configured before base.sqlite: rollback journal, full sync and the 5 s timeout of the sqlite3 module
+LEGACY_SQLITE_PRAGMAS = (('busy_timeout', 5000), ('journal_mode', 'DELETE'), ('synchronous', 'FULL'))
+
+
+class ThreadClient(Client):
+    """
+    A test client for use in threads. The test client re-raises the exceptions of views through a signal shared
+    by all clients, which sends them to the wrong thread; with DEBUG_PROPAGATE_EXCEPTIONS the handler raises them
+    in the thread of the request instead.
+    """
+    def request(self, **request):
+        return self.handler(self._base_environ(**request))
+
+
+class Command(BaseCommand):
+    help = """Stress the database with concurrent abstract submissions, as before the submission deadline.
+    Writer threads POST abstracts to the submission form while reader threads GET the detail page of the
+    meeting, whose cached page every submission invalidates. Runs in a throwaway file database with the
+    sqlite settings before base.sqlite ("legacy") and with the SQLITE_PRAGMAS setting ("configured"), and
+    reports the throughput, latency and "database is locked" errors of each."""
+
+    option_list = BaseCommand.option_list + (
+        make_option('--writers', type='int', default=8, help='Threads submitting abstracts'),
+        make_option('--readers', type='int', default=8, help='Threads reading the meeting detail page'),
+        make_option('--duration', type='float', default=10, help='Seconds to run each configuration'),
+        make_option('--authors', type='int', default=5, help='Authors per submitted abstract'),
+        make_option('--mode', choices=['both', 'legacy', 'configured'], default='both',
+                    help='The sqlite settings to run with'),
+    )
+
+    def handle(self, *args, **options):
+        logging.getLogger('base.querybudget').setLevel(logging.ERROR)  # not a line per request
+        modes = [('legacy', LEGACY_SQLITE_PRAGMAS),
+                 ('configured', getattr(settings, 'SQLITE_PRAGMAS', DEFAULT_SQLITE_PRAGMAS))]
+        self.stdout.write('%-10s %-7s %8s %8s %10s %9s %9s %8s' % (
+            'mode', 'threads', 'requests', 'per sec', 'p50 ms', 'p95 ms', 'locked', 'errors'))
+        for mode, pragmas in modes:
+            if options['mode'] in ('both', mode):
+                with override_settings(SQLITE_PRAGMAS=pragmas, DEBUG_PROPAGATE_EXCEPTIONS=True):
+                    results = self.run(options)
+                for kind in ['writers', 'readers']:
+                    result = results[kind]
+                    timings = sorted(result['timings']) or [0]
+                    self.stdout.write('%-10s %-7s %8d %8.1f %10.1f %9.1f %9d %8d' % (
+                        mode, kind, len(result['timings']), len(result['timings']) / options['duration'],
+                        timings[len(timings) // 2] * 1000, timings[int(len(timings) * 0.95)] * 1000,
+                        result['locked'], result['errors']))
+
+    def run(self, options):
+        directory = tempfile.mkdtemp()
+        connection.settings_dict['TEST_NAME'] = os.path.join(directory, 'stress.sqlite3')
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            # not in the site cache, the synthetic meetings have the years of the real ones
+            with private_cache():
+                call_command('generate_synthetic_data', meetings=2, abstracts=300, members=0, announcements=0,
+                             stdout=open(os.devnull, 'w'))
+                meeting = Meeting.objects.current()
+                detail_url = reverse('meetings:meeting_detail', args=[meeting.year])
+                connection.close()  # the threads open their own connections
+                results = {'writers': {'timings': [], 'locked': 0, 'errors': 0},
+                           'readers': {'timings': [], 'locked': 0, 'errors': 0}}
+                deadline = time.time() + options['duration']
+                lock = threading.Lock()
+
+                def submit(client):
+                    return client.post(reverse('meetings:create_abstract'), submission_data(options['authors']))
+
+                def read(client):
+                    return client.get(detail_url)
+
+                threads = [threading.Thread(target=self.worker, args=(submit, results['writers'], lock, deadline))
+                           for i in range(options['writers'])]
+                threads += [threading.Thread(target=self.worker, args=(read, results['readers'], lock, deadline))
+                            for i in range(options['readers'])]
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+                return results
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            del connection.settings_dict['TEST_NAME']
+            teardown_test_environment()
+            shutil.rmtree(directory)
+
+    def worker(self, request, result, lock, deadline):
+        """
+        Make requests until the deadline and add their timings and failures to result.
+        """
+        client = ThreadClient()
+        timings, locked, errors = [], 0, 0
+        while time.time() < deadline:
+            start = time.time()
+            try:
+                response = request(client)
+            except OperationalError as e:
+                if 'locked' in str(e):
+                    locked += 1
+                else:
+                    errors += 1
+                continue
+            if response.status_code >= 400:
+                errors += 1
+            else:
+                timings.append(time.time() - start)
+        connections['default'].close()
+        with lock:
+            result['timings'].extend(timings)
+            result['locked'] += locked
+            result['errors'] += errors
@@ -1,8 +1,20 @@
 from django.db import models
+from django.db.models import Q
+from django.db.models.signals import post_init, pre_save, post_save, post_delete
+from django.dispatch import receiver
 from ckeditor.fields import RichTextField
 from base.choices import *
 from fiber.models import Page
+from base.models import track_blob_references
+from base.storage import content_storage
 from django.core.exceptions import ObjectDoesNotExist
+from django.core.cache import cache
+from django.utils import timezone
+import datetime
+import unicodedata
+import search
+import caching
+import text
 
 
 # Create your models here.
@@ -18,6 +30,35 @@ FUNDING_CHOICES = (
 )
 
 
+CURRENT_MEETING_CACHE_KEY = 'meetings_current_meeting'
+CURRENT_MEETING_MAX_TIMEOUT = 60 * 60 * 24
+
+
+class MeetingManager(models.Manager):
+    def current(self):
+        """
+        Return the meeting open for abstract submissions, the earliest meeting that has not yet ended, or None.
+        Meetings without dates are open through the end of their year. The meeting is cached until the day after
+        it ends and is cleared whenever a meeting is saved or deleted, in all processes through the shared cache
+        of CACHES.
+        """
+        meeting = cache.get(CURRENT_MEETING_CACHE_KEY)
+        if meeting is None:
+            now = timezone.now()
+            today = now.date()
+            meeting = self.get_queryset().filter(
+                Q(end_date__gte=today) |
+                Q(end_date__isnull=True, start_date__gte=today) |
+                Q(end_date__isnull=True, start_date__isnull=True, year__gte=today.year)
+            ).order_by('year', 'start_date').first()
+            if meeting is not None:
+                closes = meeting.end_date or meeting.start_date or datetime.date(meeting.year, 12, 31)
+                closes = timezone.make_aware(datetime.datetime.combine(closes, datetime.time.min), timezone.utc)
+                timeout = int((closes - now).total_seconds()) + 60 * 60 * 24 + 1  # midnight after the last day
+                cache.set(CURRENT_MEETING_CACHE_KEY, meeting, min(timeout, CURRENT_MEETING_MAX_TIMEOUT))
+        return meeting
+
+
 class Meeting(models.Model):
     title = models.CharField(max_length=200, null=False, blank=False)  # REQUIRED
     # year is being used informally as a foreign key to the corresponding fiber page.
@@ -27,8 +68,12 @@ class Meeting(models.Model):
     associated_with = models.CharField(max_length=200, null=True, blank=True)
     location = models.CharField(max_length=200, null=True, blank=True)
     description = models.TextField(null=True, blank=True)
-    program_pdf = models.FileField(upload_to='uploads/files', null=True, blank=True)
-    abstracts_pdf = models.FileField(upload_to='uploads/files', null=True, blank=True)
+    program_pdf = models.FileField(upload_to='uploads/files', storage=content_storage, max_length=255,
+                                   null=True, blank=True)
+    abstracts_pdf = models.FileField(upload_to='uploads/files', storage=content_storage, max_length=255,
+                                     null=True, blank=True)
+
+    objects = MeetingManager()
 
     def __unicode__(self):
         return self.title
@@ -38,6 +83,10 @@ class Meeting(models.Model):
     # they contain
     # meeting details. A link to the page is automatically included in meetings.html
     def has_detail(self):
+        # MeetingsView attaches the page status to every meeting with a single query.
+        # Look the page up individually only for callers outside that view.
+        if hasattr(self, 'detail_is_public'):
+            return self.detail_is_public
         try:
             p = Page.objects.get(title=self.title)
         # if it doesn't exist, create a new page
@@ -82,13 +131,36 @@ class Meeting(models.Model):
 
 PRESENTATION_TYPE_HELP = """(Please evaluate your abstract carefully and decide whether a
                           paper or poster is most appropriate.)"""
-ABSTRACT_TEXT_HELP = "(Abstracts are limited to 300 words not counting acknowledgements. They must be in English.)"
+ABSTRACT_WORD_LIMIT = 300
+ABSTRACT_TEXT_HELP = "(Abstracts are limited to %s words not counting acknowledgements. " \
+                     "They must be in English.)" % ABSTRACT_WORD_LIMIT
 REFERENCES_HELP = "(Include references only if they are cited in your abstract.)"
 COMMENTS_HELP = "(Please include any factors that should be included in an evaluation of this abstract. " \
                 "For instance, if this paper is not substantially different from a recently given paper it may " \
                 "be rejected. Thus, you might want to make clear how this paper differs.)"
 
 
+def lead_author_sort_key(author):
+    """
+    The key abstracts are sorted on: the last name, or else the full name, of the lead author in lower case
+    and without accents, so that names sort alphabetically in SQL.
+    """
+    if author is None:
+        return ''
+    name = unicodedata.normalize('NFKD', unicode(author.last_name or author.name or ''))
+    return ''.join(c for c in name if not unicodedata.combining(c)).strip().lower()[:200]
+
+
+class AbstractManager(models.Manager):
+    def with_authors(self):
+        """
+        Return abstracts with their authors loaded in a single batched query. Authors come back ordered
+        by author_rank (the Author default ordering), so abstract.author_set.all() and lead_author()
+        are served from memory instead of one query per abstract.
+        """
+        return self.get_queryset().prefetch_related('author_set')
+
+
 class Abstract(models.Model):
     meeting = models.ForeignKey('Meeting')  # REQUIRED
     contact_email = models.EmailField(max_length=128, null=False, blank=False)  # REQUIRED
@@ -104,14 +176,62 @@ class Abstract(models.Model):
     last_modified = models.DateField(null=False, blank=True, auto_now=True)  # REQUIRED BUT AUTOMATIC
     created = models.DateField(null=False, blank=True, auto_now_add=True)  # REQUIRED BUT AUTOMATIC
     abstract_rank = models.IntegerField(null=True, blank=True)
-    abstract_media = models.FileField(upload_to="meetings/files", null=True, blank=True)
+    abstract_media = models.FileField(upload_to="meetings/files", storage=content_storage, max_length=255,
+                                      null=True, blank=True)
     accepted = models.BooleanField(default=False)
+    # kept current by the Abstract and Author signals below, see lead_author_sort_key
+    lead_author_sort = models.CharField(max_length=200, blank=True, default='', editable=False, db_index=True)
+    # plain text renderings of title and abstract_text, set on save by prepare_abstract_text
+    title_text = models.TextField(blank=True, default='', editable=False)
+    abstract_plain_text = models.TextField(blank=True, default='', editable=False)
+    word_count = models.IntegerField(default=0, editable=False)
+
+    objects = AbstractManager()
 
     def __unicode__(self):
-        return self.title[0:20]
+        return self.title_text[0:20]
+
+    def prepare_text(self):
+        """
+        Sanitize the title and abstract text and store their plain text and the abstract word count.
+        """
+        self.title = text.sanitize_html(self.title, text.TITLE_TAGS)
+        self.abstract_text = text.sanitize_html(self.abstract_text)
+        self.title_text = text.html_to_text(self.title)
+        self.abstract_plain_text = text.html_to_text(self.abstract_text)
+        self.word_count = text.word_count(self.abstract_plain_text)
+
+    def create_authors(self, authors):
+        """
+        Insert the authors of this abstract with a single statement, ranked in the order given. bulk_create
+        sends no signals, so the search index and the meeting caches are updated here.
+        """
+        for rank, author in enumerate(authors, 1):
+            author.abstract = self
+            author.author_rank = rank
+        Author.objects.bulk_create(authors)
+        self.lead_author_sort = lead_author_sort_key(authors[0] if authors else None)
+        abstract_authors_changed(self.pk)
+        search.index_abstract(self)
+
+    def lead_author(self):
+        # author_set.all() uses the prefetched authors when available and is ordered by author_rank
+        authors = list(self.author_set.all())
+        if authors:
+            return authors[0]
+        return None
 
     def lead_author_last_name(self):
-        return self.author_set.order_by('author_rank')[0].last_name
+        lead_author = self.lead_author()
+        if lead_author:
+            return lead_author.last_name
+        return None
+    lead_author_last_name.short_description = 'Lead author'
+    lead_author_last_name.admin_order_field = 'lead_author_sort'
+
+    class Meta:
+        # meeting detail pages filter on meeting and accepted and order by abstract_rank, then lead author
+        index_together = [['meeting', 'accepted', 'abstract_rank', 'lead_author_sort']]
 
 
 class Author(models.Model):
@@ -139,3 +259,100 @@ class Author(models.Model):
 
     class Meta:
         ordering = ['author_rank']
+        # authors are always fetched by abstract in author_rank order
+        index_together = [['abstract', 'author_rank']]
+
+
+class ProgramBook(models.Model):
+    """
+    The rendered program book html for a meeting. The file is rebuilt only when the fingerprint of the
+    accepted abstracts changes or when an abstract or author of the meeting is edited (stale).
+    """
+    meeting = models.OneToOneField('Meeting')
+    fingerprint = models.CharField(max_length=40, blank=True)
+    html = models.FileField(upload_to='meetings/program_books', null=True, blank=True)
+    stale = models.BooleanField(default=True)
+    generated = models.DateTimeField(auto_now=True)
+
+    def __unicode__(self):
+        return self.meeting.title
+
+
+# Derive the lead author sort key from the stored authors, so saving an abstract loaded before
+# its authors changed cannot write back a stale key
+@receiver(pre_save, sender=Abstract)
+def set_lead_author_sort(sender, instance, **kwargs):
+    if instance.pk:
+        lead_author = Author.objects.filter(abstract=instance.pk).order_by('author_rank').first()
+        instance.lead_author_sort = lead_author_sort_key(lead_author)
+
+
+@receiver(pre_save, sender=Abstract)
+def prepare_abstract_text(sender, instance, **kwargs):
+    instance.prepare_text()
+
+
+# Remember the stored meeting of an abstract and year of a meeting, so that the cached detail pages of both
+# the old and the new year are dropped when they change
+@receiver(post_init, sender=Abstract)
+def remember_abstract_meeting(sender, instance, **kwargs):
+    instance._stored_meeting_id = instance.__dict__.get('meeting_id')  # without loading a deferred field
+
+
+@receiver(post_init, sender=Meeting)
+def remember_meeting_year(sender, instance, **kwargs):
+    instance._stored_year = instance.__dict__.get('year')
+
+
+# Update the lead author sort key, mark the program book of a meeting as stale and drop its
+# cached detail page when any of its abstracts or authors change
+@receiver([post_save, post_delete], sender=Abstract)
+def abstract_changed(sender, instance, **kwargs):
+    meeting_ids = set([instance.meeting_id, instance._stored_meeting_id]) - set([None])
+    ProgramBook.objects.filter(meeting__in=meeting_ids).update(stale=True)
+    for year in Meeting.objects.filter(pk__in=meeting_ids).values_list('year', flat=True):
+        caching.invalidate_meeting_detail(year)
+    instance._stored_meeting_id = instance.meeting_id
+
+
+def abstract_authors_changed(abstract_id):
+    lead_author = Author.objects.filter(abstract=abstract_id).order_by('author_rank').first()
+    Abstract.objects.filter(pk=abstract_id).update(lead_author_sort=lead_author_sort_key(lead_author))
+    ProgramBook.objects.filter(meeting__abstract=abstract_id).update(stale=True)
+    for year in Meeting.objects.filter(abstract=abstract_id).values_list('year', flat=True):
+        caching.invalidate_meeting_detail(year)
+
+
+@receiver([post_save, post_delete], sender=Author)
+def author_changed(sender, instance, **kwargs):
+    abstract_authors_changed(instance.abstract_id)
+
+
+@receiver([post_save, post_delete], sender=Meeting)
+def meeting_changed(sender, instance, **kwargs):
+    for year in set([instance.year, instance._stored_year]) - set([None]):
+        caching.invalidate_meeting_detail(year)
+    cache.delete(CURRENT_MEETING_CACHE_KEY)
+    instance._stored_year = instance.year
+
+
+# Keep the full text search index in step with abstracts and their authors
+@receiver(post_save, sender=Abstract)
+def index_saved_abstract(sender, instance, **kwargs):
+    search.index_abstract(instance)
+
+
+@receiver(post_delete, sender=Abstract)
+def remove_deleted_abstract(sender, instance, **kwargs):
+    search.remove_abstract(instance.pk)
+
+
+@receiver([post_save, post_delete], sender=Author)
+def reindex_author_abstract(sender, instance, **kwargs):
+    abstract = Abstract.objects.filter(pk=instance.abstract_id).first()
+    if abstract:
+        search.index_abstract(abstract)
+
+
+# Count the references of the uploaded PDFs and abstract media to their stored blobs
+track_blob_references(Meeting, Abstract)
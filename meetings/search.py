@@ -0,0 +1,129 @@
+"""
+Full text search over abstracts using an SQLite FTS5 table. The table is keyed by abstract id (rowid) and
+indexes the plain text of the abstract title and text, and the names and institutions of the authors.
+It is kept current by the Abstract and Author signals in meetings.models, and can be rebuilt with the
+rebuild_search_index management command. On databases without FTS5 search falls back to LIKE queries.
+"""
+from django.db import connection, transaction
+from django.db.models.signals import post_syncdb
+from django.dispatch import receiver
+import re
+
+SEARCH_TABLE = 'meetings_abstract_search'
+_fts5_available = {}
+
+
+def fts5_available():
+    """
+    True if the default database is SQLite compiled with FTS5. The check runs once per database.
+    """
+    key = connection.settings_dict['NAME']
+    if key not in _fts5_available:
+        available = False
+        if connection.vendor == 'sqlite':
+            cursor = connection.cursor()
+            cursor.execute("PRAGMA compile_options")
+            available = 'ENABLE_FTS5' in [row[0] for row in cursor.fetchall()]
+        _fts5_available[key] = available
+    return _fts5_available[key]
+
+
+def create_search_table():
+    cursor = connection.cursor()
+    cursor.execute("CREATE VIRTUAL TABLE IF NOT EXISTS %s USING fts5(title, abstract_text, authors, "
+                   "tokenize='porter unicode61')" % SEARCH_TABLE)
+
+
+@receiver(post_syncdb)
+def create_search_table_after_syncdb(sender, **kwargs):
+    if fts5_available():
+        create_search_table()
+
+
+def index_abstract(abstract):
+    """
+    Add or replace the index entry for an abstract. Uses the prefetched authors when available.
+    """
+    if not fts5_available():
+        return
+    authors = ' '.join('%s %s' % (author.name, author.institution or '') for author in abstract.author_set.all())
+    cursor = connection.cursor()
+    cursor.execute("DELETE FROM %s WHERE rowid = %%s" % SEARCH_TABLE, [abstract.pk])
+    cursor.execute("INSERT INTO %s (rowid, title, abstract_text, authors) VALUES (%%s, %%s, %%s, %%s)" % SEARCH_TABLE,
+                   [abstract.pk, abstract.title_text, abstract.abstract_plain_text, authors])
+
+
+def remove_abstract(abstract_id):
+    if fts5_available():
+        connection.cursor().execute("DELETE FROM %s WHERE rowid = %%s" % SEARCH_TABLE, [abstract_id])
+
+
+def rebuild_index():
+    """
+    Drop and recreate the search table and index every abstract. Returns the number of abstracts indexed.
+    """
+    from exports import iter_abstracts_with_authors
+    from models import Abstract
+    count = 0
+    with transaction.atomic():  # one commit rather than one per abstract
+        cursor = connection.cursor()
+        cursor.execute("DROP TABLE IF EXISTS %s" % SEARCH_TABLE)
+        create_search_table()
+        for abstract in iter_abstracts_with_authors(Abstract.objects.all()):
+            index_abstract(abstract)
+            count += 1
+        cursor.execute("INSERT INTO %s (%s) VALUES ('optimize')" % (SEARCH_TABLE, SEARCH_TABLE))
+    return count
+
+
+def match_expression(query):
+    """
+    Convert free text into an FTS5 expression that matches every word as a prefix. Words are quoted so
+    that FTS5 operators and punctuation typed by users cannot cause syntax errors.
+    """
+    return ' '.join('"%s"*' % word for word in re.findall(r'\w+', query, re.UNICODE))
+
+
+def filter_abstracts(queryset, query):
+    """
+    Filter an Abstract queryset to the abstracts matching query. The match runs as a subquery so large
+    result sets are not passed around as lists of ids.
+    """
+    expression = match_expression(query)
+    if not expression:
+        return queryset.none()
+    if not fts5_available():
+        from django.db.models import Q
+        for word in re.findall(r'\w+', query, re.UNICODE):
+            queryset = queryset.filter(Q(title_text__icontains=word) | Q(abstract_plain_text__icontains=word) |
+                                       Q(author__name__icontains=word) | Q(author__institution__icontains=word))
+        return queryset.distinct()
+    return queryset.extra(where=['meetings_abstract.id IN (SELECT rowid FROM %s WHERE %s MATCH %%s)' %
+                                 (SEARCH_TABLE, SEARCH_TABLE)], params=[expression])
+
+
+def search_abstract_ids(query, limit=None, accepted_only=False):
+    """
+    Return the ids of abstracts matching query, best match first.
+    """
+    expression = match_expression(query)
+    if not expression:
+        return []
+    if not fts5_available():
+        from models import Abstract
+        abstracts = filter_abstracts(Abstract.objects.all(), query)
+        if accepted_only:
+            abstracts = abstracts.filter(accepted=True)
+        ids = abstracts.order_by('-pk').values_list('pk', flat=True)
+        return list(ids[:limit] if limit else ids)
+    sql = "SELECT s.rowid FROM %s s" % SEARCH_TABLE
+    if accepted_only:
+        sql += " JOIN meetings_abstract a ON a.id = s.rowid AND a.accepted"
+    sql += " WHERE s.%s MATCH %%s ORDER BY s.rank" % SEARCH_TABLE
+    params = [expression]
+    if limit:
+        sql += " LIMIT %s"
+        params.append(limit)
+    cursor = connection.cursor()
+    cursor.execute(sql, params)
+    return [row[0] for row in cursor.fetchall()]
@@ -1,7 +1,30 @@
 from django.test import TestCase
 from models import Meeting, Abstract, Author
 from django.core.urlresolvers import reverse
+from django.contrib.auth.models import User
+from django.db import connection, IntegrityError
+from django.test.utils import CaptureQueriesContext
+from django.core.cache import cache, get_cache
+from django.utils import timezone
+import datetime
+import shutil
+import tempfile
 from fiber.models import Page
+from meetings.admin import create_abstract_csv, create_abstract4meeting_html
+from meetings.models import ProgramBook
+from meetings.forms import AbstractForm
+from meetings.caching import invalidate_meeting_detail, meeting_detail_cache_key
+from base.testing import QueryPlanTestMixin, QueryBudgetTestMixin
+from meetings.models import CURRENT_MEETING_CACHE_KEY
+from django.core.management import call_command
+from django.core import mail
+from django.core.mail.backends.smtp import EmailBackend as SMTPEmailBackend
+from django.test.utils import override_settings
+from base.models import QueuedMessage
+from base.mailqueue import send_queued_mail
+from meetings.emails import PROGRAM_COMMITTEE_EMAILS
+from StringIO import StringIO
+from meetings.search import search_abstract_ids, filter_abstracts, rebuild_index
 
 
 # Factory method to create a fiber page tree with five pages.
@@ -156,6 +179,20 @@ class MeetingsViewTests(TestCase):
         # If fiber page is not public and not in menu there should be no link to it
         self.assertNotContains(response, '<a href="/meetings/2016/"')
 
+    def test_meetings_index_view_query_count_is_constant(self):
+        create_three_meetings_with_pages()
+        with CaptureQueriesContext(connection) as context:
+            self.client.get(reverse('meetings:meetings'))
+        queries_with_three_meetings = len(context)
+        for year in range(1990, 2000):
+            meeting = Meeting(year=year, title='Meeting %s' % year, location='Austin, TX', associated_with='AAPA')
+            meeting.create_fiber_page()
+            meeting.save()
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(reverse('meetings:meetings'))
+        self.assertContains(response, '<a href="/meetings/1990/"')
+        self.assertEqual(len(context), queries_with_three_meetings)  # one page query regardless of meeting count
+
     def test_meetings_index_view_with_missing_meetings(self):
         create_three_meetings_with_pages()
         response = self.client.get(reverse('meetings:meetings'))
@@ -174,6 +211,532 @@ class MeetingsDetailViewTests(TestCase):
         self.assertContains(response, "Create an Abstract")
 
 
+class MeetingsDetailViewQueryTests(QueryPlanTestMixin, TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def add_accepted_abstracts(self, meeting, count, authors_per_abstract=3):
+        """
+        Adds accepted abstracts to a meeting, each with several ranked authors.
+        """
+        for i in range(count):
+            abstract = Abstract.objects.create(meeting=meeting, contact_email='denne.reed@gmail.com',
+                                               presentation_type='Paper', title='Silly Walks %s' % i,
+                                               abstract_text='<p>Test abstract text</p>', year=meeting.year,
+                                               abstract_rank=i, accepted=True)
+            for rank in range(authors_per_abstract, 0, -1):  # save out of rank order
+                Author.objects.create(abstract=abstract, author_rank=rank, first_name='Ima',
+                                      last_name='Fake%s' % rank, name='Ima Fake%s' % rank)
+
+    def count_detail_page_queries(self, year):
+        invalidate_meeting_detail(year)  # measure the rendering, not the cached page
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(reverse('meetings:meeting_detail', args=[year]))
+        self.assertEqual(response.status_code, 200)
+        return len(context)
+
+    def test_meetings_detail_view_query_count_is_constant(self):
+        create_three_meetings_with_pages()
+        atlanta = Meeting.objects.get(year=2016)
+        self.add_accepted_abstracts(atlanta, 1)
+        self.count_detail_page_queries(2016)  # resolve the fiber page and menus once
+        queries_with_one_abstract = self.count_detail_page_queries(2016)
+        self.add_accepted_abstracts(atlanta, 20)
+        # The number of queries should not grow with the number of abstracts or authors
+        self.assertEqual(self.count_detail_page_queries(2016), queries_with_one_abstract)
+
+    def test_meetings_detail_view_queries_use_indexes(self):
+        create_three_meetings_with_pages()
+        self.add_accepted_abstracts(Meeting.objects.get(year=2016), 5)
+        self.assertNoFullTableScans(reverse('meetings:meeting_detail', args=[2016]),
+                                    ['meetings_meeting', 'meetings_abstract', 'meetings_author'])
+
+    def test_lead_author_from_prefetched_authors(self):
+        create_three_meetings_with_pages()
+        atlanta = Meeting.objects.get(year=2016)
+        self.add_accepted_abstracts(atlanta, 2)
+        abstracts = list(Abstract.objects.with_authors().filter(meeting=atlanta))
+        with self.assertNumQueries(0):
+            for abstract in abstracts:
+                self.assertEqual([a.author_rank for a in abstract.author_set.all()], [1, 2, 3])
+                self.assertEqual(abstract.lead_author_last_name(), 'Fake1')
+
+
+class MeetingsDetailCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        create_three_meetings_with_pages()
+        abstract = Abstract.objects.create(meeting=Meeting.objects.get(year=2016), contact_email='denne.reed@gmail.com',
+                                           presentation_type='Paper', title='Silly Walks',
+                                           abstract_text='<p>Test abstract text</p>', year=2016, accepted=True)
+        self.author = Author.objects.create(abstract=abstract, author_rank=1, first_name='Ima', last_name='Fake',
+                                            name='Ima Fake')
+        self.url = reverse('meetings:meeting_detail', args=[2016])
+
+    def test_detail_page_is_served_from_cache(self):
+        first = self.client.get(self.url)
+        with self.assertNumQueries(0):
+            second = self.client.get(self.url)
+        self.assertEqual(second.status_code, 200)
+        self.assertEqual(second.content, first.content)
+
+    def test_author_change_invalidates_cached_page(self):
+        self.client.get(self.url)
+        self.author.last_name = 'Renamed'
+        self.author.name = 'Ima Renamed'
+        self.author.save()
+        self.assertContains(self.client.get(self.url), 'Renamed')
+
+    def test_author_change_invalidates_cached_page_for_other_processes(self):
+        other = get_cache('default')  # a backend of its own, like the cache of another process
+        self.client.get(self.url)
+        self.assertNotEqual(other.get(meeting_detail_cache_key(2016)), None)
+        self.author.last_name = 'Renamed'
+        self.author.save()
+        self.assertEqual(other.get(meeting_detail_cache_key(2016)), None)
+
+    def test_moved_abstract_invalidates_both_cached_pages(self):
+        other_url = reverse('meetings:meeting_detail', args=[2015])
+        self.assertContains(self.client.get(self.url), 'Silly Walks')
+        self.assertNotContains(self.client.get(other_url), 'Silly Walks')
+        abstract = Abstract.objects.get(title='Silly Walks')
+        abstract.meeting = Meeting.objects.get(year=2015)
+        abstract.save()
+        self.assertNotContains(self.client.get(self.url), 'Silly Walks')
+        self.assertContains(self.client.get(other_url), 'Silly Walks')
+
+    def test_meeting_year_change_invalidates_old_year(self):
+        self.client.get(self.url)
+        self.assertNotEqual(cache.get(meeting_detail_cache_key(2016)), None)
+        meeting = Meeting.objects.get(year=2016)
+        meeting.year = 2017
+        meeting.save()
+        self.assertEqual(cache.get(meeting_detail_cache_key(2016)), None)
+
+    def test_fiber_page_change_invalidates_cached_page(self):
+        self.client.get(self.url)
+        page = Page.objects.get(title='Atlanta 2016')
+        page.title = 'Renamed Atlanta Page'
+        page.save()
+        self.assertContains(self.client.get(self.url), 'Renamed Atlanta Page')
+
+    def test_staff_users_bypass_cache(self):
+        User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.client.login(username='admin', password='password')
+        self.client.get(self.url)
+        with CaptureQueriesContext(connection) as context:
+            self.client.get(self.url)
+        self.assertGreater(len(context), 0)
+
+
+class LeadAuthorSortTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        create_three_meetings_with_pages()
+        self.atlanta = Meeting.objects.get(year=2016)
+
+    def create_abstract(self, title, *last_names):
+        abstract = Abstract.objects.create(meeting=self.atlanta, contact_email='denne.reed@gmail.com',
+                                           presentation_type='Paper', title=title, abstract_text='<p>Text</p>',
+                                           year=2016, accepted=True)
+        for rank, last_name in enumerate(last_names, 1):
+            Author.objects.create(abstract=abstract, author_rank=rank, last_name=last_name, name=last_name)
+        return Abstract.objects.get(pk=abstract.pk)
+
+    def test_sort_key_follows_lead_author(self):
+        abstract = self.create_abstract('Walks', u'\xc1lvarez', 'Zed')
+        self.assertEqual(abstract.lead_author_sort, 'alvarez')
+        Author.objects.filter(abstract=abstract, last_name='Zed').update(author_rank=0)
+        abstract.author_set.get(last_name='Zed').save()  # re-ranked authors are saved one at a time
+        self.assertEqual(Abstract.objects.get(pk=abstract.pk).lead_author_sort, 'zed')
+        abstract.author_set.get(last_name='Zed').delete()
+        self.assertEqual(Abstract.objects.get(pk=abstract.pk).lead_author_sort, 'alvarez')
+
+    def test_stale_instance_does_not_overwrite_key(self):
+        abstract = self.create_abstract('Walks', 'Brown')
+        Author.objects.get(abstract=abstract).delete()
+        abstract.save()
+        self.assertEqual(Abstract.objects.get(pk=abstract.pk).lead_author_sort, '')
+
+    def test_detail_page_orders_unranked_abstracts_by_lead_author(self):
+        self.create_abstract('Zebra walks', 'Young')
+        self.create_abstract('Aardvark walks', 'Brown')
+        content = self.client.get(reverse('meetings:meeting_detail', args=[2016])).content
+        self.assertLess(content.index('Aardvark walks'), content.index('Zebra walks'))
+
+    def test_admin_lists_lead_authors_without_query_per_abstract(self):
+        for i, rank in enumerate([3, 1, 5, 2, 4]):
+            self.create_abstract('Walks %s' % i, 'Fake%s' % rank)
+        User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.client.login(username='admin', password='password')
+        self.client.get('/admin/meetings/abstract/')
+        with CaptureQueriesContext(connection) as five:
+            response = self.client.get('/admin/meetings/abstract/', {'o': '5'})  # the lead author column
+        self.assertEqual([a.lead_author_last_name() for a in response.context['cl'].result_list],
+                         ['Fake1', 'Fake2', 'Fake3', 'Fake4', 'Fake5'])
+        self.create_abstract('Walks 5', 'Fake0')
+        with CaptureQueriesContext(connection) as six:
+            self.client.get('/admin/meetings/abstract/', {'o': '5'})
+        self.assertEqual(len(six), len(five))
+
+
+class AbstractTextTests(TestCase):
+    def setUp(self):
+        self.meeting = Meeting.objects.create(year=2016, title='Atlanta 2016')
+
+    def test_text_is_sanitized_and_counted_on_save(self):
+        abstract = Abstract.objects.create(
+            meeting=self.meeting, contact_email='denne.reed@gmail.com', presentation_type='Paper', year=2016,
+            title='<p>Silly walks of <em>Homo neanderthalensis</em></p>',
+            abstract_text='<p onclick="steal()">Neanderthals&#39; walks<script>alert(1)</script></p>'
+                          '<p>were <a href="javascript:x()">silly</a> and <a href="http://example.com">long</a>.')
+        self.assertEqual(abstract.title, 'Silly walks of <em>Homo neanderthalensis</em>')
+        self.assertEqual(abstract.abstract_text, '<p>Neanderthals&#39; walks</p><p>were <a>silly</a> and '
+                                                 '<a href="http://example.com">long</a>.</p>')
+        self.assertEqual(abstract.title_text, 'Silly walks of Homo neanderthalensis')
+        self.assertEqual(abstract.abstract_plain_text, "Neanderthals' walks were silly and long.")
+        self.assertEqual(abstract.word_count, 6)
+        self.assertEqual(unicode(abstract), 'Silly walks of Homo ')
+
+    def test_form_enforces_word_limit(self):
+        data = abstract_post_data()
+        data['abstract_text'] = '<p>%s</p>' % ('word ' * 300)
+        self.assertTrue(AbstractForm(data, instance=Abstract(meeting=self.meeting, year=2016)).is_valid())
+        data['abstract_text'] = '<p>%s</p>' % ('word ' * 301)
+        form = AbstractForm(data, instance=Abstract(meeting=self.meeting, year=2016))
+        self.assertFalse(form.is_valid())
+        self.assertIn('abstract_text', form.errors)
+
+
+class AbstractExportTests(TestCase):
+    def create_abstracts(self, meeting, count):
+        for i in range(count):
+            abstract = Abstract.objects.create(meeting=meeting, contact_email='denne.reed@gmail.com',
+                                               presentation_type='Paper', title='Silly Walks %s' % i,
+                                               abstract_text='<p>Test abstract text</p>', year=meeting.year)
+            for rank in (2, 1):
+                Author.objects.create(abstract=abstract, author_rank=rank, name='Author %s' % rank)
+
+    def test_abstract_csv_streams_in_chunks_with_prefetched_authors(self):
+        meeting = Meeting.objects.create(year=2016, title='Atlanta 2016')
+        self.create_abstracts(meeting, 5)
+        response = create_abstract_csv(None, None, Abstract.objects.all())
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        with self.assertNumQueries(2):  # one query for the abstracts and one for their authors
+            lines = b''.join(response.streaming_content).splitlines()
+        self.assertEqual(len(lines), 6)  # header plus one row per abstract
+        self.assertTrue(lines[0].startswith('id,contact_email'))
+        self.assertTrue(lines[1].endswith(',Test abstract text,,,,2016,,"Author 1, Author 2",3'))  # plain text
+
+
+class ProgramBookTests(TestCase):
+    def setUp(self):
+        self.meeting = Meeting.objects.create(year=2016, title='Atlanta 2016')
+        for i in range(3):
+            abstract = Abstract.objects.create(meeting=self.meeting, contact_email='denne.reed@gmail.com',
+                                               presentation_type='Paper', title='Silly Walks %s' % i,
+                                               abstract_text='<p>Test abstract text</p>', year=2016,
+                                               abstract_rank=i, accepted=True)
+            Author.objects.create(abstract=abstract, author_rank=1, name='Author %s' % i)
+        self.media_root = tempfile.mkdtemp()
+        self.settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        self.settings_override.enable()
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.media_root)
+
+    def download(self):
+        response = create_abstract4meeting_html(None, None, Abstract.objects.all())
+        self.assertEqual(response['Content-Type'], 'text/html; charset=utf-8')
+        return b''.join(response.streaming_content)
+
+    def test_program_book_is_stored_and_reused(self):
+        html = self.download()
+        self.assertIn('Silly Walks 2', html)
+        book = ProgramBook.objects.get(meeting=self.meeting)
+        self.assertFalse(book.stale)
+        with CaptureQueriesContext(connection) as context:
+            self.assertEqual(self.download(), html)
+        # Serving the stored file only checks the selection, looks up the meeting, the book and the fingerprint
+        self.assertEqual(len(context), 5)
+
+    def test_partial_selection_gets_only_the_selected_abstracts(self):
+        self.download()
+        response = create_abstract4meeting_html(None, None, Abstract.objects.filter(title='Silly Walks 1'))
+        self.assertIn('Silly Walks 1', response.content)
+        self.assertNotIn('Silly Walks 0', response.content)
+        self.assertNotIn('Silly Walks 2', response.content)
+        Abstract.objects.create(meeting=self.meeting, contact_email='denne.reed@gmail.com', presentation_type='Paper',
+                                title='Rejected Walks', abstract_text='<p>Test</p>', year=2016, accepted=False)
+        response = create_abstract4meeting_html(None, None, Abstract.objects.all())  # not only accepted abstracts
+        self.assertIn('Rejected Walks', response.content)
+
+    def test_program_book_is_rebuilt_when_an_author_changes(self):
+        self.download()
+        author = Author.objects.get(name='Author 1')
+        author.name = 'Renamed Author'
+        author.save()
+        self.assertTrue(ProgramBook.objects.get(meeting=self.meeting).stale)
+        self.assertIn('Renamed Author', self.download())
+
+    def test_program_book_admin_download_by_staff(self):
+        # the fiber middleware rewrites html responses for staff and must leave the streamed book alone
+        User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.client.login(username='admin', password='password')
+        response = self.client.post(reverse('admin:meetings_abstract_changelist'), {
+            'action': 'create_abstract4meeting_html', 'index': 0,
+            '_selected_action': list(Abstract.objects.values_list('pk', flat=True))})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('Silly Walks 2', b''.join(response.streaming_content))
+
+    def test_program_book_is_rebuilt_when_ranks_change(self):
+        self.download()
+        Abstract.objects.filter(abstract_rank=0).update(abstract_rank=10)  # bypasses signals
+        html = self.download()
+        self.assertTrue(html.index('Silly Walks 0') > html.index('Silly Walks 2'))
+
+
+class AbstractSearchTests(TestCase):
+    def create_abstract(self, title, text, author_name, institution, accepted=True):
+        meeting, created = Meeting.objects.get_or_create(year=2016, title='Atlanta 2016')
+        abstract = Abstract.objects.create(meeting=meeting, contact_email='denne.reed@gmail.com',
+                                           presentation_type='Paper', title=title, abstract_text=text, year=2016,
+                                           accepted=accepted)
+        Author.objects.create(abstract=abstract, author_rank=1, name=author_name, institution=institution)
+        return abstract
+
+    def setUp(self):
+        self.walks = self.create_abstract('<p>Silly <em>Walks</em> of the Neanderthals</p>',
+                                          '<p>Gait &amp; locomotion in Neanderthals.</p>', 'Ima Fake', 'Chaos University')
+        self.teeth = self.create_abstract('<p>Dental microwear</p>', '<p>Neanderthal teeth.</p>',
+                                          'Bob Reed', 'University of Texas at Austin')
+
+    def test_search_title_text_and_authors(self):
+        self.assertEqual(search_abstract_ids('walks'), [self.walks.pk])
+        self.assertEqual(search_abstract_ids('locomotion'), [self.walks.pk])  # html and entities are stripped
+        self.assertEqual(search_abstract_ids('texas'), [self.teeth.pk])  # author institution
+        self.assertEqual(search_abstract_ids('reed microwear'), [self.teeth.pk])  # every word must match
+        self.assertEqual(search_abstract_ids('neander'), [self.walks.pk, self.teeth.pk])  # prefix, ranked
+        self.assertEqual(search_abstract_ids('"OR ('), [])  # user input cannot break the match syntax
+        self.assertEqual(list(filter_abstracts(Abstract.objects.all(), 'chaos')), [self.walks])
+
+    def test_index_follows_changes(self):
+        author = self.teeth.author_set.get()
+        author.name = 'Denne Reed'
+        author.save()
+        self.assertEqual(search_abstract_ids('denne'), [self.teeth.pk])
+        self.teeth.delete()
+        self.assertEqual(search_abstract_ids('microwear'), [])
+        self.assertEqual(rebuild_index(), 1)
+        self.assertEqual(search_abstract_ids('neanderthals'), [self.walks.pk])
+
+    def test_admin_search_uses_index(self):
+        User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.client.login(username='admin', password='password')
+        response = self.client.get('/admin/meetings/abstract/', {'q': 'chaos'})
+        self.assertEqual(list(response.context['cl'].result_list), [self.walks])
+
+    def test_public_search_view(self):
+        create_django_page_tree()
+        self.create_abstract('<p>Unaccepted walks</p>', '<p>Text</p>', 'Ima Fake', 'Chaos University',
+                             accepted=False)
+        response = self.client.get(reverse('meetings:search'), {'q': 'walks'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(list(response.context['abstract_list']), [self.walks])
+        self.assertContains(response, '<a href="/meetings/2016/">Atlanta 2016</a>')
+
+
+def abstract_post_data(author_count=1):
+    """
+    Returns POST data for the abstract submission form with author_count authors.
+    """
+    data = {'presentation_type': 'Paper', 'title': 'Silly Walks of the Neanderthals',
+            'abstract_text': '<p>Test abstract text about silly walks in Neanderthals.</p>',
+            'contact_email': 'denne.reed@gmail.com', 'confirm_email': 'denne.reed@gmail.com',
+            'author_set-TOTAL_FORMS': author_count, 'author_set-INITIAL_FORMS': 0, 'author_set-MAX_NUM_FORMS': 1000}
+    for i in range(author_count):
+        data.update({'author_set-%s-name' % i: 'Ima Fake%s' % i, 'author_set-%s-first_name' % i: 'Ima',
+                     'author_set-%s-last_name' % i: 'Fake%s' % i})
+    return data
+
+
+class CurrentMeetingTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        create_django_page_tree()
+        Page.objects.create(title='abstract', parent=Page.objects.get(title='meetings'),
+                            url=reverse('meetings:create_abstract'))
+        today = timezone.now().date()
+        self.past = Meeting.objects.create(title='Past', year=today.year - 1,
+                                           start_date=today - datetime.timedelta(days=400),
+                                           end_date=today - datetime.timedelta(days=397))
+        self.next = Meeting.objects.create(title='Next', year=today.year + 1,
+                                           start_date=today + datetime.timedelta(days=100),
+                                           end_date=today + datetime.timedelta(days=103))
+
+    def test_current_meeting_is_the_next_meeting_not_yet_ended(self):
+        self.assertEqual(Meeting.objects.current(), self.next)
+        undated = Meeting.objects.create(title='Undated', year=timezone.now().year)
+        self.assertEqual(Meeting.objects.current(), undated)
+
+    def test_current_meeting_is_cached(self):
+        Meeting.objects.current()
+        with self.assertNumQueries(0):
+            self.assertEqual(Meeting.objects.current(), self.next)
+
+    def test_cached_meeting_is_cleared_for_other_processes(self):
+        other = get_cache('default')  # a backend of its own, like the cache of another process
+        Meeting.objects.current()
+        self.assertEqual(other.get(CURRENT_MEETING_CACHE_KEY), self.next)
+        self.next.title = 'Renamed'
+        self.next.save()
+        self.assertEqual(other.get(CURRENT_MEETING_CACHE_KEY), None)
+
+    def test_no_current_meeting_closes_submissions(self):
+        self.next.delete()
+        self.assertEqual(Meeting.objects.current(), None)
+        self.assertEqual(self.client.get(reverse('meetings:create_abstract')).status_code, 404)
+
+    def test_submission_is_bound_to_current_meeting(self):
+        response = self.client.get(reverse('meetings:create_abstract'))
+        self.assertContains(response, 'Next')
+        self.assertNotContains(response, 'name="meeting"')
+        response = self.client.post(reverse('meetings:create_abstract'), abstract_post_data())
+        self.assertEqual(response.status_code, 302)
+        abstract = Abstract.objects.get()
+        self.assertEqual((abstract.meeting, abstract.year), (self.next, self.next.year))
+
+
+class AbstractSubmissionTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        create_django_page_tree()
+        Page.objects.create(title='abstract', parent=Page.objects.get(title='meetings'),
+                            url=reverse('meetings:create_abstract'))
+        Meeting.objects.create(title='Next', year=timezone.now().year + 1)
+
+    def submit(self, author_count):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.post(reverse('meetings:create_abstract'), abstract_post_data(author_count))
+        self.assertEqual(response.status_code, 302)
+        return len(context)
+
+    def test_authors_are_ranked_and_indexed(self):
+        self.submit(30)
+        abstract = Abstract.objects.get()
+        self.assertEqual([(a.author_rank, a.last_name) for a in abstract.author_set.all()],
+                         [(i + 1, 'Fake%s' % i) for i in range(30)])
+        self.assertEqual(search_abstract_ids('Fake29'), [abstract.pk])
+
+    def test_query_count_does_not_grow_with_authors(self):
+        self.submit(3)  # resolve the fiber page and current meeting once
+        self.assertEqual(self.submit(30), self.submit(3))
+
+    def test_failed_submission_leaves_no_abstract(self):
+        def fail(abstract, authors):
+            raise IntegrityError('author insert failed')
+        create_authors = Abstract.create_authors
+        Abstract.create_authors = fail
+        try:
+            with self.assertRaises(IntegrityError):
+                self.client.post(reverse('meetings:create_abstract'), abstract_post_data(3))
+        finally:
+            Abstract.create_authors = create_authors
+        self.assertEqual(Abstract.objects.count(), 0)
+        self.assertEqual(QueuedMessage.objects.count(), 0)
+
+
+@override_settings(EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend')
+class SubmissionEmailTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        create_django_page_tree()
+        Page.objects.create(title='abstract', parent=Page.objects.get(title='meetings'),
+                            url=reverse('meetings:create_abstract'))
+        Meeting.objects.create(title='Next Meeting', year=timezone.now().year + 1)
+
+    def test_submission_queues_confirmation_and_committee_copy(self):
+        response = self.client.post(reverse('meetings:create_abstract'), abstract_post_data(author_count=2))
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(len(mail.outbox), 0)  # nothing is sent on the submit path
+        self.assertEqual(send_queued_mail(), (2, 0))
+        confirmation, committee = mail.outbox
+        self.assertEqual(confirmation.to, ['denne.reed@gmail.com'])
+        self.assertIn('"Silly Walks of the Neanderthals" to Next Meeting', confirmation.body)
+        self.assertIn('Authors: Ima Fake0, Ima Fake1', confirmation.body)
+        self.assertEqual(committee.to, PROGRAM_COMMITTEE_EMAILS)
+        self.assertEqual(committee.subject, 'Abstract submission: Silly Walks of the Neanderthals')
+        self.assertIn('Test abstract text about silly walks in Neanderthals.', committee.body)
+
+    def test_slow_mail_server_does_not_delay_submission(self):
+        def unreachable(*args, **kwargs):
+            raise AssertionError('the submit path must not connect to the mail server')
+        with override_settings(EMAIL_BACKEND='django.core.mail.backends.smtp.EmailBackend'):
+            open_connection = SMTPEmailBackend.open
+            SMTPEmailBackend.open = unreachable
+            try:
+                response = self.client.post(reverse('meetings:create_abstract'), abstract_post_data())
+            finally:
+                SMTPEmailBackend.open = open_connection
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(QueuedMessage.objects.filter(status='pending').count(), 2)
+
+    def test_mismatched_emails_are_a_form_error(self):
+        data = dict(abstract_post_data(), confirm_email='someone.else@example.com')
+        response = self.client.post(reverse('meetings:create_abstract'), data)
+        self.assertEqual(response.status_code, 200)
+        self.assertFormError(response, 'form', 'confirm_email', 'Emails do not match')
+        self.assertEqual(QueuedMessage.objects.count(), 0)
+
+
+class QueryBudgetTests(QueryBudgetTestMixin, TestCase):
+    def setUp(self):
+        cache.clear()
+        # authors per abstract vary up to 50, so queries run per abstract or per author overflow the budgets
+        call_command('generate_synthetic_data', meetings=2, abstracts=40, announcements=0, members=0,
+                     stdout=StringIO())
+        self.meeting = Meeting.objects.order_by('year')[0]
+        self.media_root = tempfile.mkdtemp()  # for the stored program book
+        self.settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        self.settings_override.enable()
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.media_root)
+
+    def drop_view_caches(self):
+        for year in Meeting.objects.values_list('year', flat=True):
+            invalidate_meeting_detail(year)
+        cache.delete(CURRENT_MEETING_CACHE_KEY)
+
+    def test_public_views_are_within_budget(self):
+        self.assertWithinQueryBudget(reverse('meetings:meetings'))
+        self.assertWithinQueryBudget(reverse('meetings:meeting_detail', args=[self.meeting.year]))
+        self.assertWithinQueryBudget(reverse('meetings:search') + '?q=fossil')
+        self.assertWithinQueryBudget(reverse('meetings:create_abstract'))
+        self.assertWithinQueryBudget(reverse('meetings:create_abstract'), abstract_post_data(author_count=30))
+        self.assertWithinQueryBudget(reverse('meetings:thanks'))
+
+    def test_admin_views_are_within_budget(self):
+        User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.client.login(username='admin', password='password')
+        changelist = reverse('admin:meetings_abstract_changelist')
+        self.assertWithinQueryBudget(changelist)
+        abstracts = Abstract.objects.filter(meeting=self.meeting)
+        selected = list(abstracts.values_list('pk', flat=True))
+        accepted = list(abstracts.filter(accepted=True).values_list('pk', flat=True))
+        last_accepted = abstracts.filter(accepted=True).last()
+        # the stored program book is served for the accepted abstracts of a meeting, other selections are rendered
+        for action, pks, title in [('create_abstract_csv', selected, last_accepted.title_text),
+                                   ('create_abstract4meeting_html', accepted, last_accepted.title),
+                                   ('create_abstract4meeting_html', selected, last_accepted.title)]:
+            response = self.assertWithinQueryBudget(changelist, {'action': action, '_selected_action': pks,
+                                                                 'index': 0})
+            self.assertIn(title, response.streamed_content if response.streaming else response.content)
+
+
 class AbstractCreateViewTests(TestCase):
     # load test data that includes fiber pages, meetings, abstracts etc.
     fixtures = ['fiber_data_160911.json', 'meetings_data.json']
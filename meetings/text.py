@@ -0,0 +1,89 @@
+"""
+The text pipeline for the rich text fields of abstracts. Abstracts are sanitized, rendered as plain text and
+counted once when they are saved (see the Abstract pre_save receiver in meetings.models), and the stored
+results are used by listings, exports and search.
+"""
+from HTMLParser import HTMLParser
+from django.utils.html import escape
+import re
+
+# tags allowed in abstract text, and the inline subset allowed in titles
+ABSTRACT_TAGS = ['p', 'br', 'em', 'i', 'strong', 'b', 'u', 'sub', 'sup', 'ul', 'ol', 'li', 'blockquote', 'a']
+TITLE_TAGS = ['em', 'i', 'strong', 'b', 'u', 'sub', 'sup']
+VOID_TAGS = ['br']
+DROP_CONTENT_TAGS = ['script', 'style']
+URL_SCHEMES = ('http://', 'https://', 'mailto:')
+WORD_RE = re.compile(r"\w+(?:['\-]\w+)*", re.UNICODE)
+
+
+class Sanitizer(HTMLParser):
+    """
+    Keep the allowed tags, without attributes except safe link targets, and the text of everything else.
+    """
+    def __init__(self, allowed_tags):
+        HTMLParser.__init__(self)
+        self.allowed_tags = allowed_tags
+        self.output = []
+        self.open_tags = []
+        self.dropping = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in DROP_CONTENT_TAGS:
+            self.dropping += 1
+        elif tag in self.allowed_tags and not self.dropping:
+            href = dict(attrs).get('href') or ''
+            if tag == 'a' and href.lower().startswith(URL_SCHEMES):
+                self.output.append('<a href="%s">' % escape(href))
+            else:
+                self.output.append('<%s>' % tag)
+            if tag not in VOID_TAGS:
+                self.open_tags.append(tag)
+
+    def handle_startendtag(self, tag, attrs):
+        if tag in VOID_TAGS:
+            self.handle_starttag(tag, attrs)
+
+    def handle_endtag(self, tag):
+        if tag in DROP_CONTENT_TAGS:
+            self.dropping = max(0, self.dropping - 1)
+        elif tag in self.open_tags:
+            while self.open_tags:  # close any tags left open inside this one
+                open_tag = self.open_tags.pop()
+                self.output.append('</%s>' % open_tag)
+                if open_tag == tag:
+                    break
+
+    def handle_data(self, data):
+        if not self.dropping:
+            self.output.append(escape(data))
+
+    def handle_entityref(self, name):
+        self.handle_data(self.unescape('&%s;' % name))
+
+    def handle_charref(self, name):
+        self.handle_data(self.unescape('&#%s;' % name))
+
+    def close(self):
+        HTMLParser.close(self)
+        self.output.extend('</%s>' % tag for tag in reversed(self.open_tags))
+        self.open_tags = []
+        return ''.join(self.output).strip()
+
+
+def sanitize_html(html, allowed_tags=ABSTRACT_TAGS):
+    sanitizer = Sanitizer(allowed_tags)
+    sanitizer.feed(html or '')
+    return sanitizer.close()
+
+
+def html_to_text(html):
+    """
+    Render html as plain text, with entities decoded and whitespace collapsed.
+    """
+    sanitizer = Sanitizer([])
+    sanitizer.feed(re.sub(r'(?i)<(br|/p|/li|/blockquote)\b', r' \g<0>', html or ''))  # keep words apart
+    return ' '.join(HTMLParser().unescape(sanitizer.close()).split())
+
+
+def word_count(text):
+    return len(WORD_RE.findall(text))
@@ -6,6 +6,8 @@ urlpatterns = patterns('',
                        url(r'^$', views.MeetingsView.as_view(), name='meetings'),
                        # ex /meetings/2013/
                        url(r'^(?P<year>\d{4})/$', views.MeetingsDetailView.as_view(), name='meeting_detail'),
+                       # ex /meetings/search/?q=homo
+                       url(r'^search/$', views.AbstractSearchView.as_view(), name='search'),
                        # ex /meetings/abstract/add/
                        url(r'^abstract/add/$', views.AbstractCreateView.as_view(), name='create_abstract'),
                        # ex /meetings/create_abstact/
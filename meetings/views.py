@@ -1,36 +1,71 @@
 from django.views import generic
 from models import Meeting, Abstract
 from django.core.urlresolvers import reverse
-from fiber.views import FiberPageMixin
+from base.pagecache import CachedFiberPageMixin
+from base.querybudget import QueryBudgetMixin
 from fiber.models import Page
-from forms import AbstractForm, AuthorInlineFormSet
+from forms import AbstractForm, AuthorInlineFormSet, save_abstract_submission
+from emails import enqueue_submission_emails
+from search import search_abstract_ids
 from django.shortcuts import render
-from django.http import HttpResponseRedirect
-from django.core.mail import send_mail
+from django.http import HttpResponse, HttpResponseRedirect, Http404
+from django.db import transaction
+from django.core.cache import cache
+from caching import meeting_detail_cache_key, MEETING_DETAIL_CACHE_TIMEOUT
 
 
-class MeetingsView(FiberPageMixin, generic.ListView):
-    # default template name is 'meetings/meeting_list.html'
+class MeetingsView(QueryBudgetMixin, CachedFiberPageMixin, generic.ListView):
+    # get_queryset returns a list, so the default template and context names cannot be derived from it
+    template_name = 'meetings/meeting_list.html'
+    context_object_name = 'meeting_list'
     model = Meeting
+    query_budget = 5
+
+    def get_queryset(self):
+        """
+        Return the list of meetings, each annotated with the is_public status of its fiber page.
+        The status of every meeting page is fetched with one query rather than one per meeting.
+        """
+        meetings = list(super(MeetingsView, self).get_queryset())
+        page_status = dict(Page.objects.filter(title__in=[meeting.title for meeting in meetings]).
+                           values_list('title', 'is_public'))
+        for meeting in meetings:
+            meeting.detail_is_public = page_status.get(meeting.title, False)
+        return meetings
 
     def get_fiber_page_url(self):
         return reverse('meetings:meetings')
 
 
-class MeetingsDetailView(FiberPageMixin, generic.ListView):
+class MeetingsDetailView(QueryBudgetMixin, CachedFiberPageMixin, generic.ListView):
     template_name = 'meetings/meeting_detail.html'
+    query_budget = 5
 
     def get_queryset(self):
-        # TODO Sort abstracts by lead author last name
-        # send a queryset of Authors?
-        # convert the queryset object into a list of objects and sort that
-        # This needs to be returned in the context not the get_queryset method
-        #abstracts = Abstract.objects.select_related().filter(meeting__year__exact=self.kwargs['year'], accepted__exact=True)
-        #abstract_list = list(abstracts)
-        #abstract_list.sort(key=lambda x: x.author_set.order_by('author_rank')[0].last_name)
         # TODO Add ajax to access absrtact text inline
-        return Abstract.objects.select_related().filter(meeting__year__exact=self.kwargs['year'],
-                                                        accepted__exact=True).order_by('abstract_rank')
+        # Authors are prefetched so the template does not query the author_set for every abstract.
+        # Abstracts with the same rank, or no rank, are sorted by lead author last name.
+        return Abstract.objects.with_authors().select_related('meeting').filter(
+            meeting__year__exact=self.kwargs['year'], accepted__exact=True).order_by('abstract_rank',
+                                                                                     'lead_author_sort')
+
+    def get(self, request, *args, **kwargs):
+        """
+        Serve the rendered page from the cache. The entry is dropped when the meeting, its abstracts or authors,
+        or the fiber pages change. Staff users, who may edit the page inline with fiber, always get a fresh page.
+        """
+        if request.user.is_staff:
+            return super(MeetingsDetailView, self).get(request, *args, **kwargs)
+        key = meeting_detail_cache_key(self.kwargs['year'])
+        cached = cache.get(key)
+        if cached is not None:
+            content, content_type = cached
+            return HttpResponse(content, content_type=content_type)
+        response = super(MeetingsDetailView, self).get(request, *args, **kwargs)
+        response.render()
+        if response.status_code == 200:
+            cache.set(key, (response.content, response['Content-Type']), MEETING_DETAIL_CACHE_TIMEOUT)
+        return response
 
     # Fetch corresponding fiber page content
     # In this view there is a separate fiber page for
@@ -39,9 +74,34 @@ class MeetingsDetailView(FiberPageMixin, generic.ListView):
         return reverse('meetings:meeting_detail', kwargs={'year': self.kwargs['year']})
 
 
-class AbstractThanksView(FiberPageMixin, generic.ListView):
+class AbstractSearchView(QueryBudgetMixin, CachedFiberPageMixin, generic.ListView):
+    template_name = 'meetings/search.html'
+    context_object_name = 'abstract_list'
+    max_results = 100
+    query_budget = 5
+
+    def get_queryset(self):
+        """
+        Return accepted abstracts from all meetings that match the q parameter, best match first.
+        """
+        ids = search_abstract_ids(self.request.GET.get('q', ''), limit=self.max_results, accepted_only=True)
+        abstracts = Abstract.objects.with_authors().select_related('meeting').filter(pk__in=ids)
+        rank = dict((abstract_id, position) for position, abstract_id in enumerate(ids))
+        return sorted(abstracts, key=lambda abstract: rank[abstract.pk])
+
+    def get_context_data(self, **kwargs):
+        context = super(AbstractSearchView, self).get_context_data(**kwargs)
+        context['query'] = self.request.GET.get('q', '')
+        return context
+
+    def get_fiber_page_url(self):
+        return reverse('meetings:meetings')
+
+
+class AbstractThanksView(QueryBudgetMixin, CachedFiberPageMixin, generic.ListView):
     template_name = 'meetings/thanks.html'
     model = Abstract
+    query_budget = 2
 
     def get_fiber_page_url(self):
         return reverse('meetings:thanks')
@@ -50,15 +110,32 @@ class AbstractThanksView(FiberPageMixin, generic.ListView):
 #####################################################################
 ## First pass at Create Abstract View. Needs Author inline formset ##
 #####################################################################
-class AbstractCreateView(FiberPageMixin, generic.CreateView):
+class AbstractCreateView(QueryBudgetMixin, CachedFiberPageMixin, generic.CreateView):
     template_name = 'meetings/abstract.html'
     model = Abstract
     form_class = AbstractForm
     success_url = '/meetings/abstract/thanks/'
+    query_budget = 25  # saves the abstract, its authors, search entry and queued emails in a fixed number of queries
 
     def get_fiber_page_url(self):
         return reverse('meetings:create_abstract')
 
+    def dispatch(self, request, *args, **kwargs):
+        self.meeting = Meeting.objects.current()
+        if self.meeting is None:
+            raise Http404("No meeting is open for abstract submissions")
+        return super(AbstractCreateView, self).dispatch(request, *args, **kwargs)
+
+    def get_form_kwargs(self):
+        kwargs = super(AbstractCreateView, self).get_form_kwargs()
+        kwargs['instance'] = Abstract(meeting=self.meeting, year=self.meeting.year)
+        return kwargs
+
+    def get_context_data(self, **kwargs):
+        context = super(AbstractCreateView, self).get_context_data(**kwargs)
+        context['meeting'] = self.meeting
+        return context
+
     def get(self, request, *args, **kwargs):
         """
         Implementation based on post by Kevin Dias
@@ -88,8 +165,6 @@ class AbstractCreateView(FiberPageMixin, generic.CreateView):
         self.object = None
         form_class = self.get_form_class()
         form = self.get_form(form_class)
-        form.meeting_id = 1
-        form.year = 2016
         author_formset = AuthorInlineFormSet(self.request.POST)
 
         if 'add_authors' in self.request.POST:
@@ -117,16 +192,10 @@ class AbstractCreateView(FiberPageMixin, generic.CreateView):
         :param author_formset:
         :return:
         """
-        self.object = form.save()  # save abstract
-        author_formset.instance = self.object
-        new_authors = author_formset.save(commit=False)
-        rank = 1
-        for author in new_authors:
-            author.author_rank = rank
-            author.abstract = self.object
-            author.save()
-            rank += 1
-
+        with transaction.atomic():
+            self.object = save_abstract_submission(form, author_formset)
+            # queued with the submission and sent by the mail queue worker, no mail server on the submit path
+            enqueue_submission_emails(self.object)
         return HttpResponseRedirect(self.get_success_url())
 
     def form_invalid(self, form, author_formset):
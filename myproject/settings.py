@@ -10,6 +10,8 @@ https://docs.djangoproject.com/en/1.6/ref/settings/
 
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
 import os
+import sys
+import tempfile
 import local_settings
 
 BASE_DIR = os.path.dirname(os.path.dirname(__file__))
@@ -58,14 +60,17 @@ INSTALLED_APPS = (
 )
 
 MIDDLEWARE_CLASSES = (
-    'fiber.middleware.ObfuscateEmailAddressMiddleware',  # fiber middleware needs to be listed first
-    'fiber.middleware.AdminPageMiddleware',
+    'base.middleware.QueryCountMiddleware',  # listed first to count the queries of all the others
+    'base.middleware.ObfuscateEmailAddressMiddleware',  # fiber middleware needs to be listed next
+    'base.middleware.AdminPageMiddleware',
+    'base.middleware.FiberTreeMoveMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'base.middleware.RequestProfileMiddleware',  # listed last, runs the view under cProfile when staff ask for it
 )
 
 ROOT_URLCONF = 'myproject.urls'
@@ -80,9 +85,29 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': os.path.join(BASE_DIR, 'taba.sqlite3'),
+        'CONN_MAX_AGE': 600,  # persistent connections, which keep their sqlite settings
     }
 }
 
+# Run on every new sqlite connection by base.sqlite: wait up to 20 s for the write lock, WAL journaling so
+# readers and the writer do not block each other, and the NORMAL synchronous level, which is safe with WAL.
+SQLITE_PRAGMAS = (('busy_timeout', 20000), ('journal_mode', 'WAL'), ('synchronous', 'NORMAL'))
+
+# Cache
+# The fiber page tree generation (base.pagecache), the meeting detail pages, the current meeting and the active
+# announcements are invalidated by signals in the process that changed them, so all processes must share one
+# cache. The per-process LocMemCache Django uses without CACHES would keep serving stale entries in the other
+# processes. The default is a file cache, which needs nothing installed; memcached is faster where it is
+# available. Test runs use their own directory.
+CACHES = getattr(local_settings, 'CACHES', {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(tempfile.gettempdir(),
+                                 'taba_test_cache' if sys.argv[1:2] == ['test'] else 'taba_cache'),
+        'OPTIONS': {'MAX_ENTRIES': 10000},  # the file cache culls a third of its entries past this
+    }
+})
+
 # Internationalization
 # https://docs.djangoproject.com/en/1.6/topics/i18n/
 
@@ -114,6 +139,15 @@ MEDIA_ROOT = local_settings.MEDIA_ROOT
 # Examples: "http://media.lawrence.com/media/", "http://example.com/media/"
 MEDIA_URL = "/media/"
 
+# Hand media downloads to the web server: 'x-accel-redirect' for nginx, with an internal location at
+# MEDIA_ACCEL_REDIRECT_PREFIX aliased to MEDIA_ROOT, 'x-sendfile' for Apache mod_xsendfile and lighttpd, or
+# None to stream them from Django. See base.media.
+MEDIA_SENDFILE = getattr(local_settings, 'MEDIA_SENDFILE', None)
+MEDIA_ACCEL_REDIRECT_PREFIX = getattr(local_settings, 'MEDIA_ACCEL_REDIRECT_PREFIX', '/protected-media/')
+# Directories under MEDIA_ROOT that are never served at MEDIA_URL, like the program books stored for the admin
+# download (meetings.models.ProgramBook)
+MEDIA_PRIVATE_DIRS = ('meetings/program_books', )
+
 CRSF_COOKIE_SECURE = local_settings.CRSF_COOKIE_SECURE
 SESSION_COOKIE_SECURE = local_settings.SESSION_COOKIE_SECURE
 
@@ -161,6 +195,51 @@ STATICFILES_FINDERS = DEFAULT_SETTINGS.STATICFILES_FINDERS + (
     'compressor.finders.CompressorFinder',
 )
 
+#########################
+## Mail Queue Settings ##
+#########################
+# Messages sent per SMTP connection by the send_queued_mail management command
+MAIL_QUEUE_BATCH_SIZE = 50
+# Maximum messages per second, None for no limit
+MAIL_QUEUE_RATE = None
+# Seconds after which messages claimed by a worker that never finished sending them are queued again
+MAIL_QUEUE_CLAIM_TIMEOUT = 60 * 60
+
+##############################
+## Query Count Log Settings ##
+##############################
+# base.middleware.QueryCountMiddleware logs the queries and database time of every request at INFO, and
+# requests over their view's query budget at WARNING. Test runs log neither, tests check budgets with
+# base.testing.QueryBudgetTestMixin.
+QUERY_LOG_LEVEL = 'ERROR' if sys.argv[1:2] == ['test'] else 'INFO'
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'base.querybudget': {'handlers': ['console'], 'level': QUERY_LOG_LEVEL},
+        'base.banners': {'handlers': ['console'], 'level': 'WARNING'},  # e.g. variant formats PIL cannot save
+    },
+}
+
+#######################################
+## Abstract Submission Mail Settings ##
+#######################################
+# Sender of the submission confirmations, and the program committee, who get a copy of every submission.
+# The messages are queued and sent by the send_queued_mail command, run it with --loop as a worker.
+ABSTRACT_FROM_EMAIL = 'webmaster@paleoanthro.org'
+PROGRAM_COMMITTEE_EMAILS = ['jyellen@nsf.gov', 'deboraho@sas.upenn.edu']
+
+################################
+## Request Profiling Settings ##
+################################
+# Staff requests with the X-Profile header or the _profile query parameter are profiled, see base.profiling.
+# The directory keeps the most recent profiles and must not be served.
+REQUEST_PROFILE_DIR = os.path.join(BASE_DIR, 'profiles')
+REQUEST_PROFILE_KEEP = 50
+
 ####################################
 ## Django Simple Captcha Settings ##
 ####################################
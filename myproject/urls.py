@@ -2,7 +2,8 @@ from django.conf.urls import patterns, include, url
 from django.contrib import admin
 from django.views.generic.base import RedirectView
 from django.conf import settings
-from django.conf.urls.static import static
+from urlparse import urlparse
+import re
 
 admin.autodiscover()
 
@@ -17,6 +18,7 @@ urlpatterns = patterns('',
     url(r'^meetings/', include('meetings.urls', namespace="meetings")),  # note the lack of a terminal dollar sign.
 
     # Admin URLS
+    url(r'^admin/profiles/$', 'base.views.request_profiles', name='request_profiles'),  # before the admin app urls
     url(r'^admin/', include(admin.site.urls)),
     (r'^ckeditor/', include('ckeditor.urls')),  # Rich text widget
     url(r'^captcha/', include('captcha.urls')),  # captcha form challenge
@@ -25,19 +27,20 @@ urlpatterns = patterns('',
     (r'^api/v2/', include('fiber.rest_api.urls')),
     (r'^admin/fiber/', include('fiber.admin_urls')),   # Does this need to be placed above the admin entry?
     (r'^jsi18n/$', 'django.views.i18n.javascript_catalog', {'packages': ('fiber',), }),
-    (r'', 'fiber.views.page'),  # This catches everything not matched above!
+    (r'', 'base.views.page'),  # This catches everything not matched above! Cached fiber.views.page
 
 
 )
 
 """
-The following code insures users uploaded media are served with the development
-server. It will NOT work when settings.DEBUG = False.
-Details available from the Django 1.6 documentation:
-https://docs.djangoproject.com/en/1.6/howto/static-files/
-
-IMPORTANT: One key difference between the paleocore implementation and the documentation
-is that the MEDIA_URL settings are added to the beginning of the url patterns. If appened
-to the end as shown in the documentation the fiber.view.page entry catches and returns 404.
+Uploaded media are served by base.views.serve_media, which supports the range and conditional requests of large
+PDF downloads and can hand the transfer to the web server, see base.media and the MEDIA_SENDFILE setting.
+Deployments may also serve MEDIA_URL from the web server directly.
+
+IMPORTANT: the MEDIA_URL pattern is added to the beginning of the url patterns. If appended to the end
+the fiber.view.page entry catches and returns 404.
 """
-urlpatterns = static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT) + urlpatterns
+if not urlparse(settings.MEDIA_URL).netloc:  # media on another host are not served here
+    urlpatterns = patterns('',
+        url(r'^%s(?P<path>.*)$' % re.escape(settings.MEDIA_URL.lstrip('/')), 'base.views.serve_media', name='media'),
+    ) + urlpatterns